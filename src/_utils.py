@@ -1,33 +1,43 @@
 import string
 import re
 import os
+import io
+import csv
+import gzip
+import bz2
+import lzma
+import zipfile
+import contextlib
 import unicodedata
 import logging
-from datetime import datetime
+import queue
+import threading
+from collections import defaultdict
+from typing import Iterator, List, Optional
 import pandas as pd
+import numpy as np
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow is optional, fall back to the pandas C engine
+    pa = None
+    pa_csv = None
+
+from src.log_config import setup_logging
 
-def setup_logging():
-    """Configure logging to output to both file and console with timestamped filename."""
-    # Create logs directory if it doesn't exist
-    os.makedirs('data/logs', exist_ok=True)
-    
-    # Create timestamp for filename
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    log_filename = f'data/logs/op_cleaner_{timestamp}.log'
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename),
-            logging.StreamHandler()  # This will also print to console
-        ]
-    )
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# Encoding used for every csv read and written by the pipeline (raw OP files,
+# filtered chunks and final tables) so that chunks round-trip unchanged
+CSV_ENCODING = "utf-8"
+CSV_ENGINES = ("auto", "pyarrow", "c")
+# Bytes per pyarrow streaming block; batches are re-sliced to chunksize rows
+ARROW_BLOCK_SIZE = 8 << 20
+# Output compressions and their file extensions. zstd compresses with all cores.
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz", ".zst")
 
 
 def clean_brand_name(token: str) -> str:
@@ -88,31 +98,417 @@ def clean_generic_name(token: str) -> str:
     return token
 
 
-def concatenate_chunks(chunks_dir, fileout):
+def concatenate_chunks(chunks_dir, fileout, engine="auto"):
     """
-    Concatenate all chunks vertically into a single CSV
+    Concatenate all chunks vertically into a single CSV, in chunk number
+    order ("..._chunk_2" before "..._chunk_10")
+    Args:
+        chunks_dir (str): directory containing the csv chunks (plain or compressed)
+        fileout (str): path to the concatenated csv; compressed if it ends
+            with .gz or .zst
+        engine (str): csv parse engine, see resolve_csv_engine
     """
-    # Get all chunk files
-    chunks = os.listdir(chunks_dir)
+    # Get all chunk files, in raw file order (listdir order is arbitrary)
+    chunks = sorted(os.listdir(chunks_dir), key=lambda name: [
+        int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)
+    ])
 
     # If no chunks exist, raise error
     if not chunks:
         raise FileNotFoundError(f"No chunks found in {chunks_dir}")
 
     rows_per_chunk = 0
-    # Write first chunk with header
-    logger.info(f"Processing file {os.path.join(chunks_dir, chunks[0])}")
-    df = pd.read_csv(os.path.join(chunks_dir, chunks[0]), encoding='latin-1', dtype=str)
-    rows_per_chunk = len(df)
-    df.to_csv(fileout, index=False)
-    
-    # Append all other chunks without headers
-    for idx, chunk in enumerate(chunks[1:]):
-        logger.info(f"Processing file {os.path.join(chunks_dir, chunks[idx+1])}")
-        df = pd.read_csv(os.path.join(chunks_dir, chunk), encoding='latin-1', dtype=str)
-        rows_per_chunk += len(df)
-        df.astype(str).to_csv(fileout, mode='a', header=False, index=False)
+    # one output handle, so compressed outputs are a single stream
+    with open_csv_output(fileout) as f:
+        # Write first chunk with header
+        logger.info(f"Processing file {os.path.join(chunks_dir, chunks[0])}")
+        df = read_csv(os.path.join(chunks_dir, chunks[0]), engine=engine)
+        rows_per_chunk = len(df)
+        df.to_csv(f, index=False)
+
+        # Append all other chunks without headers
+        for idx, chunk in enumerate(chunks[1:]):
+            logger.info(f"Processing file {os.path.join(chunks_dir, chunks[idx+1])}")
+            df = read_csv(os.path.join(chunks_dir, chunk), engine=engine)
+            rows_per_chunk += len(df)
+            # missing cells are written empty, as in the first chunk
+            df.to_csv(f, header=False, index=False)
     logger.info("Finished concatenating %s rows", rows_per_chunk)
-    assert rows_per_chunk == len(pd.read_csv(fileout, encoding='latin-1', dtype=str))
+    assert rows_per_chunk == len(read_csv(fileout, engine=engine))
+
+
+def resolve_csv_engine(engine="auto"):
+    """
+    Resolve the csv parse engine to use.
+    Args:
+        engine (str): "auto" (pyarrow if installed, else pandas C), "pyarrow" or "c"
+    Returns:
+        str: "pyarrow" or "c"
+    """
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unsupported csv engine '{engine}', expected one of {CSV_ENGINES}")
+    if engine == "auto":
+        return "pyarrow" if pa_csv is not None else "c"
+    if engine == "pyarrow" and pa_csv is None:
+        raise ImportError("pyarrow is not installed, use engine='c' or engine='auto'")
+    return engine
+
+
+def split_zip_path(path):
+    """
+    Split a path to a csv member of a zip archive, written as if the archive
+    were a directory: "data/raw/PGYR2022_P01302025.zip/OP_DTL_GNRL_PGYR2022_P01302025.csv"
+    Args:
+        path (str): path to check
+    Returns:
+        tuple (zip_path, member), or (None, None) if path is not inside a zip
+    """
+    parts = os.fspath(path).replace(os.sep, "/").split("/")
+    for i, part in enumerate(parts[:-1]):
+        if part.lower().endswith(".zip"):
+            zip_path = "/".join(parts[:i + 1])
+            if os.path.isfile(zip_path):
+                return zip_path, "/".join(parts[i + 1:])
+    return None, None
+
+
+def is_plain_file(path):
+    """True if path is an uncompressed file on disk (not a zip member or .gz/.zst/...)."""
+    return split_zip_path(path)[0] is None and not os.fspath(path).lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is not installed, it is needed for .zst files") from None
+    return zstandard
+
+
+def open_csv_source(path):
+    """
+    Open a csv source for binary reading: plain files, zip members (see
+    split_zip_path) and .gz/.bz2/.xz/.zst files, decompressed on the fly.
+    Args:
+        path (str): path to csv source
+    Returns:
+        binary file object
+    """
+    zip_path, member = split_zip_path(path)
+    if zip_path is not None:
+        # the member stream keeps the archive file open until it is closed
+        return zipfile.ZipFile(zip_path).open(member)
+    lower = os.fspath(path).lower()
+    if lower.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if lower.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if lower.endswith(".xz"):
+        return lzma.open(path, "rb")
+    if lower.endswith(".zst"):
+        return _zstd().ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return open(path, "rb")
+
+
+def csv_compression(path):
+    """
+    Get the to_csv compression options for an output path, from its extension:
+    gzip at a fast level, or multi-threaded zstd. None for plain csv.
+    """
+    lower = os.fspath(path).lower()
+    if lower.endswith(".gz"):
+        return {"method": "gzip", "compresslevel": 1, "mtime": 0}
+    if lower.endswith(".zst"):
+        return {"method": "zstd", "level": 3, "threads": -1}
+    return None
+
+
+def compressed_path(path, compression=None):
+    """
+    Add the file extension of compression ("gzip", "zstd" or None) to path.
+    """
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression '{compression}', expected one of {list(COMPRESSION_EXTENSIONS)}")
+    return f"{path}{COMPRESSION_EXTENSIONS[compression]}"
+
+
+def write_csv(df, path, **kwargs):
+    """
+    Write df with the pipeline's csv defaults (no index, CSV_ENCODING),
+    compressed according to path's extension (see csv_compression).
+    """
+    kwargs.setdefault("index", False)
+    kwargs.setdefault("encoding", CSV_ENCODING)
+    kwargs.setdefault("compression", csv_compression(path))
+    df.to_csv(path, **kwargs)
+
+
+@contextlib.contextmanager
+def open_csv_output(path):
+    """
+    Open a text handle for writing a csv in several pieces (header first,
+    then rows), compressed according to path's extension. Compressed outputs
+    are one gzip member / zstd frame rather than one per appended piece.
+    Yields:
+        text file object
+    """
+    lower = os.fspath(path).lower()
+    if lower.endswith(".gz"):
+        raw = gzip.GzipFile(path, "wb", compresslevel=1, mtime=0)
+    elif lower.endswith(".zst"):
+        raw = _zstd().ZstdCompressor(level=3, threads=-1).stream_writer(open(path, "wb"), closefd=True)
+    else:
+        raw = open(path, "wb")
+    with io.TextIOWrapper(raw, encoding=CSV_ENCODING, newline="") as f:
+        yield f
+
+
+def read_csv_header(path, encoding=CSV_ENCODING) -> List[str]:
+    """
+    Read only the header row of a csv file.
+    Args:
+        path (str): path to csv source (plain, compressed or zip member)
+        encoding (str): file encoding
+    Returns:
+        list: column names, in file order
+    """
+    with io.TextIOWrapper(open_csv_source(path), encoding=encoding, newline='') as f:
+        return next(csv.reader(f), [])
+
+
+@contextlib.contextmanager
+def _csv_input(path):
+    """
+    Both engines read plain and compressed files from their path; zip members
+    are handed over as an open stream. File objects are passed through.
+    """
+    if hasattr(path, "read") or split_zip_path(path)[0] is None:
+        yield path
+    else:
+        with open_csv_source(path) as f:
+            yield f
+
+
+def _arrow_column_types(columns, dtype):
+    """
+    Translate a pandas dtype (str or dict of column -> dtype) into pyarrow
+    column types. Columns not in a dtype dict are read as strings, like the
+    rest of the pipeline.
+    """
+    if dtype is str or dtype == "str":
+        return {col: pa.string() for col in columns}
+    column_types = {}
+    for col in columns:
+        col_dtype = dtype.get(col, str)
+        if col_dtype is str or col_dtype == "str":
+            column_types[col] = pa.string()
+        else:
+            column_types[col] = pa.from_numpy_dtype(np.dtype(col_dtype))
+    return column_types
+
+
+def _pandas_dtype(dtype):
+    """Columns not in a dtype dict are read as strings, same as with pyarrow."""
+    if isinstance(dtype, dict):
+        return defaultdict(lambda: str, dtype)
+    return dtype
+
+
+def _arrow_options(path, encoding, usecols, dtype, header):
+    if header is None:
+        header = read_csv_header(path, encoding)
+    read_options = pa_csv.ReadOptions(encoding=encoding, block_size=ARROW_BLOCK_SIZE)
+    # OP text fields may hold quoted newlines, which must not end a block
+    parse_options = pa_csv.ParseOptions(newlines_in_values=True)
+    convert_options = pa_csv.ConvertOptions(
+        column_types=_arrow_column_types(header, dtype),
+        # keep file order, like pandas usecols
+        include_columns=[col for col in header if col in set(usecols)] if usecols is not None else None,
+        strings_can_be_null=True,
+    )
+    return read_options, parse_options, convert_options
+
+
+def _arrow_to_frame(table, start=0) -> pd.DataFrame:
+    df = table.to_pandas()
+    # row labels continue across chunks, same as pandas' chunked reader
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+
+def read_csv(path, engine="auto", encoding=CSV_ENCODING, usecols=None, dtype=str, header=None) -> pd.DataFrame:
+    """
+    Read a full csv file with the selected parse engine. pyarrow parses with
+    multiple threads; the pandas C engine is the fallback.
+    Args:
+        path (str): path to csv file
+        engine (str): "auto", "pyarrow" or "c"
+        encoding (str): file encoding
+        usecols (list): optional subset of columns to load
+        dtype: str (all columns as strings) or dict of column -> dtype
+        header (list): header already read with read_csv_header, if any
+    Returns:
+        pd.DataFrame
+    """
+    engine = resolve_csv_engine(engine)
+    if engine == "c" or hasattr(path, "read"):
+        with _csv_input(path) as source:
+            return pd.read_csv(source, engine="c", encoding=encoding, usecols=usecols, dtype=_pandas_dtype(dtype))
+    read_options, parse_options, convert_options = _arrow_options(path, encoding, usecols, dtype, header)
+    with _csv_input(path) as source:
+        table = pa_csv.read_csv(
+            source, read_options=read_options, parse_options=parse_options, convert_options=convert_options
+        )
+    return _arrow_to_frame(table)
+
+
+def iter_csv_chunks(
+        path,
+        chunksize=100_000,
+        engine="auto",
+        encoding=CSV_ENCODING,
+        usecols=None,
+        dtype=str,
+        header=None
+        ) -> Iterator[pd.DataFrame]:
+    """
+    Stream a csv file in chunks of chunksize rows. With pyarrow, uses the
+    streaming batch reader and re-slices its batches into chunksize rows.
+    Args:
+        path (str): path to csv file
+        chunksize (int): rows per chunk
+        engine (str): "auto", "pyarrow" or "c"
+        encoding (str): file encoding
+        usecols (list): optional subset of columns to load
+        dtype: str (all columns as strings) or dict of column -> dtype
+        header (list): header already read with read_csv_header, if any
+    Yields:
+        pd.DataFrame: chunk with row labels continuing across chunks
+    """
+    engine = resolve_csv_engine(engine)
+    if engine == "c":
+        with _csv_input(path) as source:
+            yield from pd.read_csv(
+                source, chunksize=chunksize, engine="c", encoding=encoding, usecols=usecols, dtype=_pandas_dtype(dtype)
+                )
+        return
+
+    read_options, parse_options, convert_options = _arrow_options(path, encoding, usecols, dtype, header)
+    with _csv_input(path) as source:
+        yield from _iter_arrow_chunks(source, chunksize, read_options, parse_options, convert_options)
+
+
+def _iter_arrow_chunks(source, chunksize, read_options, parse_options, convert_options):
+    reader = pa_csv.open_csv(
+        source, read_options=read_options, parse_options=parse_options, convert_options=convert_options
+    )
+    pending = []
+    pending_rows = 0
+    start = 0
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunksize:
+            table = pa.Table.from_batches(pending, schema=reader.schema)
+            yield _arrow_to_frame(table.slice(0, chunksize), start)
+            start += chunksize
+            rest = table.slice(chunksize)
+            pending = rest.to_batches()
+            pending_rows = rest.num_rows
+    if pending_rows:
+        yield _arrow_to_frame(pa.Table.from_batches(pending, schema=reader.schema), start)
+
+
+_END = object()
+
+
+def prefetch(iterable, maxsize=2):
+    """
+    Iterate over iterable in a background thread, keeping up to maxsize items
+    ready, e.g. to parse the next csv chunk while the current one is matched.
+    Exceptions raised by iterable are re-raised in the consuming thread.
+    Args:
+        iterable: any iterable (e.g. iter_csv_chunks)
+        maxsize (int): bound on items read ahead
+    Yields:
+        items of iterable, in order
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # give up when the consumer stopped early, instead of blocking forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except BaseException as e:
+            put((_END, e))
+
+    thread = threading.Thread(target=produce, name="csv-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class CsvChunkWriter:
+    """
+    Write DataFrames to csv in a background thread, through a bounded queue,
+    so serialization and disk writes overlap with the caller's work.
+    Usage:
+        writer = CsvChunkWriter()
+        writer.write(df, path)
+        writer.close()  # waits for pending writes, re-raises write errors
+    """
+
+    def __init__(self, maxsize=2):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="csv-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if self._error is not None:
+                # drain the queue after a failure so write() never blocks
+                continue
+            df, path, kwargs = item
+            try:
+                write_csv(df, path, **kwargs)
+            except BaseException as e:
+                self._error = e
 
+    def write(self, df, path, **kwargs):
+        """Queue write_csv(df, path, **kwargs)."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put((df, path, kwargs))
 
+    def close(self):
+        """Wait for all queued writes, then re-raise the first write error, if any."""
+        self._queue.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,156 @@
+import logging
+import sqlite3
+
+import pandas as pd
+
+from src._utils import (
+    read_csv_header,
+    iter_csv_chunks,
+)
+from src.analytics_store import _quote
+
+logger = logging.getLogger(__name__)
+
+# Dimensions of the cubes (besides Year), as harmonized by grace_cols.csv
+CUBE_DIMS = [
+    'Drug_Name',
+    'Onc_Prescriber',
+    'Applic_Manuf_or_GPO_Paying_Name',
+    'Recipient_State',
+]
+AMOUNT_COL = 'Total_Amt_of_Payment_USDollars'
+# Measures: sum and count of the payment amounts, and count of records
+MEASURES = ['Total_Amount', 'Amount_Count', 'Record_Count']
+YEAR_COL = 'Year'
+
+
+def get_cube_table(dataset_type):
+    """Cube table of a dataset type, one slice per Year."""
+    if dataset_type not in ("general", "research"):
+        raise ValueError(f"Unsupported dataset_type '{dataset_type}'")
+    return f"{dataset_type}_cube"
+
+
+def build_cube(path, chunksize=200_000):
+    """
+    Aggregate a final table to the CUBE_DIMS grain in one streaming pass:
+    each chunk is grouped, and the (small) partial aggregates are combined.
+    Empty dimension values form their own group.
+    Args:
+        path (str): final table written by clean_op_data
+        chunksize (int): rows per chunk
+    Returns:
+        pd.DataFrame: cols CUBE_DIMS + MEASURES
+    """
+    columns = read_csv_header(path)
+    dims = [col for col in CUBE_DIMS if col in columns]
+    missing = [col for col in CUBE_DIMS if col not in columns]
+    if missing:
+        logger.warning("%s has no %s, left empty in the cube", path, missing)
+    usecols = dims + ([AMOUNT_COL] if AMOUNT_COL in columns else [])
+
+    partials = []
+    for chunk in iter_csv_chunks(path, chunksize=chunksize, usecols=usecols):
+        amounts = pd.to_numeric(chunk[AMOUNT_COL], errors='coerce') if AMOUNT_COL in chunk else None
+        chunk = chunk[dims].assign(
+            Total_Amount=amounts if amounts is not None else 0.0,
+            Amount_Count=amounts.notna().astype('int64') if amounts is not None else 0,
+            Record_Count=1,
+        )
+        partials.append(_rollup(chunk, dims))
+    if not partials:
+        return pd.DataFrame(columns=CUBE_DIMS + MEASURES)
+    return _rollup(pd.concat(partials, ignore_index=True), dims).reindex(columns=CUBE_DIMS + MEASURES)
+
+
+def _rollup(df, dims):
+    """Sum the measures of df by dims (empty values are a group)."""
+    if not dims:
+        return df[MEASURES].sum().to_frame().T
+    return df.groupby(dims, dropna=False, sort=False)[MEASURES].sum(min_count=0).reset_index()
+
+
+def update_cube(db_path, path, dataset_type, year, chunksize=200_000):
+    """
+    Build the cube of one final table and store it as the year's slice of
+    the dataset type's cube table, replacing only that year's previous rows,
+    in a single transaction.
+    Args:
+        db_path (str): path to the SQLite cube store
+        path (str): final table written by clean_op_data
+        dataset_type (str): "general" or "research"
+        year (int): year of the final table
+        chunksize (int): rows per chunk
+    Returns:
+        int: number of cube cells stored
+    """
+    table = get_cube_table(dataset_type)
+    cube = build_cube(path, chunksize)
+    cube.insert(0, YEAR_COL, int(year))
+    columns = [YEAR_COL] + CUBE_DIMS + MEASURES
+    col_defs = ", ".join(
+        [f"{_quote(YEAR_COL)} INTEGER NOT NULL"]
+        + [f"{_quote(col)} TEXT" for col in CUBE_DIMS]
+        + [f"{_quote(col)} REAL" for col in MEASURES]
+    )
+    con = sqlite3.connect(db_path)
+    try:
+        with con:
+            con.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({col_defs})")
+            con.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{table}_{YEAR_COL}')} ON {_quote(table)} ({_quote(YEAR_COL)})")
+            con.execute(f"DELETE FROM {_quote(table)} WHERE {_quote(YEAR_COL)} = ?", (int(year),))
+            # empty cells are stored as NULL
+            values = cube[columns].astype(object).where(cube[columns].notna(), None)
+            con.executemany(
+                f"INSERT INTO {_quote(table)} VALUES ({', '.join(['?'] * len(columns))})",
+                values.itertuples(index=False, name=None),
+            )
+    finally:
+        con.close()
+    logger.info("Stored %s cube cells for %s %s", len(cube), dataset_type, year)
+    return len(cube)
+
+
+def query_cube(db_path, dataset_type, by, years=None, where=None):
+    """
+    Roll the cube up to the `by` dimensions, without reading row-level data.
+    Args:
+        db_path (str): path to the SQLite cube store
+        dataset_type (str): "general" or "research"
+        by (list): dimensions to group by, from Year and CUBE_DIMS
+            (e.g. ['Year', 'Drug_Name']); [] for the grand total
+        years (iterable): only these years (default: all)
+        where (dict): dimension -> value or list of values to keep,
+            e.g. {'Onc_Prescriber': '1'}
+    Returns:
+        pd.DataFrame: by + MEASURES + Average_Amount (Total_Amount / Amount_Count)
+    """
+    dims = [YEAR_COL] + CUBE_DIMS
+    where = dict(where or {})
+    if years is not None:
+        where[YEAR_COL] = [int(year) for year in years]
+    unknown = [col for col in list(by) + list(where) if col not in dims]
+    if unknown:
+        raise ValueError(f"Unknown cube dimensions {unknown}, expected some of {dims}")
+
+    conditions, params = [], []
+    for col, values in where.items():
+        values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        conditions.append(f"{_quote(col)} IN ({', '.join(['?'] * len(values))})")
+        params.extend(values)
+    select = [_quote(col) for col in by] + [f"SUM({_quote(col)}) AS {_quote(col)}" for col in MEASURES]
+    sql = f"SELECT {', '.join(select)} FROM {_quote(get_cube_table(dataset_type))}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if by:
+        group = ", ".join(_quote(col) for col in by)
+        sql += f" GROUP BY {group} ORDER BY {group}"
+
+    con = sqlite3.connect(db_path)
+    try:
+        result = pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+    result[['Amount_Count', 'Record_Count']] = result[['Amount_Count', 'Record_Count']].fillna(0).astype('int64')
+    result['Average_Amount'] = result['Total_Amount'] / result['Amount_Count'].where(result['Amount_Count'] > 0)
+    return result
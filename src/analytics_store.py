@@ -0,0 +1,119 @@
+import logging
+import sqlite3
+
+import pandas as pd
+
+from src._utils import (
+    read_csv_header,
+    iter_csv_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+# Columns stored as numbers (SQLite REAL affinity) so aggregates need no casts
+NUMERIC_COLS = [
+    'Total_Amt_of_Payment_USDollars',
+    'Num_Payments_Included_Total_Amt',
+]
+# Columns indexed in every table, when present
+INDEX_COLS = [
+    'Covered_Recipient_NPI',
+    'Drug_Name',
+    'Onc_Prescriber',
+]
+# Partition column added to every table
+YEAR_COL = 'Year'
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_table_name(dataset_type):
+    """
+    Get the store table for a dataset type: one table per dataset type,
+    partitioned by the Year column.
+    Args:
+        dataset_type (str): "general" or "research"
+    Returns:
+        str: table name
+    """
+    if dataset_type not in ("general", "research"):
+        raise ValueError(f"Unsupported dataset_type '{dataset_type}'")
+    return f"{dataset_type}_payments"
+
+
+def _ensure_table(con, table, columns):
+    """Create table, or add the columns it is missing (schemas differ across years)."""
+    col_types = {col: ("REAL" if col in NUMERIC_COLS else "TEXT") for col in columns}
+    existing = [row[1] for row in con.execute(f"PRAGMA table_info({_quote(table)})")]
+    if not existing:
+        col_defs = ", ".join([f"{_quote(YEAR_COL)} INTEGER NOT NULL"] + [f"{_quote(col)} {col_types[col]}" for col in columns])
+        con.execute(f"CREATE TABLE {_quote(table)} ({col_defs})")
+    else:
+        for col in columns:
+            if col not in existing:
+                con.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)} {col_types[col]}")
+
+    con.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{table}_{YEAR_COL}')} ON {_quote(table)} ({_quote(YEAR_COL)})")
+    for col in INDEX_COLS:
+        if col in columns or col in existing:
+            con.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{table}_{col}')} "
+                f"ON {_quote(table)} ({_quote(YEAR_COL)}, {_quote(col)})"
+            )
+
+
+def load_final_file(db_path, path, dataset_type, year, chunksize=100_000):
+    """
+    Bulk-load one cleaned year into the store. Reloading a year replaces its
+    previous rows (upsert by year partition), in a single transaction.
+    Args:
+        db_path (str): path to the SQLite store
+        path (str): path to final table written by clean_op_data
+        dataset_type (str): "general" or "research"
+        year (int): year of the final table
+        chunksize (int): rows per insert batch
+    Returns:
+        int: number of rows loaded
+    """
+    table = get_table_name(dataset_type)
+    columns = read_csv_header(path)
+    insert = (
+        f"INSERT INTO {_quote(table)} ({', '.join(_quote(col) for col in [YEAR_COL] + columns)}) "
+        f"VALUES ({', '.join(['?'] * (len(columns) + 1))})"
+    )
+    n_rows = 0
+    con = sqlite3.connect(db_path)
+    try:
+        with con:
+            _ensure_table(con, table, columns)
+            con.execute(f"DELETE FROM {_quote(table)} WHERE {_quote(YEAR_COL)} = ?", (int(year),))
+            for chunk in iter_csv_chunks(path, chunksize=chunksize, header=columns):
+                chunk.insert(0, YEAR_COL, int(year))
+                # empty cells are stored as NULL
+                values = chunk.astype(object).where(chunk.notna(), None)
+                con.executemany(insert, values.itertuples(index=False, name=None))
+                n_rows += len(chunk)
+    finally:
+        con.close()
+    logger.info("Loaded %s rows into %s for %s", n_rows, table, year)
+    return n_rows
+
+
+def query_store(db_path, sql, params=()):
+    """
+    Run a query against the store.
+    Args:
+        db_path (str): path to the SQLite store
+        sql (str): query, e.g. 'SELECT "Drug_Name", SUM("Total_Amt_of_Payment_USDollars")
+            FROM general_payments WHERE "Year" = ? GROUP BY 1'
+        params (tuple): query parameters
+    Returns:
+        pd.DataFrame: query result
+    """
+    con = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
@@ -2,16 +2,79 @@ import os
 import pandas as pd
 import json
 import logging
+import difflib
+import functools
 import numpy as np
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional, Tuple
 from src._utils import (
-    setup_logging,
     clean_brand_name,
     clean_generic_name,
+    read_csv,
+    read_csv_header,
+    iter_csv_chunks,
+    open_csv_output,
+    compressed_path,
+    write_csv,
 )
+from src.aggregate_cubes import update_cube
+from src.analytics_store import load_final_file
+from src.partitioned_dataset import get_partition_dir, write_partition
+from src.recipients import RECIPIENT_COLS, RECIPIENT_ROLES, melt_recipients, rows_with_npi_in
+from src.typed_output import get_typed_path, write_typed_table
+from src.match_cache import MatchCache
+from src.npi_recovery import ProfileNpiIndex, load_profile_npi_index, recover_npis
+from src.npi_validation import quarantine_invalid_npis, NPI_COLS
+from src.paths import RAW_DIR, REF_PATH, get_final_path, get_op_raw_path
 
-setup_logging()
 logger = logging.getLogger(__name__)    
 
+# (drug column, device column) pairs merged into Drug_Biological_Device_Med_Sup_1..5
+MERGE_COLS_2014_2015 = [
+    (f"Name_of_Associated_Covered_Drug_or_Biological{i}", f"Name_of_Associated_Covered_Device_or_Medical_Supply{i}")
+    for i in range(1, 6)
+]
+# Raw CMS headers per year (one column per year, like grace_cols.csv), saved next to grace_cols.csv
+RAW_COLS_NAME = "raw_cols.csv"
+
+
+def enable_copy_on_write():
+    """
+    Turn on pandas Copy-on-Write for the whole process: row filters, column
+    selections and assign then share data with their source until written
+    to, so the cleaning steps below never copy the whole frame. The option
+    is global, so it is set once at the pipeline's entry point (main.main),
+    before any stage thread starts; without it the results are the same,
+    only with more copies.
+    """
+    pd.set_option("mode.copy_on_write", True)
+
+
+def _strip_decimal(x):
+    try:
+        return str(int(float(x)))
+    except (ValueError, OverflowError):
+        # not a number (e.g. a malformed NPI, quarantined later): left as it is
+        return x
+
+
+def _strip_decimals(values):
+    """
+    Remove decimals from numbers stored as strings or floats ("123.0" -> "123"),
+    the vectorized form of str(int(float(x))) for non-empty values. Converts
+    each distinct value once; empty and nan values, and values that aren't
+    numbers, are left as they are.
+    Args:
+        values (pd.Series): values to convert
+    Returns:
+        pd.Series: converted values, same index
+    """
+    codes, uniques = pd.factorize(values)
+    converted = np.array([_strip_decimal(x) if str(x).strip() != '' else x for x in uniques] + [None], dtype=object)
+    # code -1 is a missing value, kept as it is
+    result = np.where(codes >= 0, converted[codes], values.to_numpy(dtype=object))
+    return pd.Series(result, index=values.index, name=values.name)
 
 def build_map_year2cols(dataset_type, path_to_cols):
     """
@@ -22,7 +85,8 @@ def build_map_year2cols(dataset_type, path_to_cols):
         dict: year to list of column names
     """
     year2cols = {}
-    grace_cols = pd.read_csv(path_to_cols)
+    # pandas engine: grace_cols.csv has blank header cells that pandas names 'Unnamed: N'
+    grace_cols = read_csv(path_to_cols, engine="c")
     years = grace_cols.columns
     for year in years:
         year2cols[year] = grace_cols[year].dropna().to_list()
@@ -38,7 +102,7 @@ def build_ref_data_maps(ref_path):
         tuple (brand2generic, brand2color): dicts of brand names to generic names and color
     """
     # load ProstateDrugList.csv
-    ref_df = pd.read_csv(ref_path)
+    ref_df = read_csv(ref_path)
     brand2generic = {}
     brand2color = {}
     # keys: values in column 'Generic_name', values: value in Brand_name1, Brand_name2, Brand_name3, Brand_name4 for that row
@@ -74,8 +138,8 @@ def harmonize_col_names(df, year, dataset_type, path_to_harmonized_cols):
     Returns:
         pd.DataFrame: df with column names changed to harmonized names
     """
-    # Get map of year2cols
-    year2cols = build_map_year2cols(dataset_type, path_to_harmonized_cols)
+    # Get map of year2cols (parsed once per grace_cols.csv version)
+    year2cols = _load_year2cols(path_to_harmonized_cols)
     df.columns = year2cols[str(year)]
     return df
 
@@ -130,68 +194,52 @@ def is_onc_prescriber(prostate_drug_type, recipient_npis, npi_set):
         raise ValueError("Unsupported value type in 'Prostate_Drug_Type' (1/0)")
 
 
-def add_new_columns(df, drug_cols, npi_set, dataset_type):
+def add_new_columns(df, drug_cols, npi_set, dataset_type, ref_path=REF_PATH, cache=None):
     """
     Adds new columns to filtered OP file: Drug_Name, Prostate_Drug_Type, Onc_Prescriber.
-    Applies clean_brand_name to drug_name in drug_cols for each row of df.
+    Applies clean_brand_name to the drug names in drug_cols, once per distinct
+    drug string. The first drug column (in drug_cols order) with a target
+    drug sets the new columns; rows without one are left empty.
     Args:
         df (pd.DataFrame): filtered OP file
         drug_cols (list): list of OP file's drug column names
         npi_set (list): unique NPIs gathered from prescribers database
         dataset_type (str): "general" or "research"
+        ref_path (str): path to ProstateDrugList.csv
+        cache (MatchCache): cache of drug string decisions (in-memory if None)
     Returns:
         pd.DataFrame: filtered OP df with new columns added 
     """
-    brand2generic, brand2color = build_ref_data_maps("data/reference/ProstateDrugList.csv")
-
-    for idx, row in df.iterrows():
-        # iterate through drug_cols
-        for col in drug_cols:
-            drug_name = str(row[col])
-            if pd.isna(drug_name) or drug_name == 'nan':
-                continue
-            elif drug_name == '':
-                continue
-
-            drug_name = clean_brand_name(drug_name)
-            
-            # skip drug names not in our target set
-            try:
-                generic_name = brand2generic[drug_name]
-            except KeyError:
-                continue
-
-            # add Drug_Name
-            df.at[idx, 'Drug_Name'] = generic_name
-
-            # add Prostate_Drug_Type
-            df.at[idx, 'Prostate_Drug_Type'] = get_prostate_drug_type(drug_name, brand2color)
-
-            recipient_npis= []
-            # add Onc_Prescriber col:
-            if dataset_type == "general":
-                recipient_npis.append(df.at[idx, 'Covered_Recipient_NPI'])
-            else:
-                new_npi_cols = [
-                    'Covered_Recipient_NPI',
-                    'PI_1_NPI',
-                    'PI_2_NPI',
-                    'PI_3_NPI',
-                    'PI_4_NPI',
-                    'PI_5_NPI'
-                ]
-                for npi_col in new_npi_cols:
-                    recipient_npis.append(df.at[idx, npi_col])
-                # remove empty strings
-                recipient_npis = [npi for npi in recipient_npis if npi != '']
-            result = is_onc_prescriber(df.at[idx, 'Prostate_Drug_Type'], recipient_npis, npi_set)
-            df.at[idx, 'Onc_Prescriber'] = result
-        
-            # break loop because we are keeping the first drug name found in our target list
-            break
-    return df
-
-def prep_general_data(df, filename, dir_missing_npis):
+    if cache is None:
+        cache = MatchCache(ref_path)
+
+    generic_names = pd.Series(np.nan, index=df.index, dtype=object)
+    colors = pd.Series(np.nan, index=df.index, dtype=object)
+    for col in drug_cols:
+        matches = cache.match(df[col])
+        # keep the first drug name found in our target list
+        first = generic_names.isna() & matches['Generic_Name'].notna()
+        generic_names[first] = matches.loc[first, 'Generic_Name']
+        colors[first] = matches.loc[first, 'Color']
+    matched = generic_names.notna()
+
+    # one join of the long recipient table (all NPI columns) on npi_set
+    npi_set = set(npi_set)
+    npi_set.discard('')
+    in_npi_set = pd.Series(rows_with_npi_in(melt_recipients(df, dataset_type), len(df), npi_set), index=df.index)
+
+    # see get_prostate_drug_type and is_onc_prescriber
+    prostate_drug_type = (colors == 'yellow').astype(float)
+    onc_prescriber = ((prostate_drug_type == 1) & in_npi_set).astype(float)
+    new_columns = pd.DataFrame({
+        'Drug_Name': generic_names,
+        'Prostate_Drug_Type': prostate_drug_type.where(matched),
+        'Onc_Prescriber': onc_prescriber.where(matched),
+    })
+    # one concat, not one insert per column: harmonized frames hold a block per column
+    return pd.concat([df.drop(columns=new_columns.columns, errors='ignore'), new_columns], axis=1)
+
+def prep_general_data(df, filename, dir_missing_npis, append=False):
     """
     Drops rows where Covered_Recipient_NPI is nan and cleans NPIs by removing 
     any decimals if present. Saves dropped rows to csv in dir_missing_npis.
@@ -199,21 +247,21 @@ def prep_general_data(df, filename, dir_missing_npis):
         df (pd.DataFrame): OP df to prep
         filename (str): filename to use when saving dropped rows to csv
         dir_missing_npis (str): directory to save dropped rows to
+        append (bool): append dropped rows to the file (no header), for chunks
     Returns:
         pd.DataFrame: OP df with rows dropped where Covered_Recipient_NPI is nan
     """
     # Drop rows where Covered_Recipient_NPI is nan
     npi_missing = df[df['Covered_Recipient_NPI'].isna()]
     # save dropped rows to csv
-    npi_missing.to_csv(f"{dir_missing_npis}{filename}", index=False)
+    write_csv(npi_missing, f"{dir_missing_npis}{filename}", mode='a' if append else 'w', header=not append)
     
-    # Drop nan NPI rows from the original DataFrame and create a copy
-    df = df[df['Covered_Recipient_NPI'].notna()].copy()
-    # remove the decimal if present in NPIs
-    df['Covered_Recipient_NPI'] = df['Covered_Recipient_NPI'].astype(float).astype(int).astype(str)
-    return df
+    # Drop nan NPI rows from the original DataFrame
+    df = df[df['Covered_Recipient_NPI'].notna()]
+    # remove the decimal if present in NPIs (assign shares the other columns with Copy-on-Write)
+    return df.assign(Covered_Recipient_NPI=_strip_decimals(df['Covered_Recipient_NPI']))
 
-def prep_research_data(df, filename, dir_missing_npis):
+def prep_research_data(df, filename, dir_missing_npis, append=False):
     """
     Drops rows where NPI val is nan in all NPI cols and cleans NPIs by removing 
     any decimals if present. Saves dropped rows to csv in dir_missing_npis.
@@ -221,6 +269,7 @@ def prep_research_data(df, filename, dir_missing_npis):
         df (pd.DataFrame): OP df to prep
         filename (str): filename to use when saving dropped rows to csv
         dir_missing_npis (str): directory to save dropped rows to
+        append (bool): append dropped rows to the file (no header), for chunks
     Returns:
         pd.DataFrame: OP df with rows dropped where NPI val is nan in all NPI cols
     """
@@ -230,16 +279,17 @@ def prep_research_data(df, filename, dir_missing_npis):
     rows_all_na = df[npi_cols].isna().all(axis=1)
     npi_missing = df[rows_all_na]
     # save dropped rows to csv
-    npi_missing.to_csv(f"{dir_missing_npis}{filename}", index=False)
+    write_csv(npi_missing, f"{dir_missing_npis}{filename}", mode='a' if append else 'w', header=not append)
 
     # Drop nan NPI rows from the original DataFrame
-    df = df.dropna(subset=npi_cols, how='all').copy()
-    # remove the decimal if present in NPIs
-    for col in npi_cols:
-        df[col] = df[col].apply(
-            lambda x: str(int(float(x))) if pd.notna(x) and str(x).strip() != '' else x
-            )
-    return df
+    df = df[~rows_all_na]
+    # remove the decimal if present in NPIs (assign shares the other columns with Copy-on-Write)
+    return df.assign(**{col: _strip_decimals(df[col]) for col in npi_cols})
+
+
+def _coalesce(primary, fallback):
+    """Take fallback where primary is empty or nan, same as replace('', NA).fillna(fallback)."""
+    return primary.mask(primary.isna() | (primary == ""), fallback)
 
 
 def merge_cols_2014_2015(df):
@@ -257,13 +307,190 @@ def merge_cols_2014_2015(df):
         pd.DataFrame: OP df with drug columns merged
     """
     # 1. Merge drug columns
-    for i in range(1, 6):
-        df[f"Drug_Biological_Device_Med_Sup_{i}"] = df[f"Name_of_Associated_Covered_Drug_or_Biological{i}"].replace("", pd.NA).fillna(
-            df[f"Name_of_Associated_Covered_Device_or_Medical_Supply{i}"]
+    merged = {}
+    for i, (drug_col, device_col) in enumerate(MERGE_COLS_2014_2015, start=1):
+        merged[f"Drug_Biological_Device_Med_Sup_{i}"] = _coalesce(df[drug_col], df[device_col])
+    # 2. Drop original columns and add the merged ones, in one step each
+    sources = [col for pair in MERGE_COLS_2014_2015 for col in pair]
+    return pd.concat([df.drop(columns=sources), pd.DataFrame(merged, index=df.index)], axis=1)
+
+
+class SchemaMismatchError(ValueError):
+    """Raised when a raw OP header doesn't match grace_cols.csv for its year."""
+
+
+@dataclass(frozen=True)
+class SchemaPlan:
+    """
+    Compiled harmonization of one raw OP header: for every harmonized column,
+    the raw column position it comes from and, for the 2014-2015 merged drug
+    columns, the position of the fallback column.
+    Built by compile_schema_plan; apply it with SchemaPlan.apply.
+    """
+    dataset_type: str
+    year: int
+    raw_cols: Tuple[str, ...]
+    harmonized_cols: Tuple[str, ...]
+    sources: Tuple[Tuple[int, Optional[int]], ...]
+
+    def apply(self, df):
+        """
+        Coalesce, drop and rename in a single step.
+        Args:
+            df (pd.DataFrame): raw OP df with the header the plan was compiled for
+        Returns:
+            pd.DataFrame: df with harmonized column names
+        """
+        if tuple(df.columns) != self.raw_cols:
+            raise SchemaMismatchError(
+                f"Header of {self.dataset_type} {self.year} df differs from the one the plan was compiled for"
+            )
+        data = {}
+        for name, (src, fallback) in zip(self.harmonized_cols, self.sources):
+            col = df.iloc[:, src]
+            if fallback is not None:
+                col = _coalesce(col, df.iloc[:, fallback])
+            data[name] = col
+        return pd.DataFrame(data, index=df.index, copy=False)
+
+
+def _load_year2cols(path_to_cols):
+    # cache key includes the mtime, so an edited grace_cols.csv is re-read
+    path_to_cols = os.fspath(path_to_cols)
+    return _load_year2cols_cached(path_to_cols, os.path.getmtime(path_to_cols))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_year2cols_cached(path_to_cols, mtime):
+    return build_map_year2cols(None, path_to_cols)
+
+
+def _header_diff(expected, found):
+    diff = [
+        line for line in difflib.ndiff(list(expected), list(found))
+        if line.startswith(('- ', '+ '))
+    ]
+    if len(diff) > 20:
+        diff = diff[:20] + [f"... ({len(diff) - 20} more)"]
+    return "\n".join(diff)
+
+
+def get_raw_cols_path(path_to_harmonized_cols):
+    """Path of the recorded raw headers (RAW_COLS_NAME) next to grace_cols.csv."""
+    return os.path.join(os.path.dirname(os.fspath(path_to_harmonized_cols)), RAW_COLS_NAME)
+
+
+def compile_schema_plan(dataset_type, year, path_to_harmonized_cols, raw_cols):
+    """
+    Validate a raw OP header and compile the plan that harmonizes it
+    (2014-2015 drug column merge, drop and rename). If the year's raw CMS
+    header is recorded in raw_cols.csv next to grace_cols.csv (see
+    record_raw_headers), raw_cols must match it exactly: any renamed, added,
+    removed or reordered column fails. Otherwise only the column count and
+    the position of raw columns named like harmonized ones are checked.
+    Plans are cached per (dataset_type, year, file versions, raw header).
+    Args:
+        dataset_type (str): "general" or "research"
+        year (int): OP file data year
+        path_to_harmonized_cols (str): path to grace_cols.csv
+        raw_cols (list): raw OP header
+    Returns:
+        SchemaPlan
+    Raises:
+        SchemaMismatchError: with the differences, when the header doesn't match
+    """
+    path = os.fspath(path_to_harmonized_cols)
+    raw_cols_path = get_raw_cols_path(path)
+    raw_cols_mtime = os.path.getmtime(raw_cols_path) if os.path.exists(raw_cols_path) else None
+    return _compile_schema_plan(
+        dataset_type, int(year), path, os.path.getmtime(path), tuple(raw_cols), raw_cols_mtime
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_schema_plan(dataset_type, year, path_to_harmonized_cols, mtime, raw_cols, raw_cols_mtime, recorded=True):
+    year2cols = _load_year2cols(path_to_harmonized_cols)
+    if str(year) not in year2cols:
+        raise SchemaMismatchError(f"No harmonized columns for {year} in {path_to_harmonized_cols}")
+    harmonized_cols = tuple(year2cols[str(year)])
+    label = f"{dataset_type} {year}"
+
+    # recorded=False: structural checks only, for record_raw_headers
+    if recorded:
+        raw_cols_path = get_raw_cols_path(path_to_harmonized_cols)
+        expected_raw_cols = _load_year2cols(raw_cols_path).get(str(year)) if raw_cols_mtime is not None else None
+        if expected_raw_cols is None:
+            logger.warning(
+                "%s: no recorded raw header in %s, only the column count and positions are checked",
+                label, raw_cols_path
+            )
+        elif list(raw_cols) != expected_raw_cols:
+            raise SchemaMismatchError(
+                f"{label}: raw header differs from the recorded one\n{_header_diff(expected_raw_cols, raw_cols)}"
+            )
+
+    raw_positions = list(range(len(raw_cols)))
+    merged_sources = []
+    if year < 2016:
+        missing = [col for pair in MERGE_COLS_2014_2015 for col in pair if col not in raw_cols]
+        if missing:
+            raise SchemaMismatchError(f"{label}: raw header is missing drug columns to merge: {missing}")
+        merge_positions = set()
+        for drug_col, device_col in MERGE_COLS_2014_2015:
+            merged_sources.append((raw_cols.index(drug_col), raw_cols.index(device_col)))
+            merge_positions.update(merged_sources[-1])
+        raw_positions = [pos for pos in raw_positions if pos not in merge_positions]
+    # order after the merge: kept raw columns, then the merged drug columns
+    sources = tuple((pos, None) for pos in raw_positions) + tuple(merged_sources)
+    source_names = [raw_cols[pos] for pos in raw_positions] + [
+        f"Drug_Biological_Device_Med_Sup_{i}" for i in range(1, len(merged_sources) + 1)
+    ]
+
+    if len(sources) != len(harmonized_cols):
+        raise SchemaMismatchError(
+            f"{label}: expected {len(harmonized_cols)} columns after merge, found {len(sources)}"
         )
-        # 2. Drop original columns
-        df.drop([f"Name_of_Associated_Covered_Drug_or_Biological{i}", f"Name_of_Associated_Covered_Device_or_Medical_Supply{i}"], axis=1, inplace=True)
-    return df
+    # a raw column named like a harmonized column must sit at that column's position
+    harmonized_lower = {col.lower() for col in harmonized_cols}
+    moved = [
+        f"position {pos}: expected '{expected}', found '{found}'"
+        for pos, (expected, found) in enumerate(zip(harmonized_cols, source_names))
+        if found.lower() != expected.lower() and found.lower() in harmonized_lower
+    ]
+    if moved:
+        raise SchemaMismatchError(f"{label}: raw columns moved\n" + "\n".join(moved))
+
+    return SchemaPlan(dataset_type, year, raw_cols, harmonized_cols, sources)
+
+
+def record_raw_headers(dataset_type, years, path_to_harmonized_cols, raw_dir=RAW_DIR):
+    """
+    Record the raw CMS headers of the given years in raw_cols.csv next to
+    grace_cols.csv, so later runs fail on any renamed or reordered raw
+    column (see compile_schema_plan). Each header is first checked against
+    grace_cols.csv; other years already recorded are kept.
+    Args:
+        dataset_type (str): "general" or "research"
+        years (iterable): OP years
+        path_to_harmonized_cols (str): path to grace_cols.csv
+        raw_dir (str): raw OP files or zip bundles, see get_op_raw_path
+    Returns:
+        str: path of raw_cols.csv
+    """
+    path = get_raw_cols_path(path_to_harmonized_cols)
+    year2raw_cols = _load_year2cols(path) if os.path.exists(path) else {}
+    for year in years:
+        raw_cols = read_csv_header(get_op_raw_path(year, dataset_type, raw_dir))
+        # structural checks against grace_cols.csv only, not the previous recording
+        _compile_schema_plan(
+            dataset_type, int(year), os.fspath(path_to_harmonized_cols),
+            os.path.getmtime(path_to_harmonized_cols), tuple(raw_cols), None, recorded=False
+        )
+        year2raw_cols[str(year)] = raw_cols
+    columns = {year: pd.Series(cols, dtype=object) for year, cols in sorted(year2raw_cols.items())}
+    write_csv(pd.DataFrame(columns), path)
+    logger.info("Recorded raw headers of %s %s in %s", dataset_type, sorted(year2raw_cols), path)
+    return path
 
 
 def add_npis_2014(df, dataset_type, profile_id_cols, providers_npis_ids):
@@ -273,51 +500,29 @@ def add_npis_2014(df, dataset_type, profile_id_cols, providers_npis_ids):
       https://openpaymentsdata.cms.gov/dataset/23160558-6742-54ff-8b9f-cac7d514ff4e
       For Research files, we add one NPI column per profile_id_col:
         [Covered_Recipient_NPI, PI_1_NPI, PI_2_NPI, PI_3_NPI, PI_4_NPI, PI_5_NPI]
+    clean_op_data now recovers NPIs for every year with npi_recovery.recover_npis;
+    this is the same lookup for a supplement already loaded in a df.
     Args:
         df (pd.DataFrame): OP df to add NPIs to
         dataset_type (str): "general" or "research"
         profile_id_cols (list): list of column names to merge on to get NPIs
           (there are multiple profile_id_cols in OP research files but only 1 in OP general files)
+        providers_npis_ids (pd.DataFrame): supplement rows (profile ID, NPI)
     Returns:
         pd.DataFrame: OP df with NPIs added
     """
-    # 4. Add NPIs to df using Profile ID
-    for col in profile_id_cols:
-        npi_df = providers_npis_ids.copy()
-        # rename Covered_Recipient_Profile_ID to col in providers_npis_ids for merge
-        current_columns = npi_df.columns.tolist()
-        current_columns[0] = col
-        npi_df.columns = current_columns
-
-        # Convert to string type before merging
-        npi_df[col] = npi_df[col].fillna('').astype(str)
-        df[col] = df[col].fillna('').astype(str)
-
+    df = _strip_profile_id_decimals(df, profile_id_cols)
+    df, _ = recover_npis(df, dataset_type, ProfileNpiIndex.from_frame(providers_npis_ids), profile_id_cols)
+    if dataset_type == "general":
+        return df
+    # fill all nan with ''
+    return df.fillna('')
 
-        # sort df and providers_npi_ids by provider ID
-        df.sort_values(by=col, inplace=True)
-        npi_df.sort_values(by=col, inplace=True)
 
-        # check the IDs are in the same format
-        df[col] = df[col].apply(
-            lambda x: str(int(float(x))) if pd.notna(x) and str(x).strip() != '' else x
-            )
-        
-        if dataset_type == "general":
-            return df.merge(npi_df, on=col, how="left").copy()
-        
-        else:
-            if col == "Covered_Recipient_Profile_ID":
-                # don't add suffix and don't rename new col from merge
-                df = df.merge(npi_df, on=col, how="left").copy()
-            else:
-                pi_npi_num = col.split("_")[1]
-                df = df.merge(npi_df, on=col, how="left", suffixes=('', f'_{pi_npi_num}')).copy()
-                # rename new col from merge to: PI_1_NPI, PI_2_NPI, PI_3_NPI, PI_4_NPI, PI_5_NPI
-                df.rename(columns={f"Covered_Recipient_NPI_{pi_npi_num}": f"PI_{pi_npi_num}_NPI"}, inplace=True)
-    # fill all nan with ''
-    df = df.fillna('')
-    return df
+def _strip_profile_id_decimals(df, profile_id_cols):
+    """Profile ID columns of df (those present) as strings without decimals, missing ones as ''."""
+    profile_id_cols = [col for col in profile_id_cols if col in df.columns]
+    return df.assign(**{col: _strip_decimals(df[col].fillna('').astype(str)) for col in profile_id_cols})
 
 
 def clean_op_data(
@@ -329,7 +534,13 @@ def clean_op_data(
         dataset_type, 
         path_to_harmonized_cols, 
         path_providers_npis_ids, 
-        dir_missing_npis
+        dir_missing_npis,
+        engine="auto",
+        match_cache_path=None,
+        chunksize=None,
+        dir_invalid_npis=None,
+        path_recipients=None,
+        fuzzy=False
         ):
     """
     Clean and enhance Open Payments data
@@ -346,70 +557,173 @@ def clean_op_data(
         dataset_type (str): "general" or "research"
         path_to_harmonized_cols (str): path to grace_cols.csv (different for 
             general vs research)
-        path_providers_npis_ids (str): path to providers_npis_ids.csv
+        path_providers_npis_ids (str): path to providers_npis_ids.csv, used
+            to recover missing NPIs from profile IDs in every year (see
+            npi_recovery; the index is prebuilt next to the csv)
         dir_missing_npis (str): directory to save rows dropped due to missing NPIs
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+        match_cache_path (str): SQLite cache of drug string decisions,
+            shared across years and runs (see match_cache)
+        chunksize (int): if set, clean and write the file chunksize rows at a
+            time, appending each chunk's missing-NPI rows to the sidecar, so
+            memory is bounded by one chunk. Rows keep their order.
+        dir_invalid_npis (str): if set, validate NPIs (length, check digit)
+            and quarantine rows with invalid ones to this directory, see
+            npi_validation.quarantine_invalid_npis
+        path_recipients (str): if set, also save the long recipient table of
+            the cleaned rows (one row per Record_ID and role, cols
+            RECIPIENT_COLS) to this csv, see recipients.melt_recipients
+        fuzzy (bool): for a file filtered with filter_open_payments(fuzzy=True):
+            drug strings that fuzzy-match a reference name get its Drug_Name
+            and Prostate_Drug_Type (decisions read from match_cache_path if
+            the filter saved them there, see match_cache.MatchCache)
     Returns:
-        None
+        Counter: NPIs recovered from profile IDs, per NPI column
     """
-    df = pd.read_csv(filepath, dtype=str)
-    
-    providers_npis_ids = pd.read_csv(path_providers_npis_ids, dtype=str)
-
-    # Harmonize column names (and prep 2014-2015)
-    if int(year) < 2016:
-        df = merge_cols_2014_2015(df)
-        df = harmonize_col_names(df, year, dataset_type, path_to_harmonized_cols)
-        if int(year) == 2014:
-            if dataset_type == "research":
-                profile_id_cols = [
-                'Covered_Recipient_Profile_ID',
-                'PI_1_Profile_ID',
-                'PI_2_Profile_ID',
-                'PI_3_Profile_ID',
-                'PI_4_Profile_ID',
-                'PI_5_Profile_ID'
-                ]
-            else:
-                profile_id_cols = ['Covered_Recipient_Profile_ID']
-            df = add_npis_2014(df, dataset_type, profile_id_cols, providers_npis_ids)
-    else:
-        df = harmonize_col_names(df, year, dataset_type, path_to_harmonized_cols)
-    
+    profile_index = load_profile_npi_index(path_providers_npis_ids)
+    recovered = Counter()
+
+    with MatchCache(REF_PATH, match_cache_path, fuzzy=fuzzy) as cache:
+        if chunksize is None:
+            df = read_csv(filepath, engine=engine)
+            # Harmonize column names (and merge 2014-2015 drug columns) in one step;
+            # fails fast if the raw header doesn't match grace_cols.csv
+            plan = compile_schema_plan(dataset_type, year, path_to_harmonized_cols, df.columns)
+            df = _clean_frame(
+                plan.apply(df), filename, year, npi_set, dataset_type, profile_index, dir_missing_npis, cache,
+                dir_invalid_npis=dir_invalid_npis, recovered=recovered, path_recipients=path_recipients
+                )
+            # 4. Save to CSV (all cols are strings already, no astype copy)
+            write_csv(df, fileout)
+            return recovered
+
+        header = read_csv_header(filepath)
+        plan = compile_schema_plan(dataset_type, year, path_to_harmonized_cols, header)
+        n_rows = 0
+        with open_csv_output(fileout) as f:
+            for i, chunk in enumerate(iter_csv_chunks(filepath, chunksize=chunksize, engine=engine, header=header)):
+                chunk = _clean_frame(
+                    plan.apply(chunk), filename, year, npi_set, dataset_type, profile_index,
+                    dir_missing_npis, cache, append=i > 0, dir_invalid_npis=dir_invalid_npis, recovered=recovered,
+                    path_recipients=path_recipients
+                    )
+                chunk.to_csv(f, header=i == 0, index=False)
+                n_rows += len(chunk)
+                logger.info("Cleaned chunk %s of %s", i, fileout)
+        logger.info("Wrote %s rows to %s", n_rows, fileout)
+    return recovered
+
+
+def _clean_frame(
+        df, filename, year, npi_set, dataset_type, profile_index, dir_missing_npis, cache, append=False,
+        dir_invalid_npis=None, recovered=None, path_recipients=None
+        ):
+    """
+    Clean and enhance harmonized OP rows (the whole file or one chunk of it),
+    see clean_op_data. append=True appends dropped rows to the missing-NPI
+    (and invalid-NPI) files, and recipients to path_recipients. NPIs
+    recovered from profile IDs are added to the recovered Counter, if given.
+    """
+    if int(year) == 2014:
+        df = _strip_profile_id_decimals(df, [profile_col for _, profile_col, _ in RECIPIENT_ROLES[dataset_type]])
+    # Fill missing NPIs from profile IDs (all of them in 2014, which has no NPI columns)
+    df, recovered_npis = recover_npis(df, dataset_type, profile_index)
+    if recovered is not None:
+        recovered.update(recovered_npis)
+    if int(year) == 2014 and dataset_type == "research":
+        # as in add_npis_2014: NPIs not found are left empty, not missing,
+        # so research rows without any NPI are kept
+        npi_cols = [col for col in NPI_COLS[dataset_type] if col in df.columns]
+        df = df.assign(**{col: df[col].fillna('') for col in npi_cols})
+
     # Drop rows where NPI is nan and clean string cols formatting
     if dataset_type == "general":
-        df = prep_general_data(df, filename, dir_missing_npis)
+        df = prep_general_data(df, filename, dir_missing_npis, append)
     else:
-        df = prep_research_data(df, filename, dir_missing_npis)
+        df = prep_research_data(df, filename, dir_missing_npis, append)
+    if dir_invalid_npis is not None:
+        df = quarantine_invalid_npis(df, NPI_COLS[dataset_type], f"{dir_invalid_npis}{filename}", append)
 
     # Add Columns: Drug_Name, Prostate_Drug_Type, Onc_Prescriber
     drug_cols = get_harmonized_drug_cols(df)
-    logger.info("Adding new columns to %s", fileout)
-    df = add_new_columns(df, drug_cols, npi_set, dataset_type)
+    df = add_new_columns(df, drug_cols, npi_set, dataset_type, cache=cache)
     assert 'Drug_Name' in df.columns
     assert 'Prostate_Drug_Type' in df.columns
     assert 'Onc_Prescriber' in df.columns
 
     # Remove decimals from cols
-    df['Prostate_Drug_Type'] = df['Prostate_Drug_Type'].apply(
-        lambda x: str(int(float(x))) if pd.notna(x) and str(x).strip() != '' else x
-        )
-    
-    df['Onc_Prescriber'] = df['Onc_Prescriber'].apply(
-        lambda x: str(int(float(x))) if pd.notna(x) and str(x).strip() != '' else x
-        )
-    
-    df['Covered_Recipient_Profile_ID'] = df['Covered_Recipient_Profile_ID'].apply(
-        lambda x: str(int(float(x))) if pd.notna(x) and str(x).strip() != '' else x
-        )
-    
-    # fill all nan with ''
-    df.fillna('', inplace=True)
-    
-    # 4. Save to CSV (save all cols as string)
-    df.astype(str).to_csv(fileout, index=False)
+    df = df.assign(**{
+        col: _strip_decimals(df[col]) for col in ['Prostate_Drug_Type', 'Onc_Prescriber', 'Covered_Recipient_Profile_ID']
+    })
+
+    # fill all nan with '', only copying the columns that have any
+    df = df.fillna('')
+    if path_recipients is not None:
+        recipients = melt_recipients(df, dataset_type)
+        recipients['Profile_ID'] = _strip_decimals(recipients['Profile_ID'])
+        write_csv(recipients[RECIPIENT_COLS], path_recipients, mode='a' if append else 'w', header=not append)
+    return df
 
 
-def run_op_cleaner(file_to_clean, dataset_type, year, year2npis_path):
+def get_clean_side_outputs(
+        fileout, dataset_type, year, validate_npis=False, dataset_dir=None, typed=None, recipients=False
+        ):
+    """
+    Get the per-year files and directories run_op_cleaner writes besides the
+    final table fileout, for the options that are set (see run_op_cleaner).
+    The analytics store and cube store are shared across years and left out.
+    Returns:
+        tuple: paths
+    """
+    filename = os.path.basename(fileout)
+    outputs = []
+    if validate_npis:
+        outputs.append(f"data/final_files/{dataset_type}_payments/invalid_npis/{filename}")
+    if recipients:
+        outputs.append(f"data/final_files/{dataset_type}_payments/recipients/{filename}")
+    if dataset_dir is not None:
+        outputs.append(get_partition_dir(dataset_dir, dataset_type, year))
+    if typed is not None:
+        outputs.append(get_typed_path(fileout))
+    return tuple(outputs)
+
+
+def run_op_cleaner(
+        file_to_clean, dataset_type, year, year2npis_path, store_path=None, compression=None, match_cache_path=None,
+        chunksize=None, validate_npis=False, dataset_dir=None, cube_path=None, typed=None,
+        recipients=False, fuzzy=False
+        ):
+    """
+    Clean a filtered OP file and save the final table for the year.
+    Args:
+        file_to_clean (str): path to filtered OP file (concatenated chunks)
+        dataset_type (str): "general" or "research"
+        year (int): year of OP file
+        year2npis_path (str): path to prescribers_year2npis.json
+        store_path (str): if set, also load the final table into this SQLite
+            analytics store, replacing the year's previous rows
+        compression (str): compress the final table (and its missing NPIs
+            file) with "gzip" or "zstd", None for plain csv
+        match_cache_path (str): SQLite cache of drug string decisions
+        chunksize (int): clean the file in chunks of this many rows, see clean_op_data
+        validate_npis (bool): quarantine rows with invalid NPIs to
+            data/final_files/{dataset_type}_payments/invalid_npis/
+        dataset_dir (str): if set, also write the final table as the
+            dataset_type=/year= partition of this cross-year dataset, with
+            the schema harmonized across years (see partitioned_dataset)
+        cube_path (str): if set, also aggregate the final table into this
+            SQLite cube store, replacing the year's previous slice (see
+            aggregate_cubes)
+        typed (str): if set, also write a typed parquet copy of the final
+            table next to it, with amounts as "float" (dollars) or "cents"
+            (see typed_output)
+        recipients (bool): also save the long recipient table (Record_ID,
+            Role, NPI, Profile_ID) to
+            data/final_files/{dataset_type}_payments/recipients/
+        fuzzy (bool): the file was filtered in fuzzy mode, see clean_op_data
+    Returns:
+        None
+    """
     # load year2npis_path (json)
     with open(year2npis_path, 'r') as f:
         year2npis = json.load(f)
@@ -418,13 +732,22 @@ def run_op_cleaner(file_to_clean, dataset_type, year, year2npis_path):
     npi_set = year2npis[year_str]
 
     # fileout = f"data/final_files/{dataset_type}_payments/{dataset_type}_{year}.csv"
-    fileout = f"data/final_files/{dataset_type}_payments/{dataset_type}_{year}_may8.csv"
+    fileout = compressed_path(get_final_path(dataset_type, year), compression)
     filename = fileout.split("/")[-1]
     path_to_harmonized_cols =f"data/reference/col_names/{dataset_type}_payments/grace_cols.csv"
     path_providers_npis_ids = "data/reference/providers_npis_ids.csv"
     dir_missing_npis = f"data/final_files/{dataset_type}_payments/missing_npis/"
+    dir_invalid_npis = None
+    if validate_npis:
+        dir_invalid_npis = f"data/final_files/{dataset_type}_payments/invalid_npis/"
+        os.makedirs(dir_invalid_npis, exist_ok=True)
+    path_recipients = None
+    if recipients:
+        dir_recipients = f"data/final_files/{dataset_type}_payments/recipients/"
+        os.makedirs(dir_recipients, exist_ok=True)
+        path_recipients = f"{dir_recipients}{filename}"
     
-    clean_op_data(
+    recovered = clean_op_data(
         file_to_clean,
         fileout,
         filename,
@@ -433,6 +756,20 @@ def run_op_cleaner(file_to_clean, dataset_type, year, year2npis_path):
         dataset_type,
         path_to_harmonized_cols,
         path_providers_npis_ids,
-        dir_missing_npis
+        dir_missing_npis,
+        match_cache_path=match_cache_path,
+        chunksize=chunksize,
+        dir_invalid_npis=dir_invalid_npis,
+        path_recipients=path_recipients,
+        fuzzy=fuzzy
         )
-    
+    logger.info("Recovered %s NPIs from profile IDs for %s %s: %s", recovered.total(), dataset_type, year, dict(recovered))
+
+    if store_path is not None:
+        load_final_file(store_path, fileout, dataset_type, year)
+    if dataset_dir is not None:
+        write_partition(dataset_dir, fileout, dataset_type, year, path_to_harmonized_cols)
+    if cube_path is not None:
+        update_cube(cube_path, fileout, dataset_type, year)
+    if typed is not None:
+        write_typed_table(fileout, amount_type=typed)
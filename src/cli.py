@@ -0,0 +1,235 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+from src.log_config import setup_logging
+from src.paths import (
+    RAW_DIR,
+    YEAR2NPIS_PATH,
+    MATCH_CACHE_PATH,
+    DATASET_DIR,
+    FILTERED_LISTS_DIR,
+    RECORD_INDEX_PATH,
+    STORE_PATH,
+    CUBES_PATH,
+    YEARS,
+    DATASET_TYPES,
+    get_op_raw_path,
+    get_filtered_path,
+    get_final_path,
+)
+
+# Only the standard library is imported at module level: pandas and the
+# pipeline modules are imported by the commands that need them, so --help
+# and --dry-run start instantly.
+
+logger = logging.getLogger(__name__)
+
+
+def parse_years(value):
+    """
+    Parse a --years value: "2022", "2020-2023" or "2014,2016,2020-2023".
+    Returns:
+        list: sorted years
+    """
+    years = set()
+    try:
+        for part in value.split(","):
+            start, _, end = part.strip().partition("-")
+            years.update(range(int(start), int(end or start) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid years '{value}', expected e.g. 2022 or 2020-2023") from None
+    if not years:
+        raise argparse.ArgumentTypeError("no years given")
+    return sorted(years)
+
+
+def parse_datasets(value):
+    """Parse a --datasets value: "general", "research" or "general,research"."""
+    datasets = [dataset.strip() for dataset in value.split(",") if dataset.strip()]
+    for dataset in datasets:
+        if dataset not in DATASET_TYPES:
+            raise argparse.ArgumentTypeError(f"invalid dataset '{dataset}', expected {' or '.join(DATASET_TYPES)}")
+    return datasets
+
+
+def parse_drug_list(value):
+    """Parse a --list value: "ID=PATH" to a drug list csv in the ProstateDrugList.csv format."""
+    list_id, _, path = value.partition("=")
+    if not list_id.strip() or not path.strip():
+        raise argparse.ArgumentTypeError(f"invalid list '{value}', expected e.g. breast=data/reference/BreastDrugList.csv")
+    return list_id.strip(), path.strip()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="qsure", description="Open Payments x Part D prescribers pipeline")
+    parser.add_argument("--log-dir", default="data/logs", help="directory for the run's log file")
+    parser.add_argument("--no-log-file", action="store_true", help="log to the console only")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="filter, concatenate and clean OP files")
+    run.add_argument("--years", type=parse_years, default=list(YEARS), help="e.g. 2022, 2020-2023 (default: 2014-2023)")
+    run.add_argument("--datasets", type=parse_datasets, default=list(DATASET_TYPES), help="general, research or both")
+    run.add_argument("--raw-dir", default=RAW_DIR, help="raw OP files or zip bundles")
+    run.add_argument("--year2npis", default=YEAR2NPIS_PATH, help="output of filter-prescribers")
+    run.add_argument("--compression", choices=["gzip", "zstd"], help="compress intermediate and final csv files")
+    run.add_argument("--match-cache", default=MATCH_CACHE_PATH, help="SQLite cache of drug string decisions")
+    run.add_argument("--no-match-cache", action="store_true", help="don't persist drug string decisions")
+    run.add_argument("--clean-chunksize", type=int, help="clean files in chunks of this many rows")
+    run.add_argument("--validate-npis", action="store_true", help="quarantine rows with invalid NPIs (check digit)")
+    run.add_argument("--dedup", action="store_true", help="keep the latest version of each Record_ID")
+    run.add_argument(
+        "--dataset-dir", nargs="?", const=DATASET_DIR,
+        help=f"also write a dataset partitioned by dataset_type/year (default dir: {DATASET_DIR})"
+    )
+    run.add_argument(
+        "--store", nargs="?", const=STORE_PATH,
+        help=f"also load the final tables into a SQLite analytics store (default file: {STORE_PATH})"
+    )
+    run.add_argument(
+        "--cubes", nargs="?", const=CUBES_PATH,
+        help=f"also maintain payment aggregate cubes (default file: {CUBES_PATH})"
+    )
+    run.add_argument(
+        "--typed", nargs="?", const="float", choices=["float", "cents"],
+        help="also write typed parquet copies of the final tables (amounts in float dollars or int cents)"
+    )
+    run.add_argument(
+        "--recipients", action="store_true", help="also save long recipient tables (Record_ID, Role, NPI, Profile_ID)"
+    )
+    run.add_argument(
+        "--workers", type=int, help="run independent stages concurrently with this many workers, skipping up-to-date stages"
+    )
+    run.add_argument("--prescribers", action="store_true", help="also filter the Part D prescribers first (scheduled run)")
+    run.add_argument("--part-d-dir", help="full national Part D files for --prescribers")
+    run.add_argument("--final-generics", action="store_true", help="also write final tables with final generic names")
+    run.add_argument("--force", action="store_true", help="scheduled run: rerun up-to-date stages")
+    run.add_argument("--dry-run", action="store_true", help="list inputs and outputs, don't process anything")
+
+    prescribers = subparsers.add_parser(
+        "filter-prescribers", help="filter Part D prescribers and write prescribers_year2npis.json"
+    )
+    prescribers.add_argument(
+        "--part-d-dir", help="read the full national Part D by-provider-and-drug files in this directory"
+    )
+    prescribers.add_argument("--workers", type=int, help="years filtered in parallel (default: one per year)")
+    prescribers.add_argument(
+        "--validate-npis", action="store_true", help="quarantine rows with invalid Prscrbr_NPIs (check digit)"
+    )
+
+    lists = subparsers.add_parser(
+        "filter-lists", help="filter the raw OP files for several drug lists in one scan of each file"
+    )
+    lists.add_argument(
+        "--list", dest="lists", type=parse_drug_list, action="append", required=True,
+        help="ID=PATH of a drug list in the ProstateDrugList.csv format, repeated per list"
+    )
+    lists.add_argument("--years", type=parse_years, default=list(YEARS), help="e.g. 2022, 2020-2023")
+    lists.add_argument("--datasets", type=parse_datasets, default=list(DATASET_TYPES), help="general, research or both")
+    lists.add_argument("--raw-dir", default=RAW_DIR, help="raw OP files or zip bundles")
+    lists.add_argument("--out", default=FILTERED_LISTS_DIR, help="output directory, one subdirectory per list")
+    lists.add_argument("--compression", choices=["gzip", "zstd"], help="compress the filtered files")
+
+    records = subparsers.add_parser("index-records", help="index the final tables by Record_ID")
+    records.add_argument("--final-dir", default="data/final_files/", help="directory of the final tables")
+    records.add_argument("--index", default=RECORD_INDEX_PATH, help="SQLite index file")
+    record = subparsers.add_parser("get-record", help="print the final table row(s) of a Record_ID")
+    record.add_argument("record_id")
+    record.add_argument("--index", default=RECORD_INDEX_PATH, help="SQLite index file")
+
+    headers = subparsers.add_parser(
+        "record-headers", help="record the raw OP headers, so later runs fail on renamed or reordered columns"
+    )
+    headers.add_argument("--years", type=parse_years, default=list(YEARS), help="e.g. 2022, 2020-2023")
+    headers.add_argument("--datasets", type=parse_datasets, default=list(DATASET_TYPES), help="general, research or both")
+    headers.add_argument("--raw-dir", default=RAW_DIR, help="raw OP files or zip bundles")
+    return parser
+
+
+def dry_run(args):
+    """Print the planned steps and check the raw inputs exist, without loading pandas."""
+    extension = {None: "", "gzip": ".gz", "zstd": ".zst"}[args.compression]
+    missing = 0
+    for dataset_type in args.datasets:
+        for year in args.years:
+            try:
+                raw_path = get_op_raw_path(year, dataset_type, args.raw_dir)
+            except ValueError:
+                raw_path = "MISSING"
+                missing += 1
+            print(f"{dataset_type} {year}: {raw_path}")
+            print(f"    -> {get_filtered_path(dataset_type, year)}{extension}")
+            print(f"    -> {get_final_path(dataset_type, year)}{extension}")
+    if not os.path.exists(args.year2npis):
+        print(f"MISSING {args.year2npis}, run: qsure filter-prescribers")
+        missing += 1
+    return 1 if missing else 0
+
+
+def main(argv=None):
+    """
+    Entry point of python -m src. Configures logging once, then imports and
+    runs the requested command.
+    Returns:
+        int: exit code
+    """
+    args = build_parser().parse_args(argv)
+    if args.command == "run" and args.dry_run:
+        return dry_run(args)
+
+    setup_logging(None if args.no_log_file else args.log_dir)
+    start_time = time.time()
+    if args.command == "run":
+        from src.main import main as run_pipeline
+        run_pipeline(
+            years=args.years,
+            dataset_types=args.datasets,
+            raw_dir=args.raw_dir,
+            year2npis_path=args.year2npis,
+            compression=args.compression,
+            match_cache_path=None if args.no_match_cache else args.match_cache,
+            clean_chunksize=args.clean_chunksize,
+            validate_npis=args.validate_npis,
+            dedup=args.dedup,
+            dataset_dir=args.dataset_dir,
+            store_path=args.store,
+            cube_path=args.cubes,
+            typed=args.typed,
+            recipients=args.recipients,
+            workers=args.workers,
+            prescribers=args.prescribers,
+            part_d_dir=args.part_d_dir,
+            final_generics=args.final_generics,
+            force=args.force,
+        )
+    elif args.command == "filter-prescribers":
+        from src.filter_prescribers import main as filter_prescribers
+        filter_prescribers(part_d_dir=args.part_d_dir, max_workers=args.workers, validate_npis=args.validate_npis)
+    elif args.command == "filter-lists":
+        from src.filter_op import filter_lists
+        ref_paths = dict(args.lists)
+        if len(ref_paths) != len(args.lists):
+            raise SystemExit("filter-lists: list IDs must be unique")
+        filter_lists(ref_paths, args.years, args.datasets, args.raw_dir, args.out, args.compression)
+    elif args.command == "index-records":
+        from src.record_index import build_record_index, find_final_files
+        build_record_index(args.index, find_final_files(args.final_dir, compressed=True))
+    elif args.command == "get-record":
+        from src.record_index import lookup_record
+        result = lookup_record(args.index, args.record_id)
+        print(f"Record_ID {args.record_id} not found" if result.empty else result.T.to_string(header=False))
+    elif args.command == "record-headers":
+        from src.clean_final_tables import record_raw_headers
+        for dataset_type in args.datasets:
+            record_raw_headers(
+                dataset_type, args.years, f"data/reference/col_names/{dataset_type}_payments/grace_cols.csv",
+                args.raw_dir
+            )
+    logger.info("Finished %s in %.2f seconds", args.command, time.time() - start_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
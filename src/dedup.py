@@ -0,0 +1,129 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from src._utils import (
+    iter_csv_chunks,
+    open_csv_output,
+    read_csv_header,
+)
+
+logger = logging.getLogger(__name__)
+
+RECORD_ID_COL = 'Record_ID'
+# Integers up to this are exact in float64, so "12.0" and "12" hash the same
+MAX_EXACT_INT = 2 ** 53
+
+
+def hash_record_ids(values) -> np.ndarray:
+    """
+    Hash Record_IDs to uint64, 8 bytes per row whatever the ID length.
+    Numeric IDs are hashed by value, so surrounding whitespace and a float
+    artifact (".0") are ignored; other IDs are hashed as stripped strings.
+    Args:
+        values (array-like): Record_IDs as strings (NaN allowed)
+    Returns:
+        np.ndarray: uint64 hashes, 0 for missing Record_IDs
+    """
+    ids = pd.Series(values, dtype=object)
+    # parsing as numbers is much faster than string normalization, and OP Record_IDs are numeric
+    numbers = pd.to_numeric(ids, errors='coerce').to_numpy()
+    if numbers.dtype.kind == 'f':
+        integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+        integral[integral] = np.abs(numbers[integral]) < MAX_EXACT_INT
+    else:
+        integral = np.abs(numbers) < MAX_EXACT_INT
+    hashes = np.empty(len(ids), dtype=np.uint64)
+    hashes[integral] = pd.util.hash_array(numbers[integral].astype(np.int64))
+    others = ids[~integral].fillna('').astype(str).str.strip()
+    hashes[~integral] = pd.util.hash_array(others.to_numpy(dtype=object), categorize=False)
+    # 0 marks missing IDs; a real ID hashing to 0 is moved off it
+    hashes[hashes == 0] = 1
+    hashes[~integral] = np.where((others == '').to_numpy(), 0, hashes[~integral])
+    return hashes
+
+
+def latest_version_mask(hashes: np.ndarray) -> np.ndarray:
+    """
+    Get a mask keeping the last occurrence of each Record_ID hash. Rows
+    without a Record_ID (hash 0) are always kept.
+    Args:
+        hashes (np.ndarray): see hash_record_ids, in file order
+    Returns:
+        np.ndarray: bool, True for rows to keep
+    """
+    # np.unique returns the first index of each value: first in the reversed order is last
+    _, last_from_end = np.unique(hashes[::-1], return_index=True)
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[len(hashes) - 1 - last_from_end] = True
+    keep[hashes == 0] = True
+    return keep
+
+
+def dedup_record_ids(paths_in, path_out, chunksize=100_000, engine="auto"):
+    """
+    Deduplicate filtered OP files on Record_ID, keeping the latest version of
+    each record: the last occurrence, with files taken in release order
+    (oldest first). Two streaming passes: the first reads only Record_ID and
+    keeps a uint64 hash per row (see hash_record_ids), the second writes the
+    kept rows chunk by chunk, so memory is bounded by ~8 bytes per row plus
+    one chunk, whatever the file size.
+    Args:
+        paths_in (str or list): filtered file(s) with the same columns, plain
+            or compressed; a single path is deduplicated within itself
+        path_out (str): deduplicated csv, compressed if it ends with .gz or .zst.
+            May be one of paths_in, which is then replaced once done.
+        chunksize (int): rows per chunk
+        engine (str): csv parse engine, see resolve_csv_engine
+    Returns:
+        int: number of duplicate rows removed
+    """
+    if isinstance(paths_in, (str, os.PathLike)):
+        paths_in = [paths_in]
+    header = read_csv_header(paths_in[0])
+    if RECORD_ID_COL not in header:
+        raise ValueError(f"No {RECORD_ID_COL} column in {paths_in[0]}")
+
+    hashes = np.concatenate([
+        hash_record_ids(chunk[RECORD_ID_COL].to_numpy())
+        for path in paths_in
+        for chunk in iter_csv_chunks(path, chunksize=chunksize, engine=engine, usecols=[RECORD_ID_COL])
+    ] or [np.zeros(0, dtype=np.uint64)])
+    keep = latest_version_mask(hashes)
+    del hashes
+
+    # write next to path_out first, in case path_out is also an input
+    head, tail = os.path.split(str(path_out))
+    tmp_path = os.path.join(head, f".dedup_tmp_{tail}")
+    start = 0
+    with open_csv_output(tmp_path) as f:
+        pd.DataFrame(columns=header).to_csv(f, index=False)
+        for path in paths_in:
+            for chunk in iter_csv_chunks(path, chunksize=chunksize, engine=engine):
+                chunk_keep = keep[start:start + len(chunk)]
+                start += len(chunk)
+                chunk[chunk_keep].reindex(columns=header).to_csv(f, header=False, index=False)
+    os.replace(tmp_path, path_out)
+
+    n_removed = int((~keep).sum())
+    logger.info("Removed %s duplicate Record_IDs of %s rows, wrote %s", n_removed, len(keep), path_out)
+    return n_removed
+
+
+def write_dedup_report(removed, path):
+    """
+    Save the duplicate counts of a run.
+    Args:
+        removed (dict): (dataset_type, year) -> duplicates removed
+        path (str): csv path
+    Returns:
+        pd.DataFrame: cols dataset_type, year, duplicates_removed
+    """
+    report = pd.DataFrame(
+        [(dataset_type, year, n) for (dataset_type, year), n in sorted(removed.items())],
+        columns=['dataset_type', 'year', 'duplicates_removed'],
+    )
+    report.to_csv(path, index=False)
+    return report
@@ -0,0 +1,226 @@
+import argparse
+import io
+import logging
+import os
+import random
+
+from src._utils import (
+    setup_logging,
+    open_csv_source,
+    read_csv,
+    COMPRESSED_EXTENSIONS,
+    CSV_ENCODING,
+)
+from src.filter_op import (
+    find_matches_op,
+    get_op_drug_columns,
+    get_ref_drug_names,
+)
+from src.filter_prescribers import (
+    find_matches_prescribers,
+    PRESCRIBER_DRUG_COLS,
+    PRESCRIBER_DRUG_NAMES,
+    RAW_PRESCRIBERS_DIR,
+)
+from src.paths import (
+    DATASET_TYPES,
+    RAW_DIR,
+    REF_PATH,
+    YEARS,
+    get_op_raw_path,
+)
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = "data/fixtures/raw/"
+
+
+def iter_raw_records(f):
+    """
+    Split a binary csv stream into raw records, bytes untouched (BOM, quoting,
+    line terminators). Quote-aware like raw_index.iter_record_spans: a quoted
+    field containing newlines stays in one record. Blank lines are skipped.
+    Args:
+        f (binary file object): csv stream, see open_csv_source
+    Yields:
+        bytes: the header record first, then each data record
+    """
+    record = []
+    in_quotes = False
+    for line in f:
+        record.append(line)
+        # an odd number of quotes toggles the quoted state ("" escapes are even)
+        if line.count(b'"') % 2:
+            in_quotes = not in_quotes
+        if in_quotes:
+            continue
+        record = b''.join(record)
+        if record.strip(b'\r\n'):
+            yield record
+        record = []
+    if record:
+        yield b''.join(record)
+
+
+def fixture_name(path_in):
+    """File name of the fixture of a raw file: fixtures are plain csv, so .gz/.zst/... is dropped."""
+    name = os.path.basename(path_in)
+    for extension in COMPRESSED_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def op_row_matcher(year, ref_path=REF_PATH):
+    """
+    Match function of filter_open_payments for a raw OP file: exact drug
+    name matches after cleaning, in the year's drug columns.
+    Returns:
+        callable: chunk (pd.DataFrame) -> bool mask (np.ndarray)
+    """
+    ref_drug_names = get_ref_drug_names(ref_path)
+
+    def is_match(chunk):
+        drug_cols = get_op_drug_columns(chunk, year)
+        return chunk.index.isin(find_matches_op(chunk, drug_cols, ref_drug_names).index)
+    return is_match
+
+
+def prescriber_row_matcher(chunk):
+    """Match function of filter_prescribers_by_drug_names for a raw Part D file, see op_row_matcher."""
+    return chunk.index.isin(find_matches_prescribers(chunk, PRESCRIBER_DRUG_COLS, PRESCRIBER_DRUG_NAMES).index)
+
+
+def sample_raw_file(path_in, path_out, is_match, n_sample=1000, seed=0, chunksize=100_000, encoding=CSV_ENCODING):
+    """
+    Build a small fixture from a raw file in one streaming pass: every row
+    the pipeline would match, plus a seeded reservoir sample of n_sample
+    non-matching rows. Records are copied as raw bytes, so the header, BOM,
+    quoting, line terminators and encoding are exactly the original's.
+    Matching rows are written as they are found, then the sampled rows, both
+    in raw file order; the same input and seed give the same fixture.
+    Memory is bounded by one chunk plus the reservoir.
+    Args:
+        path_in (str): raw csv, plain, compressed or a zip member (see open_csv_source)
+        path_out (str): plain csv fixture
+        is_match (callable): chunk (pd.DataFrame, all strings) -> bool mask,
+            e.g. op_row_matcher(year) or prescriber_row_matcher
+        n_sample (int): non-matching rows to keep
+        seed (int): reservoir sampling seed
+        chunksize (int): rows parsed at a time to find the matches
+        encoding (str): encoding of path_in, used only to parse the rows
+    Returns:
+        dict: rows (data rows read), matched and sampled
+    """
+    rng = random.Random(seed)
+    reservoir = []  # (row number, record)
+    n_rows = n_matched = n_unmatched = 0
+
+    def flush(f_out, header, batch, start):
+        nonlocal n_matched, n_unmatched
+        # the last record of a file may lack a line terminator
+        data = [record if record.endswith(b'\n') else record + b'\n' for record in batch]
+        chunk = read_csv(io.BytesIO(header + b''.join(data)), engine="c", encoding=encoding)
+        if len(chunk) != len(batch):
+            raise ValueError(f"Parsed {len(chunk)} rows from {len(batch)} records of {path_in} at row {start}")
+        for row, (record, matched) in enumerate(zip(data, is_match(chunk)), start):
+            if matched:
+                f_out.write(record)
+                n_matched += 1
+                continue
+            # Algorithm R: the i-th non-matching row replaces a kept one with probability n_sample / i
+            n_unmatched += 1
+            if len(reservoir) < n_sample:
+                reservoir.append((row, record))
+            else:
+                slot = rng.randrange(n_unmatched)
+                if slot < n_sample:
+                    reservoir[slot] = (row, record)
+
+    os.makedirs(os.path.dirname(path_out) or ".", exist_ok=True)
+    with open_csv_source(path_in) as f_in, open(path_out, 'wb') as f_out:
+        records = iter_raw_records(f_in)
+        header = next(records, b'')
+        f_out.write(header)
+        header = header if header.endswith(b'\n') else header + b'\n'
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == chunksize:
+                flush(f_out, header, batch, n_rows)
+                n_rows += len(batch)
+                batch = []
+        if batch:
+            flush(f_out, header, batch, n_rows)
+            n_rows += len(batch)
+        for _, record in sorted(reservoir):
+            f_out.write(record)
+
+    logger.info(
+        "Fixture %s: %s matched and %s sampled of %s rows of %s",
+        path_out, n_matched, len(reservoir), n_rows, path_in
+    )
+    return {'rows': n_rows, 'matched': n_matched, 'sampled': len(reservoir)}
+
+
+def build_fixtures(
+        out_dir=FIXTURES_DIR, years=YEARS, dataset_types=DATASET_TYPES, raw_dir=RAW_DIR, ref_path=REF_PATH,
+        prescribers_dir=RAW_PRESCRIBERS_DIR, n_sample=1000, seed=0
+        ):
+    """
+    Build fixtures of the raw OP files of the given years and dataset types,
+    and of the raw Part D prescriber files, with the raw directory layout:
+    run the pipeline on them with --raw-dir out_dir.
+    Args:
+        out_dir (str): fixtures directory, ending with "/"
+        years (iterable): OP years
+        dataset_types (iterable): "general" and/or "research"
+        raw_dir (str): raw OP files or zip bundles, see get_op_raw_path
+        ref_path (str): path to ProstateDrugList.csv
+        prescribers_dir (str): raw Part D files ({year}_{specialty}.csv), None to skip
+        n_sample (int): non-matching rows kept per file
+        seed (int): sampling seed, the same for every file
+    Returns:
+        list: (path_out, counts) per fixture, see sample_raw_file
+    """
+    fixtures = []
+    for dataset_type in dataset_types:
+        for year in years:
+            path_in = get_op_raw_path(year, dataset_type, raw_dir)
+            # zip members and compressed files are written as plain extracted files,
+            # found first by get_op_raw_path
+            path_out = os.path.join(out_dir, f"{dataset_type}_payments", fixture_name(path_in))
+            counts = sample_raw_file(path_in, path_out, op_row_matcher(year, ref_path), n_sample, seed)
+            fixtures.append((path_out, counts))
+    if prescribers_dir is not None and os.path.isdir(prescribers_dir):
+        for file in sorted(os.listdir(prescribers_dir)):
+            path_out = os.path.join(out_dir, "prescribers", "chunks", fixture_name(file))
+            counts = sample_raw_file(os.path.join(prescribers_dir, file), path_out, prescriber_row_matcher, n_sample, seed)
+            fixtures.append((path_out, counts))
+    return fixtures
+
+
+def main():
+    # imported here, the cli imports pandas-free modules only
+    from src.cli import parse_years, parse_datasets
+    parser = argparse.ArgumentParser(description="Build small sampled fixtures of the raw OP and Part D files")
+    parser.add_argument("--years", type=parse_years, default=list(YEARS), help="e.g. 2022, 2020-2023")
+    parser.add_argument("--datasets", type=parse_datasets, default=list(DATASET_TYPES), help="general, research or both")
+    parser.add_argument("--raw-dir", default=RAW_DIR, help="raw OP files or zip bundles")
+    parser.add_argument("--prescribers-dir", default=RAW_PRESCRIBERS_DIR, help="raw Part D prescriber files")
+    parser.add_argument("--out", default=FIXTURES_DIR, help="fixtures directory")
+    parser.add_argument("--sample", type=int, default=1000, help="non-matching rows kept per file")
+    parser.add_argument("--seed", type=int, default=0, help="sampling seed")
+    args = parser.parse_args()
+
+    fixtures = build_fixtures(
+        args.out, args.years, args.datasets, args.raw_dir, prescribers_dir=args.prescribers_dir,
+        n_sample=args.sample, seed=args.seed
+    )
+    for path_out, counts in fixtures:
+        print(f"{path_out}: {counts['matched']} matched + {counts['sampled']} sampled of {counts['rows']} rows")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from src._utils import (
+    setup_logging,
+    iter_csv_chunks,
+    open_csv_output,
+    read_csv_header,
+    write_csv,
+)
+from src.dedup import (
+    hash_record_ids,
+    latest_version_mask,
+)
+from src.record_index import find_final_files
+
+logger = logging.getLogger(__name__)
+
+KEY_COL = 'Record_ID'
+SUMMARY_COLS = [
+    'dataset_type', 'year', 'rows_a', 'rows_b', 'added', 'removed', 'changed', 'unchanged',
+    'columns_added', 'columns_removed',
+]
+DETAIL_COLS = ['Record_ID', 'Status', 'Changed_Cols']
+
+
+def _hash_columns(chunk, cols):
+    """Per-column uint64 hashes of chunk[cols], shape (rows, len(cols))."""
+    return np.column_stack([
+        pd.util.hash_array(chunk[col].to_numpy(dtype=object), categorize=False) for col in cols
+    ]) if cols else np.zeros((len(chunk), 0), dtype=np.uint64)
+
+
+def _scan(path, cols, chunksize, engine):
+    """
+    First pass over a final table: the Record_ID hash and the hash of the
+    row's cols (in that order) for every row.
+    Returns:
+        tuple (keys, row_hashes, keep): row_hashes are taken over cols, keep
+            marks the rows compared (last occurrence of each Record_ID,
+            rows without one excluded)
+    """
+    keys, row_hashes = [np.zeros(0, dtype=np.uint64)], [np.zeros(0, dtype=np.uint64)]
+    if path is not None:
+        for chunk in iter_csv_chunks(path, chunksize=chunksize, engine=engine):
+            keys.append(hash_record_ids(chunk[KEY_COL].to_numpy()))
+            if cols:
+                row_hashes.append(pd.util.hash_pandas_object(chunk[cols], index=False).to_numpy())
+            else:
+                row_hashes.append(np.zeros(len(chunk), dtype=np.uint64))
+    keys, row_hashes = np.concatenate(keys), np.concatenate(row_hashes)
+    keep = latest_version_mask(keys) & (keys != 0)
+    n_skipped = len(keys) - keep.sum()
+    if n_skipped:
+        logger.warning("%s: skipped %s rows with a repeated or missing Record_ID", path, n_skipped)
+    return keys, row_hashes, keep
+
+
+def _select(path, keys, keep, selected, chunksize, engine):
+    """Second pass: yield (chunk rows, their keys) for the kept rows whose key is in selected (sorted)."""
+    if path is None or not len(selected):
+        return
+    start = 0
+    for chunk in iter_csv_chunks(path, chunksize=chunksize, engine=engine):
+        chunk_keys = keys[start:start + len(chunk)]
+        mask = keep[start:start + len(chunk)] & np.isin(chunk_keys, selected, assume_unique=False)
+        start += len(chunk)
+        if mask.any():
+            yield chunk[mask], chunk_keys[mask]
+
+
+def diff_final_file(path_a, path_b, details_path=None, chunksize=200_000, engine="auto"):
+    """
+    Diff two versions of a final table by Record_ID, streaming both files.
+    A first pass hashes every row (pd.util.hash_pandas_object over the
+    columns both versions have); only rows whose hashes differ are re-read,
+    to find the columns that changed.
+    Args:
+        path_a (str): old version (None if the table is new)
+        path_b (str): new version (None if the table was removed)
+        details_path (str): if set, save one row per added, removed or changed
+            Record_ID (cols DETAIL_COLS) to this csv
+        chunksize (int): rows per chunk
+        engine (str): csv parse engine, see resolve_csv_engine
+    Returns:
+        tuple (dict, dict): counts (see SUMMARY_COLS) and rows changed per column
+    """
+    header_a = read_csv_header(path_a) if path_a is not None else []
+    header_b = read_csv_header(path_b) if path_b is not None else []
+    for path, header in [(path_a, header_a), (path_b, header_b)]:
+        if path is not None and KEY_COL not in header:
+            raise ValueError(f"No {KEY_COL} column in {path}")
+    cols = [col for col in header_a if col in header_b and col != KEY_COL]
+    keys_a, hashes_a, keep_a = _scan(path_a, cols, chunksize, engine)
+    keys_b, hashes_b, keep_b = _scan(path_b, cols, chunksize, engine)
+
+    order_a = np.argsort(keys_a[keep_a])
+    order_b = np.argsort(keys_b[keep_b])
+    sorted_a, sorted_b = keys_a[keep_a][order_a], keys_b[keep_b][order_b]
+    common, in_a, in_b = np.intersect1d(sorted_a, sorted_b, assume_unique=True, return_indices=True)
+    differs = hashes_a[keep_a][order_a][in_a] != hashes_b[keep_b][order_b][in_b]
+    changed = common[differs]
+    removed = np.setdiff1d(sorted_a, sorted_b, assume_unique=True)
+    added = np.setdiff1d(sorted_b, sorted_a, assume_unique=True)
+
+    # column hashes of the changed rows of a, by position in changed
+    col_hashes_a = np.zeros((len(changed), len(cols)), dtype=np.uint64)
+    changed_by_column = np.zeros(len(cols), dtype=np.int64)
+    output = open_csv_output(details_path) if details_path is not None else contextlib.nullcontext()
+    with output as details:
+        if details is not None:
+            details.write(",".join(DETAIL_COLS) + "\n")
+        selected_a = np.union1d(changed, removed) if details is not None else changed
+        for rows, row_keys in _select(path_a, keys_a, keep_a, selected_a, chunksize, engine):
+            is_changed = np.isin(row_keys, changed)
+            col_hashes_a[np.searchsorted(changed, row_keys[is_changed])] = _hash_columns(rows[is_changed], cols)
+            if details is not None:
+                _write_details(details, rows.loc[~is_changed, KEY_COL], "removed")
+
+        selected_b = np.union1d(changed, added) if details is not None else changed
+        for rows, row_keys in _select(path_b, keys_b, keep_b, selected_b, chunksize, engine):
+            is_changed = np.isin(row_keys, changed)
+            diff = _hash_columns(rows[is_changed], cols) != col_hashes_a[np.searchsorted(changed, row_keys[is_changed])]
+            changed_by_column += diff.sum(axis=0)
+            if details is not None:
+                changed_cols = [";".join(np.array(cols)[row]) for row in diff]
+                _write_details(details, rows.loc[is_changed, KEY_COL], "changed", changed_cols)
+                _write_details(details, rows.loc[~is_changed, KEY_COL], "added")
+
+    counts = {
+        'rows_a': int(len(keys_a)),
+        'rows_b': int(len(keys_b)),
+        'added': int(len(added)),
+        'removed': int(len(removed)),
+        'changed': int(len(changed)),
+        'unchanged': int(len(common) - len(changed)),
+        'columns_added': ";".join(col for col in header_b if col not in header_a),
+        'columns_removed': ";".join(col for col in header_a if col not in header_b),
+    }
+    return counts, {col: int(n) for col, n in zip(cols, changed_by_column) if n}
+
+
+def _write_details(f, record_ids, status, changed_cols=''):
+    pd.DataFrame({'Record_ID': record_ids.to_numpy(), 'Status': status, 'Changed_Cols': changed_cols}).to_csv(
+        f, header=False, index=False
+    )
+
+
+def diff_runs(dir_a, dir_b, out_dir, details=True, chunksize=200_000, engine="auto"):
+    """
+    Diff two versions of data/final_files, year by year: which Record_IDs
+    were added, removed or changed, and which columns changed.
+    Args:
+        dir_a (str): final_files directory of the old run
+        dir_b (str): final_files directory of the new run
+        out_dir (str): directory for summary.csv (counts per table),
+            changed_columns.csv (rows changed per column) and, with details,
+            rows/{dataset_type}_{year}.csv (one row per differing Record_ID)
+        details (bool): save the differing Record_IDs
+        chunksize (int): rows per chunk
+        engine (str): csv parse engine, see resolve_csv_engine
+    Returns:
+        pd.DataFrame: summary, cols SUMMARY_COLS
+    """
+    files_a = {(dataset_type, year): path for dataset_type, year, path in find_final_files(dir_a, compressed=True)}
+    files_b = {(dataset_type, year): path for dataset_type, year, path in find_final_files(dir_b, compressed=True)}
+    os.makedirs(out_dir, exist_ok=True)
+    if details:
+        os.makedirs(os.path.join(out_dir, "rows"), exist_ok=True)
+
+    summary, changed_columns = [], []
+    for dataset_type, year in sorted(set(files_a) | set(files_b)):
+        details_path = os.path.join(out_dir, "rows", f"{dataset_type}_{year}.csv") if details else None
+        counts, by_column = diff_final_file(
+            files_a.get((dataset_type, year)), files_b.get((dataset_type, year)), details_path, chunksize, engine
+        )
+        logger.info(
+            "%s %s: %s added, %s removed, %s changed", dataset_type, year,
+            counts['added'], counts['removed'], counts['changed']
+        )
+        summary.append({'dataset_type': dataset_type, 'year': year, **counts})
+        changed_columns.extend((dataset_type, year, col, n) for col, n in by_column.items())
+
+    summary = pd.DataFrame(summary, columns=SUMMARY_COLS)
+    write_csv(summary, os.path.join(out_dir, "summary.csv"))
+    write_csv(
+        pd.DataFrame(changed_columns, columns=['dataset_type', 'year', 'column', 'rows_changed']),
+        os.path.join(out_dir, "changed_columns.csv"),
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two versions of the final tables by Record_ID")
+    parser.add_argument("dir_a", help="final_files directory of the old run")
+    parser.add_argument("dir_b", help="final_files directory of the new run")
+    parser.add_argument("--out", default="data/diff/", help="directory for the diff reports")
+    parser.add_argument("--no-details", action="store_true", help="don't save the differing Record_IDs")
+    args = parser.parse_args()
+
+    summary = diff_runs(args.dir_a, args.dir_b, args.out, details=not args.no_details)
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -1,16 +1,33 @@
+import numpy as np
 import pandas as pd
 import logging 
 import os
 from typing import List
 
 from src._utils import (
-    setup_logging,
     clean_brand_name,
     clean_generic_name,
+    read_csv,
+    read_csv_header,
+    iter_csv_chunks,
+    prefetch,
+    CsvChunkWriter,
+    compressed_path,
+    concatenate_chunks,
+    write_csv,
 )
+from src.raw_index import check_plain_file, get_header_length, iter_chunks_with_spans, save_offsets_index
+from src.paths import (
+    FILTERED_LISTS_DIR,
+    RAW_DIR,
+    get_list_chunks_dir,
+    get_list_filtered_path,
+    get_op_raw_path,
+)
+from src.fuzzy_match import FuzzyDrugMatcher
+from src.match_cache import MatchCache, clean_values
 
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
 def get_ref_drug_names(ref_path):
@@ -25,7 +42,7 @@ def get_ref_drug_names(ref_path):
         list of unique drug names (brand and generic)
     """
     # Load ProstateDrugList.csv
-    ref_df = pd.read_csv(ref_path)
+    ref_df = read_csv(ref_path)
     brand_cols = [col for col in ref_df.columns if col.startswith('Brand_name')]
 
     # convert values in brand_cols and Generic_name to list
@@ -43,27 +60,6 @@ def get_ref_drug_names(ref_path):
     # double check for duplicates
     return list(set(ref_drug_names))
 
-def get_op_raw_path(year, dataset_type):
-    """
-    Get the path to the raw Open Payments data for a given year and dataset type
-    Args:
-        year (int): year of data
-        dataset_type (str): "general" or "research"
-    Returns:
-        str: path to raw file for given year and dataset type
-    """
-    acronym = "GNRL" if dataset_type == "general" else "RSRCH"
-    parent_dir = "data/raw/"
-    dataset_dir = f"{dataset_type}_payments/"
-    prefix = f"OP_DTL_{acronym}_PGYR{year}"
-    # Find the file in dataset_dir that starts with prefix
-    for file in os.listdir(parent_dir + dataset_dir):
-        if file.startswith(prefix):
-            return os.path.join(parent_dir + dataset_dir, file)
-    # log ValueError if not file found
-    logger.error(f"No file found for {year} {dataset_type}_payments")
-    raise ValueError(f"No file found for {year} {dataset_type}_payments")
-
 def get_op_drug_columns(df: pd.DataFrame, year: int) -> List[str]:
     """
     Get columns that contain drug names, case-insensitive. Handles different
@@ -86,43 +82,231 @@ def get_op_drug_columns(df: pd.DataFrame, year: int) -> List[str]:
         cols.extend([col for col in df.columns if col.lower().startswith(prefix.lower())])
     return cols
 
-def find_matches_op(chunk, drug_cols, ref_drug_names):
+def find_matches_op(chunk, drug_cols, ref_drug_names, cache=None):
     """
     In chunk, finds rows with drug names in drug_cols that match ref_drug_names.
-    Applies clean_brand_name to drug_name before matching.
+    Applies clean_brand_name to drug_name before matching, once per distinct
+    drug string of each column.
     Args:
         chunk (pd.DataFrame): chunk of raw OP data, max size 100k rows
         drug_cols (list): list of OP column names that contain drug names
         ref_drug_names (list): list of drug names to match against
+        cache (MatchCache): cache of cleaned drug strings, see match_cache
     Returns:
         filtered_chunk (pd.DataFrame): chunk of raw OP data with only the rows 
             that match the drug names. If no matches, returns empty 
             pd.DataFrame (with chunk column names)
     """
-    chunk_row_idx = []
-    chunk_matched_rows = 0
-    # iterate through rows
-    for idx, row in chunk.iterrows():
-        # iterate through drug_cols
-        for col in drug_cols:
-            drug_name = str(row[col])
-            if pd.isna(drug_name) or drug_name == 'nan':
-                continue
-            elif drug_name == '':
-                continue
-            # Apply clean_brand_name and then check against drug_names
-            drug_name = clean_brand_name(drug_name)
-            for tgt_name in ref_drug_names:
-                if drug_name == tgt_name:
-                    chunk_row_idx.append(idx)
-                    chunk_matched_rows += 1
-                    break  # Break out of tgt_name loop once we find a match
-            if drug_name == tgt_name:  # If we found a match in drug_names loop
-                break  # Break out of col loop to move to next row, else move to next column
-    filtered_chunk = chunk.loc[chunk_row_idx] # using row labels, not positions, so changed from iloc to loc
+    ref_drug_names = set(ref_drug_names)
+    mask = pd.Series(False, index=chunk.index)
+    for col in drug_cols:
+        cleaned = clean_values(chunk[col], cache)
+        mask |= cleaned.isin(ref_drug_names) & (cleaned != '')
+    filtered_chunk = chunk[mask] # row labels are kept
     return filtered_chunk
 
-def filter_open_payments(year, dataset_type, ref_path, op_path, dir_out):
+def find_fuzzy_matches_op(chunk, drug_cols, matcher):
+    """
+    In chunk, finds rows with a drug name in drug_cols that fuzzy-matches a
+    reference name (see fuzzy_match.FuzzyDrugMatcher). Exact matches after
+    clean_brand_name are always kept, as in find_matches_op.
+    Args:
+        chunk (pd.DataFrame): chunk of raw OP data
+        drug_cols (list): list of OP column names that contain drug names
+        matcher (FuzzyDrugMatcher): matcher, caching decisions across chunks
+    Returns:
+        filtered_chunk (pd.DataFrame): matching rows of chunk
+    """
+    mask = pd.Series(False, index=chunk.index)
+    for col in drug_cols:
+        mask |= matcher.match_mask(chunk[col])
+    return chunk[mask]
+
+def clear_chunks(dir_out, dataset_type, year):
+    """
+    Remove the chunks of a previous filter run of this dataset type and year
+    from dir_out, whatever their compression: a new run may write fewer
+    chunks or other extensions, and concatenate_chunks reads every file.
+    Returns:
+        int: number of files removed
+    """
+    if not os.path.isdir(dir_out):
+        return 0
+    prefix = f"{dataset_type}_{year}_chunk_"
+    stale = [file for file in os.listdir(dir_out) if file.startswith(prefix)]
+    for file in stale:
+        os.remove(os.path.join(dir_out, file))
+    if stale:
+        logger.info("Removed %s chunks of a previous run from %s", len(stale), dir_out)
+    return len(stale)
+
+def build_multi_list_lookup(ref_paths):
+    """
+    Build one lookup over several drug lists in the ProstateDrugList.csv
+    format (e.g. prostate, breast, lung), mapping each cleaned drug name to
+    the lists that contain it.
+    Args:
+        ref_paths (dict): list ID -> path to drug list csv
+    Returns:
+        dict: cleaned drug name -> tuple of list IDs
+    """
+    name2lists = {}
+    for list_id, ref_path in ref_paths.items():
+        for name in get_ref_drug_names(ref_path):
+            name2lists[name] = name2lists.get(name, ()) + (list_id,)
+    return name2lists
+
+def find_matches_op_multi(chunk, drug_cols, name2lists, list_ids):
+    """
+    In chunk, finds the rows matching each drug list in one pass: drug
+    strings are cleaned once per distinct value and looked up in the
+    combined name2lists map.
+    Args:
+        chunk (pd.DataFrame): chunk of raw OP data
+        drug_cols (list): list of OP column names that contain drug names
+        name2lists (dict): cleaned drug name -> list IDs, see build_multi_list_lookup
+        list_ids (list): IDs of all lists
+    Returns:
+        dict: list ID -> matching rows of chunk (possibly empty)
+    """
+    masks = {list_id: pd.Series(False, index=chunk.index) for list_id in list_ids}
+    for col in drug_cols:
+        cleaned = clean_values(chunk[col])
+        # distinct cleaned names of this column, grouped by the lists they hit
+        list2names = {}
+        for name in cleaned.unique():
+            for list_id in name2lists.get(name, ()):
+                list2names.setdefault(list_id, []).append(name)
+        for list_id, names in list2names.items():
+            masks[list_id] |= cleaned.isin(names)
+    return {list_id: chunk[mask] for list_id, mask in masks.items()}
+
+def filter_open_payments_multi(
+        year,
+        dataset_type,
+        ref_paths,
+        op_path,
+        dirs_out,
+        engine="auto",
+        pipelined=False,
+        queue_size=2,
+        chunksize=100_000,
+        compression=None
+        ):
+    """
+    Filter Open Payments data for several drug lists in a single scan of the
+    raw file. Matched rows of each list are saved to that list's directory,
+    with the same chunk file names as filter_open_payments, so the
+    concatenate and clean steps run unchanged per list.
+    Args:
+        year (int): year of OP data
+        dataset_type (str): "general" or "research"
+        ref_paths (dict): list ID -> path to drug list csv (ProstateDrugList.csv format)
+        op_path (str): path to raw OP file
+        dirs_out (dict): list ID -> directory to save filtered chunks to, ending with "/"
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+        pipelined (bool): overlap parsing, matching and writing, see filter_open_payments
+        queue_size (int): chunks held per queue in pipelined mode
+        chunksize (int): rows per chunk
+        compression (str): compress filtered chunks with "gzip" or "zstd"
+    Returns:
+        dict: list ID -> number of matched rows
+    """
+    if set(ref_paths) != set(dirs_out):
+        raise ValueError("ref_paths and dirs_out must have the same list IDs")
+    list_ids = list(ref_paths)
+    name2lists = build_multi_list_lookup(ref_paths)
+    for dir_out in dirs_out.values():
+        os.makedirs(dir_out, exist_ok=True)
+        clear_chunks(dir_out, dataset_type, year)
+
+    header = read_csv_header(op_path)
+    chunks = iter_csv_chunks(op_path, chunksize=chunksize, engine=engine, header=header)
+    writer = None
+    if pipelined:
+        chunks = prefetch(chunks, maxsize=queue_size)
+        writer = CsvChunkWriter(maxsize=queue_size)
+    op_drug_cols = get_op_drug_columns(pd.DataFrame(columns=header), year)
+
+    logger.info("Looking for matches of %s drug lists", len(list_ids))
+    total_matched_rows = dict.fromkeys(list_ids, 0)
+    for i, chunk in enumerate(chunks):
+        logger.info("Processing chunk %s", i)
+        for list_id, filtered_chunk in find_matches_op_multi(chunk, op_drug_cols, name2lists, list_ids).items():
+            if filtered_chunk.empty:
+                continue
+            chunk_path = compressed_path(f"{dirs_out[list_id]}{dataset_type}_{year}_chunk_{i}.csv", compression)
+            if writer is not None:
+                writer.write(filtered_chunk, chunk_path)
+            else:
+                write_csv(filtered_chunk, chunk_path)
+            total_matched_rows[list_id] += len(filtered_chunk)
+
+    if writer is not None:
+        writer.close()
+    for list_id, n_rows in total_matched_rows.items():
+        logger.info("Matched %s rows for %s %s, list %s", n_rows, year, dataset_type, list_id)
+    return total_matched_rows
+
+
+def filter_lists(
+        ref_paths, years, dataset_types, raw_dir=RAW_DIR, lists_dir=FILTERED_LISTS_DIR, compression=None,
+        engine="auto", pipelined=True
+        ):
+    """
+    Multi-list mode (python -m src filter-lists): filter every raw OP file of
+    the given years and dataset types once for all drug lists (see
+    filter_open_payments_multi), then concatenate each list's chunks into its
+    own filtered file (see paths.get_list_filtered_path).
+    Args:
+        ref_paths (dict): list ID -> path to drug list csv (ProstateDrugList.csv format)
+        years (iterable): OP years
+        dataset_types (iterable): "general" and/or "research"
+        raw_dir (str): raw OP files or zip bundles, see get_op_raw_path
+        lists_dir (str): output directory, one subdirectory per list ID
+        compression (str): compress filtered chunks and files with "gzip" or "zstd"
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+        pipelined (bool): overlap parsing, matching and writing
+    Returns:
+        dict: (list ID, dataset type, year) -> number of matched rows
+    """
+    counts = {}
+    for dataset_type in dataset_types:
+        for year in years:
+            dirs_out = {list_id: get_list_chunks_dir(list_id, dataset_type, year, lists_dir) for list_id in ref_paths}
+            matched = filter_open_payments_multi(
+                year, dataset_type, ref_paths, get_op_raw_path(year, dataset_type, raw_dir), dirs_out,
+                engine=engine, pipelined=pipelined, compression=compression
+            )
+            for list_id, dir_out in dirs_out.items():
+                filtered_path = compressed_path(get_list_filtered_path(list_id, dataset_type, year, lists_dir), compression)
+                counts[(list_id, dataset_type, year)] = matched[list_id]
+                if not matched[list_id]:
+                    # no chunks to concatenate; drop the file of a previous run
+                    if os.path.exists(filtered_path):
+                        os.remove(filtered_path)
+                    logger.info("No matches for list %s in %s %s", list_id, dataset_type, year)
+                    continue
+                os.makedirs(os.path.dirname(filtered_path), exist_ok=True)
+                concatenate_chunks(dir_out, filtered_path)
+    return counts
+
+def filter_open_payments(
+        year,
+        dataset_type,
+        ref_path,
+        op_path,
+        dir_out,
+        engine="auto",
+        offsets_index_path=None,
+        pipelined=False,
+        queue_size=2,
+        chunksize=100_000,
+        compression=None,
+        fuzzy=False,
+        review_path=None,
+        match_cache_path=None
+        ):
     """
     Filter Open Payments data for a given year and dataset type, keeping only
      rows that contain the drug names in ProstateDrugList.csv.
@@ -132,39 +316,114 @@ def filter_open_payments(year, dataset_type, ref_path, op_path, dir_out):
         year (int): year of OP data
         dataset_type (str): "general" or "research"
         ref_path (str): path to ProstateDrugList.csv
+        op_path (str): path to raw OP file
+        dir_out (str): directory to save filtered chunks to, ending with "/"
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+        offsets_index_path (str): if set, save a sidecar index (.npz) of the
+            byte offset and length of every matched raw row, for lookups with
+            raw_index.fetch_raw_records. The spans are recorded during the
+            scan (see raw_index.iter_chunks_with_spans, pandas C engine)
+        pipelined (bool): if True, parse the next chunk in a background
+            reader thread and write matched rows in a background writer
+            thread, with bounded queues of queue_size chunks in between
+        queue_size (int): chunks held per queue in pipelined mode
+        chunksize (int): rows per chunk
+        compression (str): compress filtered chunks with "gzip" or "zstd"
+            (.gz/.zst appended to chunk names), None for plain csv
+        fuzzy (bool): if True, also keep rows whose drug names fuzzy-match a
+            reference name (typos, added salts or forms), see fuzzy_match
+        review_path (str): in fuzzy mode, save the borderline and fuzzy
+            accepted drug strings to this csv for review
+        match_cache_path (str): SQLite cache of cleaned drug strings, shared
+            across runs and files (see match_cache). In fuzzy mode the fuzzy
+            decisions are saved to it, for clean_op_data(fuzzy=True) to give
+            the fuzzy accepted rows their matched drug name.
     Returns:
         None
     """
+    if offsets_index_path is not None:
+        # fail before the scan, not after it
+        check_plain_file(op_path)
     # get cleaned drug names (brand and generic) from ProstateDrugList.csv
     ref_drug_names = get_ref_drug_names(ref_path)
+    cache = MatchCache(ref_path, match_cache_path, fuzzy=fuzzy) if match_cache_path is not None else None
+    matcher = None
+    if fuzzy:
+        matcher = cache.fuzzy_matcher if cache is not None else FuzzyDrugMatcher(ref_drug_names)
 
     # # Load OP data for year/type
     # op_path = get_op_raw_path(year, dataset_type) ####################
     # logger.info("Raw data file: %s", op_path) ########################
     # load csv in chunks
-    chunksize = 100_000
-    chunks = pd.read_csv(op_path, chunksize=chunksize, dtype=str)
+    # read the header once, for the drug columns and the chunk reader
+    header = read_csv_header(op_path)
+    if offsets_index_path is not None:
+        # split the raw records here, keeping each row's byte span for the index (no second scan)
+        chunks = iter_chunks_with_spans(op_path, chunksize=chunksize)
+    else:
+        chunks = iter_csv_chunks(op_path, chunksize=chunksize, engine=engine, header=header)
+    writer = None
+    if pipelined:
+        chunks = prefetch(chunks, maxsize=queue_size)
+        writer = CsvChunkWriter(maxsize=queue_size)
 
     # Get drug columns
-    op_drug_cols = get_op_drug_columns(pd.read_csv(op_path, nrows=1), year)
+    op_drug_cols = get_op_drug_columns(pd.DataFrame(columns=header), year)
     # create dir_out if doesn't exist
     # dir_out = f"data/filtered/{dataset_type}_payments/{year}_chunks/" #####################
     # os.makedirs(dir_out, exist_ok=True) #############################
 
+    clear_chunks(dir_out, dataset_type, year)
     logger.info("Looking for matches")
     total_matched_rows = 0
+    matched_rows, matched_offsets, matched_lengths, matched_record_ids = [], [], [], []
     # Filter each chunk using exact drug name matches
     for i, chunk in enumerate(chunks):
+        if offsets_index_path is not None:
+            chunk, offsets, lengths = chunk
         logger.info("Processing chunk %s", i)
-        filtered_chunk = find_matches_op(chunk, op_drug_cols, ref_drug_names)
+        if matcher is not None:
+            filtered_chunk = find_fuzzy_matches_op(chunk, op_drug_cols, matcher)
+        else:
+            filtered_chunk = find_matches_op(chunk, op_drug_cols, ref_drug_names, cache)
         # Save to CSV if filtered chunk is not empty
         if not filtered_chunk.empty:
-            filtered_chunk.to_csv(f"{dir_out}{dataset_type}_{year}_chunk_{i}.csv", index=False)
+            chunk_path = compressed_path(f"{dir_out}{dataset_type}_{year}_chunk_{i}.csv", compression)
+            if writer is not None:
+                writer.write(filtered_chunk, chunk_path)
+            else:
+                write_csv(filtered_chunk, chunk_path)
             logger.info("Saved chunk %s, found %s matches", i, len(filtered_chunk))
             total_matched_rows += len(filtered_chunk)
+            if offsets_index_path is not None:
+                # row labels are row numbers in the raw file
+                positions = filtered_chunk.index.to_numpy() - chunk.index[0]
+                matched_rows.append(filtered_chunk.index.to_numpy())
+                matched_offsets.append(offsets[positions])
+                matched_lengths.append(lengths[positions])
+                if 'Record_ID' in filtered_chunk.columns:
+                    matched_record_ids.extend(filtered_chunk['Record_ID'].to_list())
         else:
             logger.info("Didn't find any matches in chunk %s", i)
 
+    if writer is not None:
+        writer.close()
+    if cache is not None:
+        if matcher is not None:
+            # save the fuzzy decisions, already made by cache.fuzzy_matcher
+            cache.lookup(list(matcher.decisions))
+        cache.close()
     logger.info("Matched %s rows for %s %s", total_matched_rows, year, dataset_type)
+    if matcher is not None and review_path is not None:
+        matcher.write_review_report(review_path)
+
+    if offsets_index_path is not None:
+        spans = [np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64) for arrays in (
+            matched_rows, matched_offsets, matched_lengths
+        )]
+        save_offsets_index(
+            offsets_index_path, *spans, get_header_length(op_path), matched_record_ids if matched_record_ids else None
+            )
+        logger.info("Indexed %s rows of %s in %s", len(spans[0]), op_path, offsets_index_path)
 
 
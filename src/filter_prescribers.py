@@ -2,25 +2,45 @@ import pandas as pd
 import logging
 import os
 import json
+import multiprocessing
+import re
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from src._utils import (
     setup_logging,
-    clean_brand_name,
     concatenate_chunks,
+    read_csv,
+    iter_csv_chunks,
+    open_csv_output,
+    CSV_ENCODING,
 )
+from src.match_cache import MatchCache, clean_values, contains_any
+from src.npi_validation import quarantine_invalid_npis, NPI_COLS
+from src.paths import YEAR2NPIS_PATH
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# Target drugs of the Part D prescribers (substring match on Brnd_Name, Gnrc_Name)
+PRESCRIBER_DRUG_NAMES = ['bicalutamide', 'abiraterone', 'enzalutamide', 'apalutamide', 'darolutamide']
+PRESCRIBER_DRUG_COLS = ['Brnd_Name', 'Gnrc_Name']
+RAW_PRESCRIBERS_DIR = "data/raw/prescribers/chunks/"
+# Prescriber types kept from the full national Part D files
+PRESCRIBER_TYPES = ['Radiation Oncology', 'Hematology-Oncology', 'Medical Oncology', 'Hematology', 'Urology']
+PRESCRIBER_COLS = ['Prscrbr_NPI', 'Prscrbr_Type', 'Brnd_Name', 'Gnrc_Name']
+FILTERED_PRESCRIBERS_PATH = "data/filtered/prescribers/prescribers_filtered_type_drug_names.csv"
+# Part D rows quarantined for an invalid Prscrbr_NPI, see get_final_npis
+INVALID_PRESCRIBER_NPIS_PATH = "data/filtered/prescribers/invalid_npis.csv"
 
-def add_years_to_raw_prescriber_chunks(dir_in, dir_out):
+
+def add_years_to_raw_prescriber_chunks(dir_in, dir_out, engine="auto"):
     """
     Modify all csv files in dir_in to add a Year column
     Args:
         dir_in (str): path to input directory
         dir_out (str): path to output directory
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
     Input files: 
         Manually downloaded from https://data.cms.gov/provider-summary-by-type-of-service/medicare-part-d-prescribers/medicare-part-d-prescribers-by-provider-and-drug
         Filenames: {year}_{specialty}.csv
@@ -35,49 +55,32 @@ def add_years_to_raw_prescriber_chunks(dir_in, dir_out):
     """
     for file in os.listdir(dir_in):
         year = file.split('_')[0]
-        df = pd.read_csv(os.path.join(dir_in, file), encoding='latin-1')
+        df = read_csv(os.path.join(dir_in, file), engine=engine)
         df['Year'] = str(year)
-        df.to_csv(os.path.join(dir_out, file), index=False)
+        df.to_csv(os.path.join(dir_out, file), index=False, encoding=CSV_ENCODING)
 
 
-def find_matches_prescribers(chunk, drug_cols, ref_drug_names):
+def find_matches_prescribers(chunk, drug_cols, ref_drug_names, cache=None):
     """
     Filters a single csv chunk to find rows with drug names in ref_drug_names.
-    Uses clean_brand_name to prep drug names in chunk row before checking 
-    against ref_drug_names.
+    Uses clean_brand_name to prep drug names in chunk before checking 
+    against ref_drug_names (substring match), once per distinct drug string.
     Args:
         chunk (pd.DataFrame)
         drug_cols (list): cols to check for drug names [Brnd_Name,Gnrc_Name]
         ref_drug_names (list): drug names to check for
+        cache (MatchCache): cache of cleaned drug strings, see match_cache
     Returns:
         filtered_chunk: pd.DataFrame
     """
-    chunk_row_idx = []
-    chunk_matched_rows = 0
-    # iterate through rows
-    for idx, row in chunk.iterrows():
-        # iterate through drug_cols
-        for col in drug_cols:
-            drug_name = str(row[col])
-            if pd.isna(drug_name) or drug_name == 'nan':
-                continue
-            elif drug_name == '':
-                continue
-            # Apply clean_brand_name and then check against drug_names
-            drug_name = clean_brand_name(drug_name)
-            for tgt_name in ref_drug_names:
-                if tgt_name in drug_name:
-                    chunk_row_idx.append(idx)
-                    chunk_matched_rows += 1
-                    break  # Break out of tgt_name loop once we find a match
-            if tgt_name in drug_name:  # If we found a match in drug_names loop
-                break  # Break out of col loop to move to next row, else move to next column
-    
-    filtered_chunk = chunk.loc[chunk_row_idx] # using row labels, not positions, so changed from iloc to loc
+    mask = pd.Series(False, index=chunk.index)
+    for col in drug_cols:
+        mask |= contains_any(clean_values(chunk[col], cache), ref_drug_names)
+    filtered_chunk = chunk[mask] # row labels are kept
     return filtered_chunk
 
 
-def filter_prescribers_by_drug_names(path_in, dir_out):
+def filter_prescribers_by_drug_names(path_in, dir_out, engine="auto", match_cache_path=None):
     """
     Filter Prescribers data to find qualifying NPIs. Saves filtered
     chunks (with matches) to individual csv files.
@@ -88,29 +91,133 @@ def filter_prescribers_by_drug_names(path_in, dir_out):
         dir_out (str): path to directory where filtered chunks are saved, 
             ending with "/"
             Filenames: dir_out/prescribers_chunk_{i+1}.csv
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+        match_cache_path (str): SQLite cache of cleaned drug strings, shared
+            with the OP steps (see match_cache)
     """
-    drug_names = ['bicalutamide', 'abiraterone', 'enzalutamide', 'apalutamide', 'darolutamide']
 
     # Chunk the df prescribers_filtered_type into 100_000 rows, then filter each chunk
     chunksize = 100_000
-    chunks = pd.read_csv(path_in, chunksize=chunksize, encoding='latin-1')
+    chunks = iter_csv_chunks(path_in, chunksize=chunksize, engine=engine)
     # Filter rows with drug names in Brnd_Name or Gnrc_Name
     total_matched_rows = 0
-    drug_cols = ['Brnd_Name', 'Gnrc_Name']
+    cache = MatchCache(db_path=match_cache_path) if match_cache_path is not None else None
 
     for i, chunk in enumerate(chunks):
-        filtered_chunk = find_matches_prescribers(chunk, drug_cols, drug_names)
+        filtered_chunk = find_matches_prescribers(chunk, PRESCRIBER_DRUG_COLS, PRESCRIBER_DRUG_NAMES, cache)
         # save filtered chunk to csv if not empty
         if not filtered_chunk.empty:
-            filtered_chunk.to_csv(f"{dir_out}prescribers_chunk_{i+1}.csv", index=False)
+            filtered_chunk.to_csv(f"{dir_out}prescribers_chunk_{i+1}.csv", index=False, encoding=CSV_ENCODING)
             logger.info("Saved chunk %s, found %s matches", i+1, len(filtered_chunk))
             total_matched_rows += len(filtered_chunk)
     
+    if cache is not None:
+        cache.close()
     logger.info("Matched %s rows for prescribers", total_matched_rows)
 
 
+def _normalize_types(values):
+    """Lowercase prescriber types, with '/' and '-' as spaces: "Hematology/Oncology" == "Hematology-Oncology"."""
+    return values.fillna('').str.lower().str.replace(r'[/\-\s]+', ' ', regex=True).str.strip()
+
+
+def get_part_d_year(path):
+    """
+    Get the data year of a full Part D by-provider-and-drug file from its
+    name: the CMS DY{yy} tag (MUP_DPR_RY24_P04_V10_DY22_NPIBN.csv is 2022),
+    else a 4-digit year (2022_part_d.csv).
+    Args:
+        path (str): path to the file
+    Returns:
+        int: year
+    """
+    name = os.path.basename(os.fspath(path))
+    match = re.search(r'DY(\d{2})(?!\d)', name)
+    if match:
+        return 2000 + int(match.group(1))
+    match = re.search(r'(?<!\d)(20\d{2})(?!\d)', name)
+    if match:
+        return int(match.group(1))
+    raise ValueError(f"No data year in Part D file name {name}")
+
+
+def filter_full_prescriber_file(path_in, year, path_out, chunksize=500_000, engine="auto"):
+    """
+    Filter a full national Part D by-provider-and-drug file (~25M rows) in
+    one streaming pass: only PRESCRIBER_COLS are parsed, rows are kept if
+    Prscrbr_Type is one of PRESCRIBER_TYPES and a drug name matches
+    PRESCRIBER_DRUG_NAMES (as in filter_prescribers_by_drug_names). Memory is
+    bounded by one chunk of four columns.
+    Args:
+        path_in (str): full Part D csv, plain, compressed or a zip member
+        year (int): data year, written to the Year column
+        path_out (str): filtered csv, cols PRESCRIBER_COLS + [Year]
+        chunksize (int): rows per chunk
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+    Returns:
+        int: number of rows kept
+    """
+    prescriber_types = set(_normalize_types(pd.Series(PRESCRIBER_TYPES)))
+    n_rows = n_kept = 0
+    with open_csv_output(path_out) as f:
+        pd.DataFrame(columns=PRESCRIBER_COLS + ['Year']).to_csv(f, index=False)
+        for chunk in iter_csv_chunks(path_in, chunksize=chunksize, engine=engine, usecols=PRESCRIBER_COLS):
+            n_rows += len(chunk)
+            chunk = chunk[_normalize_types(chunk['Prscrbr_Type']).isin(prescriber_types)]
+            chunk = find_matches_prescribers(chunk, PRESCRIBER_DRUG_COLS, PRESCRIBER_DRUG_NAMES)
+            chunk[PRESCRIBER_COLS].assign(Year=str(year)).to_csv(f, header=False, index=False)
+            n_kept += len(chunk)
+    logger.info("Kept %s of %s Part D rows for %s from %s", n_kept, n_rows, year, path_in)
+    return n_kept
+
+
+def filter_full_prescriber_files(paths, dir_out, max_workers=None, chunksize=500_000, engine="auto"):
+    """
+    Filter full national Part D files of several years in parallel, one year
+    per worker process, see filter_full_prescriber_file. Memory is bounded
+    by max_workers chunks.
+    Args:
+        paths (list): full Part D files, the year of each is taken from its
+            name (see get_part_d_year)
+        dir_out (str): directory for the filtered files
+            (prescribers_{year}.csv), ending with "/"
+        max_workers (int): worker processes (default: one per year, up to the CPU count)
+        chunksize (int): rows per chunk
+        engine (str): csv parse engine ("auto", "pyarrow" or "c")
+    Returns:
+        dict: year -> rows kept
+    """
+    year2path = {}
+    for path in paths:
+        year = get_part_d_year(path)
+        if year in year2path:
+            raise ValueError(f"Two Part D files for {year}: {year2path[year]} and {path}")
+        year2path[year] = path
+    os.makedirs(dir_out, exist_ok=True)
+    max_workers = max_workers or min(len(year2path), os.cpu_count() or 1) or 1
+    # spawned, not forked: scheduled runs call this from a stage thread, and
+    # forking a process that runs other threads can deadlock the workers
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {
+            year: executor.submit(
+                filter_full_prescriber_file, path, year, os.path.join(dir_out, f"prescribers_{year}.csv"),
+                chunksize, engine
+            )
+            for year, path in sorted(year2path.items())
+        }
+        return {year: future.result() for year, future in futures.items()}
+
+
+def find_full_prescriber_files(part_d_dir):
+    """Full Part D csv files (plain or compressed) in part_d_dir, sorted."""
+    return [
+        os.path.join(part_d_dir, file) for file in sorted(os.listdir(part_d_dir))
+        if re.search(r'\.csv(\.(gz|bz2|xz|zst))?$', file.lower())
+    ]
+
+
 # Step 2: Group by id and get sorted unique years where target_names appeared
-def get_final_npis(pathin_filtered_prescribers, pathout_final_npis):
+def get_final_npis(pathin_filtered_prescribers, pathout_final_npis, invalid_npis_path=None):
     """
     Get set of NPIs, per year, of prescribers who prescribed any of the target drugs in
     previous 3 consecutive years.
@@ -122,8 +229,12 @@ def get_final_npis(pathin_filtered_prescribers, pathout_final_npis):
         pathout_final_npis (str): path to output json with final set of NPIs per year
             Filename: data/filtered/prescribers/prescribers_year2npis.json
             Format: {year: [npis]}
+        invalid_npis_path (str): if set, rows whose Prscrbr_NPI fails NPI
+            validation (length, check digit) are saved to this csv and left out
     """
-    df = pd.read_csv(pathin_filtered_prescribers, dtype=str)
+    df = read_csv(pathin_filtered_prescribers)
+    if invalid_npis_path is not None:
+        df = quarantine_invalid_npis(df, NPI_COLS["prescribers"], invalid_npis_path)
     npi_groups = df.groupby('Prscrbr_NPI')
     npi_years = npi_groups.agg({'Year': list}).reset_index()
 
@@ -158,27 +269,52 @@ def get_final_npis(pathin_filtered_prescribers, pathout_final_npis):
 
 
 
-def main():
+def ingest_prescribers(part_d_dir=None, max_workers=None):
+    """
+    Filter the Part D prescribers by prescriber type and target drugs into
+    FILTERED_PRESCRIBERS_PATH (cols PRESCRIBER_COLS + [Year]).
+    Args:
+        part_d_dir (str): if set, read the full national Part D files in this
+            directory (filtered on prescriber type in-stream, years in
+            parallel) instead of the per-specialty chunks in RAW_PRESCRIBERS_DIR
+        max_workers (int): worker processes for the full files
+    """
+    if part_d_dir is not None:
+        dir_filtered_years = "data/filtered/prescribers/full_file_years/"
+        filter_full_prescriber_files(find_full_prescriber_files(part_d_dir), dir_filtered_years, max_workers)
+        concatenate_chunks(dir_filtered_years, FILTERED_PRESCRIBERS_PATH)
+        logger.info("Finished filtering full Part D files")
+        return
+
     # Add Year column to raw prescriber chunks
-    add_years_to_raw_prescriber_chunks("data/raw/prescribers/chunks/", "data/raw/prescribers/with_years/")
-    print("Finished adding years to raw prescriber chunks")
+    add_years_to_raw_prescriber_chunks(RAW_PRESCRIBERS_DIR, "data/raw/prescribers/with_years/")
+    logger.info("Finished adding years to raw prescriber chunks")
     # Concatenate raw prescribers chunks (already filtered by prescriber type)
     concatenate_chunks("data/raw/prescribers/with_years/", "data/filtered/prescribers/prescribers_filtered_prscrb_type.csv")
-    print("Finished concatenating prescribers chunks")
+    logger.info("Finished concatenating prescribers chunks")
     
     # Filter Prescribers by drug names, then save in chunks
     dir_prescribers_filtered_chunks = "data/filtered/prescribers/chunks/"
     filter_prescribers_by_drug_names("data/filtered/prescribers/prescribers_filtered_prscrb_type.csv", dir_prescribers_filtered_chunks)
-    print("Finished filtering prescribers by drug names")
+    logger.info("Finished filtering prescribers by drug names")
     # Concatenate filtered prescribers chunks
-    concatenate_chunks(dir_prescribers_filtered_chunks, "data/filtered/prescribers/prescribers_filtered_type_drug_names.csv")
-    print("Finished concatenating filtered prescribers chunks")
-    
-    # # 3. Get target set of NPIs and save to CSV
-    year2npis_path = "data/filtered/prescribers/prescribers_year2npis.json"
-    get_final_npis("data/filtered/prescribers/prescribers_filtered_type_drug_names.csv", year2npis_path)
-    print("Finished getting final npis")
+    concatenate_chunks(dir_prescribers_filtered_chunks, FILTERED_PRESCRIBERS_PATH)
+    logger.info("Finished concatenating filtered prescribers chunks")
 
 
+def main(part_d_dir=None, max_workers=None, validate_npis=False):
+    """
+    Filter the Part D prescribers and write prescribers_year2npis.json, see
+    ingest_prescribers. With validate_npis, rows with an invalid Prscrbr_NPI
+    are quarantined to INVALID_PRESCRIBER_NPIS_PATH.
+    """
+    ingest_prescribers(part_d_dir, max_workers)
+    # # 3. Get target set of NPIs and save to CSV
+    get_final_npis(
+        FILTERED_PRESCRIBERS_PATH, YEAR2NPIS_PATH, INVALID_PRESCRIBER_NPIS_PATH if validate_npis else None
+    )
+    logger.info("Finished getting final npis")
+
 if __name__ == "__main__":
+    setup_logging()
     main()
\ No newline at end of file
@@ -1,12 +1,12 @@
 import os
 import pandas as pd
 
-from src._utils import clean_generic_name
+from src._utils import clean_generic_name, read_csv
 
 
 
 def get_final_generic_names(ref_drug_names_path):
-    ref_df = pd.read_csv(ref_drug_names_path)
+    ref_df = read_csv(ref_drug_names_path)
     generic_names = ref_df['Generic_name']
     generic_names_cleaned = [clean_generic_name(name) for name in generic_names]
     generic_names_final = []
@@ -37,7 +37,7 @@ def replace_generic_names(df, generics_cleaned2final):
 
 
 def get_final_files(file_path, generics_cleaned2final, dir_out):
-    df = pd.read_csv(file_path)
+    df = read_csv(file_path)
     filename = os.path.basename(file_path)
     new_filename = f"{filename.split('.csv')[0]}_final.csv"
 
@@ -46,6 +46,18 @@ def get_final_files(file_path, generics_cleaned2final, dir_out):
     final_df.to_csv(os.path.join(dir_out, new_filename), index=False)
 
 
+def get_final_generics_path(file_path, dir_out):
+    """Path of the corrected copy of a final file written by get_final_files."""
+    filename = os.path.basename(file_path)
+    return os.path.join(dir_out, f"{filename.split('.csv')[0]}_final.csv")
+
+
+def finalize_generic_names(file_path, dir_out, ref_drug_names_path="data/reference/ProstateDrugList.csv"):
+    """Write the corrected copy of one final file (a pipeline stage, see main.pipeline_stages)."""
+    os.makedirs(dir_out, exist_ok=True)
+    get_final_files(file_path, get_final_generic_names(ref_drug_names_path), dir_out)
+
+
 
 def main():
     # dataset_types = ["general, research"]
@@ -0,0 +1,167 @@
+import difflib
+import logging
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from src._utils import (
+    clean_brand_name,
+    write_csv,
+)
+
+logger = logging.getLogger(__name__)
+
+# Scores at or above ACCEPT_SCORE are matches; scores in [REVIEW_SCORE, ACCEPT_SCORE)
+# are rejected but listed in the review report
+ACCEPT_SCORE = 0.9
+REVIEW_SCORE = 0.75
+# Reference names shorter than this are only matched by edit similarity, not containment
+MIN_CONTAINMENT_LENGTH = 5
+# Padding marking the start of a name, so trigram containment is anchored there
+PAD = "$"
+REVIEW_COLS = ['Raw_Drug_Name', 'Cleaned_Name', 'Matched_Name', 'Score', 'Decision', 'Count']
+
+
+def trigrams(name):
+    """
+    Get the set of trigrams of a cleaned name, padded at the start:
+    "xtandi" -> {"$xt", "xta", "tan", "and", "ndi"}
+    """
+    padded = PAD + name
+    return {padded[i:i + 3] for i in range(max(len(padded) - 2, 1))}
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigram to the reference drug names containing it.
+    Only names sharing trigrams with a query are scored, instead of all names.
+    """
+
+    def __init__(self, ref_drug_names, min_shared=2):
+        """
+        Args:
+            ref_drug_names (list): cleaned reference names (see filter_op.get_ref_drug_names)
+            min_shared (int): trigrams a name must share with a query to be scored
+        """
+        self.names = sorted(set(name for name in ref_drug_names if name))
+        self.grams = [trigrams(name) for name in self.names]
+        self.postings = defaultdict(list)
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings[gram].append(i)
+        self.min_shared = min_shared
+
+    def score(self, query, i):
+        """
+        Score a cleaned query against reference name i, in [0, 1]: the best of
+        edit similarity (typos, "xtandii") and the share of the name's trigrams
+        found from the start of the query (added salts/forms,
+        "abirateroneacetate", "luprondepotped").
+        """
+        name = self.names[i]
+        score = difflib.SequenceMatcher(None, query, name, autojunk=False).ratio()
+        if len(name) >= MIN_CONTAINMENT_LENGTH and len(query) > len(name):
+            containment = len(self.grams[i] & trigrams(query)) / len(self.grams[i])
+            score = max(score, containment)
+        return score
+
+    def best_match(self, query):
+        """
+        Find the best scoring reference name for a cleaned query.
+        Returns:
+            tuple (name, score), (None, 0.0) if no name shares enough trigrams
+        """
+        shared = Counter()
+        for gram in trigrams(query):
+            shared.update(self.postings.get(gram, ()))
+        best_name, best_score = None, 0.0
+        for i, count in shared.items():
+            if count < self.min_shared:
+                continue
+            score = self.score(query, i)
+            if score > best_score:
+                best_name, best_score = self.names[i], score
+        return best_name, best_score
+
+
+class FuzzyDrugMatcher:
+    """
+    Accept/reject decisions for raw OP drug strings, cached per distinct string
+    so each one is cleaned and scored once per run, however often it occurs.
+    """
+
+    def __init__(self, ref_drug_names, accept_score=ACCEPT_SCORE, review_score=REVIEW_SCORE):
+        """
+        Args:
+            ref_drug_names (list): cleaned reference names
+            accept_score (float): minimum score of a match
+            review_score (float): minimum score of a rejected name to list for review
+        """
+        self.index = TrigramIndex(ref_drug_names)
+        self.exact = set(self.index.names)
+        self.accept_score = accept_score
+        self.review_score = review_score
+        # raw string -> (cleaned, matched name, score, accepted)
+        self.decisions = {}
+        # occurrences of each raw string in the scanned drug columns
+        self.counts = Counter()
+
+    def decide(self, raw_name):
+        """
+        Decide whether a raw drug string matches a reference name.
+        Returns:
+            bool: True if accepted
+        """
+        decision = self.decisions.get(raw_name)
+        if decision is None:
+            cleaned = clean_brand_name(raw_name)
+            if not cleaned:
+                decision = (cleaned, None, 0.0, False)
+            elif cleaned in self.exact:
+                decision = (cleaned, cleaned, 1.0, True)
+            else:
+                name, score = self.index.best_match(cleaned)
+                decision = (cleaned, name, score, score >= self.accept_score)
+            self.decisions[raw_name] = decision
+        return decision[3]
+
+    def match_mask(self, values: pd.Series) -> pd.Series:
+        """
+        Get a boolean mask of the accepted values of a drug column. Only the
+        distinct strings of the column are looked up.
+        """
+        present = values.dropna()
+        present = present[present != '']
+        distinct = present.value_counts()
+        self.counts.update(distinct.to_dict())
+        accepted = [raw_name for raw_name in distinct.index if self.decide(raw_name)]
+        return values.isin(accepted)
+
+    def review_report(self) -> pd.DataFrame:
+        """
+        Get the fuzzy decisions to review: accepted non-exact matches and
+        rejected names scoring at least review_score, most frequent first.
+        Returns:
+            pd.DataFrame: cols REVIEW_COLS
+        """
+        rows = []
+        for raw_name, (cleaned, name, score, accepted) in self.decisions.items():
+            if cleaned == name or score < self.review_score:
+                continue
+            rows.append([
+                raw_name, cleaned, name, round(score, 3),
+                "accepted" if accepted else "rejected", self.counts[raw_name]
+            ])
+        report = pd.DataFrame(rows, columns=REVIEW_COLS)
+        return report.sort_values(['Count', 'Raw_Drug_Name'], ascending=[False, True], ignore_index=True)
+
+    def write_review_report(self, path):
+        """
+        Save review_report to csv.
+        Returns:
+            int: number of rows written
+        """
+        report = self.review_report()
+        write_csv(report, path)
+        logger.info("Wrote %s fuzzy matches to review in %s", len(report), path)
+        return len(report)
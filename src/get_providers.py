@@ -1,13 +1,15 @@
 import pandas as pd
 
+from src._utils import read_csv, CSV_ENCODING
+
 
 def get_providers(filein, fileout):
-    df = pd.read_csv(filein, dtype=str)
+    df = read_csv(filein, usecols=['Covered_Recipient_Profile_ID', 'Covered_Recipient_NPI'])
     providers_npi_id = df[['Covered_Recipient_Profile_ID', 'Covered_Recipient_NPI']].copy()
     # fill na with empty string
     providers_npi_id = providers_npi_id.fillna('')
     # save to csv
-    providers_npi_id.to_csv(fileout, index=False)
+    providers_npi_id.to_csv(fileout, index=False, encoding=CSV_ENCODING)
 
 def main():
     filein = "data/reference/OP_CVRD_RCPNT_PRFL_SPLMTL_P01302025_01212025.csv"
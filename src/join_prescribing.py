@@ -0,0 +1,169 @@
+import logging
+import os
+import tempfile
+from collections import defaultdict
+
+import pandas as pd
+
+from src._utils import (
+    clean_brand_name,
+    iter_csv_chunks,
+    read_csv,
+    read_csv_header,
+    CSV_ENCODING,
+)
+from src.npi_validation import NPI_COLS
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_COL = 'Total_Amt_of_Payment_USDollars'
+# Part D volume columns summed per (NPI, year) when present in the prescribers file
+PRESCRIBING_SUM_COLS = ['Tot_Clms', 'Tot_30day_Fills', 'Tot_Day_Suply', 'Tot_Drug_Cst', 'Tot_Benes']
+
+
+def clean_npis(npis: pd.Series) -> pd.Series:
+    """
+    Normalize NPI strings for joins: strip whitespace and float artifacts
+    ("1234567890.0"). Missing values become ''.
+    """
+    return npis.fillna('').astype(str).str.strip().str.replace(r'\.0+$', '', regex=True)
+
+
+def partition_prescribers_by_year(prescribers_path, dir_out, chunksize=100_000):
+    """
+    Stream the filtered prescribers file once and spill its rows into one
+    partition file per Year, so each year can be joined on its own.
+    Args:
+        prescribers_path (str): path to prescribers_filtered_type_drug_names.csv
+            Cols: [Prscrbr_NPI,Prscrbr_Type,Brnd_Name,Gnrc_Name,Year, ...]
+        dir_out (str): directory for the partition files
+        chunksize (int): rows per chunk
+    Returns:
+        dict: year (int) -> path to partition file
+    """
+    header = read_csv_header(prescribers_path)
+    usecols = ['Prscrbr_NPI', 'Gnrc_Name', 'Year'] + [col for col in PRESCRIBING_SUM_COLS if col in header]
+    year2path = {}
+    for chunk in iter_csv_chunks(prescribers_path, chunksize=chunksize, usecols=usecols, header=header):
+        for year, part in chunk.groupby('Year'):
+            year = int(float(year))
+            path = os.path.join(dir_out, f"prescribers_{year}.csv")
+            part.to_csv(path, mode='a', header=year not in year2path, index=False, encoding=CSV_ENCODING)
+            year2path[year] = path
+    return year2path
+
+
+def aggregate_prescribing(partition_path):
+    """
+    Aggregate one year partition of prescribers per NPI.
+    Args:
+        partition_path (str): partition file written by partition_prescribers_by_year
+    Returns:
+        pd.DataFrame: indexed by NPI, cols Prescribing_Rows, Target_Drug_Count
+            and the sums of PRESCRIBING_SUM_COLS present in the file
+    """
+    df = read_csv(partition_path)
+    df['NPI'] = clean_npis(df['Prscrbr_NPI'])
+    df['Gnrc_Name'] = df['Gnrc_Name'].map(clean_brand_name)
+    sum_cols = [col for col in PRESCRIBING_SUM_COLS if col in df.columns]
+    for col in sum_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    grouped = df[df['NPI'] != ''].groupby('NPI')
+    result = grouped.agg(
+        Prescribing_Rows=('Gnrc_Name', 'size'),
+        Target_Drug_Count=('Gnrc_Name', 'nunique'),
+    )
+    if sum_cols:
+        result = result.join(grouped[sum_cols].sum())
+    return result
+
+
+def aggregate_payments(final_path, dataset_type, chunksize=100_000):
+    """
+    Stream one final OP table and aggregate payments per NPI. For research
+    files a record counts for every NPI column it lists (recipient and PIs).
+    Args:
+        final_path (str): final table written by clean_op_data
+        dataset_type (str): "general" or "research"
+        chunksize (int): rows per chunk
+    Returns:
+        pd.DataFrame: indexed by NPI, cols {dataset_type}_Payment_Total,
+            {dataset_type}_Payment_Count
+    """
+    header = read_csv_header(final_path)
+    npi_cols = [col for col in NPI_COLS[dataset_type] if col in header]
+    totals = defaultdict(float)
+    counts = defaultdict(int)
+    for chunk in iter_csv_chunks(final_path, chunksize=chunksize, usecols=npi_cols + [AMOUNT_COL], header=header):
+        amounts = pd.to_numeric(chunk[AMOUNT_COL], errors='coerce').fillna(0.0)
+        long = pd.concat(
+            [pd.DataFrame({'Row': chunk.index, 'NPI': clean_npis(chunk[col]), 'Amount': amounts}) for col in npi_cols],
+            ignore_index=True
+        )
+        # one entry per (record, NPI), an NPI listed twice in a record counts once
+        long = long[long['NPI'] != ''].drop_duplicates(['Row', 'NPI'])
+        partial = long.groupby('NPI')['Amount'].agg(['sum', 'size'])
+        for npi, total, count in partial.itertuples(name=None):
+            totals[npi] += total
+            counts[npi] += count
+    return pd.DataFrame({
+        f"{dataset_type}_Payment_Total": pd.Series(totals, dtype=float),
+        f"{dataset_type}_Payment_Count": pd.Series(counts, dtype='int64'),
+    }).rename_axis('NPI')
+
+
+def join_payments_prescribing(prescribers_path, final_files, fileout, how="left", tmp_dir=None, chunksize=100_000):
+    """
+    Build the per-(NPI, year) table of OP payment totals alongside Part D
+    prescribing of the target drugs. Both sides are partitioned by year and
+    joined one year at a time, so memory is bounded by one year of NPIs.
+    Args:
+        prescribers_path (str): filtered prescribers file from filter_prescribers
+            (data/filtered/prescribers/prescribers_filtered_type_drug_names.csv)
+        final_files (list): tuples (dataset_type, year, path) of final OP
+            tables, see record_index.find_final_files
+        fileout (str): path to output csv
+        how (str): "left" keeps paid NPIs only, "outer" also keeps prescribers
+            without payments
+        tmp_dir (str): directory for prescriber partitions (temporary if None)
+        chunksize (int): rows per chunk
+    Returns:
+        int: number of output rows
+    """
+    year2files = defaultdict(list)
+    for dataset_type, year, path in final_files:
+        year2files[int(year)].append((dataset_type, path))
+    # fixed output columns, so every year appends to the same layout
+    out_cols = ['Year', 'NPI']
+    for dataset_type in ["general", "research"]:
+        if any(file_type == dataset_type for file_type, _, _ in final_files):
+            out_cols += [f"{dataset_type}_Payment_Total", f"{dataset_type}_Payment_Count"]
+    prescribers_header = read_csv_header(prescribers_path)
+    out_cols += ['Prescribing_Rows', 'Target_Drug_Count'] + [
+        col for col in PRESCRIBING_SUM_COLS if col in prescribers_header
+    ]
+
+    n_rows = 0
+    written = False
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as partitions_dir:
+        year2prescribers = partition_prescribers_by_year(prescribers_path, partitions_dir, chunksize)
+        years = sorted(year2files) if how == "left" else sorted(set(year2files) | set(year2prescribers))
+        for year in years:
+            payments = pd.DataFrame(index=pd.Index([], name='NPI'))
+            for dataset_type, path in year2files.get(year, []):
+                payments = payments.join(aggregate_payments(path, dataset_type, chunksize), how='outer')
+            if year in year2prescribers:
+                prescribing = aggregate_prescribing(year2prescribers[year])
+            else:
+                prescribing = pd.DataFrame(index=pd.Index([], name='NPI'))
+            joined = payments.join(prescribing, how=how).reset_index()
+            joined['Year'] = year
+            joined = joined.reindex(columns=out_cols).sort_values('NPI')
+            # no payment / no prescribing of target drugs is a zero, not a gap
+            zero_cols = [col for col in out_cols if col.endswith(('_Total', '_Count', '_Rows'))]
+            joined[zero_cols] = joined[zero_cols].fillna(0)
+            joined.to_csv(fileout, mode='a' if written else 'w', header=not written, index=False, encoding=CSV_ENCODING)
+            written = True
+            n_rows += len(joined)
+            logger.info("Joined %s NPIs for %s", len(joined), year)
+    return n_rows
@@ -0,0 +1,38 @@
+import logging
+import os
+from datetime import datetime
+
+LOG_DIR = "data/logs"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# log file of the current process, set by the first setup_logging call
+_log_filename = None
+
+
+def setup_logging(log_dir=LOG_DIR, level=logging.INFO):
+    """
+    Configure logging to output to both file and console with timestamped
+    filename. Called once by entry points (CLI, script mains), never at
+    import time; later calls return the same log file.
+    Args:
+        log_dir (str): directory of the log file, None for console only
+        level (int): logging level
+    Returns:
+        str: path to log file, None if console only
+    """
+    global _log_filename
+    if _log_filename is not None:
+        return _log_filename
+
+    handlers = [logging.StreamHandler()]  # This will also print to console
+    if log_dir is not None:
+        # Create logs directory if it doesn't exist
+        os.makedirs(log_dir, exist_ok=True)
+        # Create timestamp for filename
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        _log_filename = os.path.join(log_dir, f'op_cleaner_{timestamp}.log')
+        handlers.append(logging.FileHandler(_log_filename))
+    else:
+        _log_filename = ""
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=handlers)
+    return _log_filename or None
@@ -5,6 +5,8 @@ import time
 from src._utils import (
     setup_logging,
     concatenate_chunks,
+    compressed_path,
+    split_zip_path,
 )
 
 from src.filter_op import (
@@ -13,53 +15,296 @@ from src.filter_op import (
 )
 
 from src.clean_final_tables import (
+    enable_copy_on_write,
+    get_clean_side_outputs,
     run_op_cleaner,
 )
+from src.dedup import (
+    dedup_record_ids,
+    write_dedup_report,
+)
+from src.filter_prescribers import (
+    FILTERED_PRESCRIBERS_PATH,
+    INVALID_PRESCRIBER_NPIS_PATH,
+    RAW_PRESCRIBERS_DIR,
+    get_final_npis,
+    ingest_prescribers,
+)
+from src.fix_final_generic_names import (
+    finalize_generic_names,
+    get_final_generics_path,
+)
+from src.paths import (
+    RAW_DIR,
+    REF_PATH,
+    YEAR2NPIS_PATH,
+    MATCH_CACHE_PATH,
+    DEDUP_REPORT_PATH,
+    RUN_REPORT_PATH,
+    STAMPS_DIR,
+    FINAL_GENERICS_DIR,
+    YEARS,
+    DATASET_TYPES,
+    get_filtered_chunks_dir,
+    get_filtered_path,
+    get_final_path,
+)
+from src.scheduler import (
+    Stage,
+    run_stages,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _filter_stage(year, dataset_type, op_data_path, dir_out, compression=None, match_cache_path=None):
+    """Filter stage: raw OP file -> filtered chunks in dir_out."""
+    os.makedirs(dir_out, exist_ok=True)
+    filter_open_payments(
+        year, dataset_type, REF_PATH, op_data_path, dir_out,
+        compression=compression, match_cache_path=match_cache_path
+        )
+
 
-setup_logging()
-logger = logging.getLogger(__name__)    
+def _concatenate_stage(dir_out, filtered_op_file, dedup=False):
+    """Concatenate stage: filtered chunks -> one file, deduplicated on Record_ID if dedup."""
+    concatenate_chunks(dir_out, filtered_op_file)
+    if dedup:
+        return dedup_record_ids(filtered_op_file, filtered_op_file)
 
 
+def _stamp_path(name):
+    return f"{STAMPS_DIR}{name.replace(':', '_')}.json"
 
-def main():
+
+def pipeline_stages(
+        years=YEARS,
+        dataset_types=DATASET_TYPES,
+        raw_dir=RAW_DIR,
+        year2npis_path=YEAR2NPIS_PATH,
+        compression=None,
+        match_cache_path=MATCH_CACHE_PATH,
+        clean_chunksize=None,
+        validate_npis=False,
+        dedup=False,
+        dataset_dir=None,
+        store_path=None,
+        cube_path=None,
+        typed=None,
+        recipients=False,
+        prescribers=False,
+        part_d_dir=None,
+        final_generics=False
+        ):
+    """
+    Build the stages of a scheduled run (see scheduler.run_stages): per
+    dataset type and year, filter -> concatenate -> clean, and optionally
+    prescriber ingest -> NPI qualification before every clean stage and
+    generic-name finalization after each. Options are those of main;
+    validate_npis also quarantines invalid Part D Prscrbr_NPIs in NPI
+    qualification. The NPI qualification, concatenate and clean stages
+    have stamp files, so they rerun when their options change (see
+    scheduler.write_stamp); the side outputs of the options are declared
+    as stage outputs.
+    Args:
+        prescribers (bool): also filter the Part D prescribers and write
+            year2npis_path (see filter_prescribers.ingest_prescribers)
+        part_d_dir (str): full national Part D files for the prescriber
+            ingest (default: the per-specialty chunks)
+        final_generics (bool): also write the final tables with final
+            generic names to FINAL_GENERICS_DIR (see fix_final_generic_names)
+    Returns:
+        list: Stage objects
+    """
+    stages = []
+    if prescribers:
+        stages.append(Stage(
+            "prescriber_ingest", ingest_prescribers, kwargs={'part_d_dir': part_d_dir},
+            inputs=(part_d_dir or RAW_PRESCRIBERS_DIR,), outputs=(FILTERED_PRESCRIBERS_PATH,),
+        ))
+        invalid_npis_path = INVALID_PRESCRIBER_NPIS_PATH if validate_npis else None
+        stages.append(Stage(
+            "npi_qualification", get_final_npis, args=(FILTERED_PRESCRIBERS_PATH, year2npis_path, invalid_npis_path),
+            inputs=(FILTERED_PRESCRIBERS_PATH,),
+            outputs=(year2npis_path,) + ((invalid_npis_path,) if validate_npis else ()),
+            stamp=_stamp_path("npi_qualification"),
+        ))
+    # clean stages writing to one dataset manifest, analytics store or cube store run one at a time
+    resources = tuple(
+        name for name, option in [("dataset", dataset_dir), ("store", store_path), ("cubes", cube_path)]
+        if option is not None
+    )
+    for dataset_type in dataset_types:
+        for year in years:
+            op_data_path = get_op_raw_path(year, dataset_type, raw_dir)
+            dir_out = get_filtered_chunks_dir(dataset_type, year)
+            filtered_op_file = compressed_path(get_filtered_path(dataset_type, year), compression)
+            fileout = compressed_path(get_final_path(dataset_type, year), compression)
+            stages.append(Stage(
+                f"filter:{dataset_type}:{year}", _filter_stage,
+                args=(year, dataset_type, op_data_path, dir_out),
+                kwargs={'compression': compression, 'match_cache_path': match_cache_path},
+                # a csv inside a zip bundle is as new as the bundle
+                inputs=(split_zip_path(op_data_path)[0] or op_data_path, REF_PATH), outputs=(dir_out,),
+            ))
+            stages.append(Stage(
+                f"concatenate:{dataset_type}:{year}", _concatenate_stage, args=(dir_out, filtered_op_file, dedup),
+                inputs=(dir_out,), outputs=(filtered_op_file,), stamp=_stamp_path(f"concatenate:{dataset_type}:{year}"),
+            ))
+            stages.append(Stage(
+                f"clean:{dataset_type}:{year}", run_op_cleaner, args=(filtered_op_file, dataset_type, year, year2npis_path),
+                kwargs={
+                    'compression': compression, 'match_cache_path': match_cache_path, 'chunksize': clean_chunksize,
+                    'validate_npis': validate_npis, 'dataset_dir': dataset_dir, 'store_path': store_path,
+                    'cube_path': cube_path, 'typed': typed, 'recipients': recipients,
+                },
+                inputs=(
+                    filtered_op_file, year2npis_path, REF_PATH,
+                    f"data/reference/col_names/{dataset_type}_payments/grace_cols.csv",
+                ),
+                outputs=(fileout,) + get_clean_side_outputs(
+                    fileout, dataset_type, year, validate_npis, dataset_dir, typed, recipients
+                ),
+                resources=resources, stamp=_stamp_path(f"clean:{dataset_type}:{year}"),
+            ))
+            if final_generics:
+                stages.append(Stage(
+                    f"final_generics:{dataset_type}:{year}", finalize_generic_names, args=(fileout, FINAL_GENERICS_DIR),
+                    inputs=(fileout, REF_PATH), outputs=(get_final_generics_path(fileout, FINAL_GENERICS_DIR),),
+                ))
+    return stages
+
+
+def main(
+        years=YEARS,
+        dataset_types=DATASET_TYPES,
+        raw_dir=RAW_DIR,
+        year2npis_path=YEAR2NPIS_PATH,
+        compression=None,
+        match_cache_path=MATCH_CACHE_PATH,
+        clean_chunksize=None,
+        validate_npis=False,
+        dedup=False,
+        dataset_dir=None,
+        store_path=None,
+        cube_path=None,
+        typed=None,
+        recipients=False,
+        workers=None,
+        prescribers=False,
+        part_d_dir=None,
+        final_generics=False,
+        force=False
+        ):
+    """
+    Run the pipeline (filter, concatenate, clean) for the given years and
+    dataset types. Run from the command line with: python -m src run --help
+    Args:
+        years (iterable): years of OP data (2014-2023)
+        dataset_types (iterable): "general" and/or "research"
+        raw_dir (str): directory of the raw OP files or zip bundles, see get_op_raw_path
+        year2npis_path (str): path to prescribers_year2npis.json written by
+            filter_prescribers.py
+        compression (str): compress intermediate and final csv outputs with
+            "gzip" or "zstd", None for plain csv. Raw inputs may be extracted
+            csv files or the CMS zip bundles, see get_op_raw_path.
+        match_cache_path (str): SQLite cache of drug string decisions reused
+            across years and runs (None to disable)
+        clean_chunksize (int): clean each filtered file in chunks of this many
+            rows, for files too large to clean in memory (None: whole file)
+        validate_npis (bool): quarantine rows with invalid NPIs (length,
+            check digit) next to the missing_npis output, and scheduled
+            with prescribers, Part D rows to INVALID_PRESCRIBER_NPIS_PATH
+        dedup (bool): keep only the latest version of each Record_ID in the
+            filtered files before cleaning; duplicates removed per year are
+            saved to DEDUP_REPORT_PATH
+        dataset_dir (str): also write the final tables as one dataset
+            partitioned by dataset_type= and year= (e.g. DATASET_DIR), see
+            partitioned_dataset
+        store_path (str): also load the final tables into this SQLite
+            analytics store (e.g. STORE_PATH), one table per dataset type,
+            see analytics_store
+        cube_path (str): also maintain pre-aggregated payment cubes in this
+            SQLite file (e.g. CUBES_PATH), one slice per year, see aggregate_cubes
+        typed (str): also write typed parquet copies of the final tables,
+            amounts as "float" or "cents", see typed_output
+        recipients (bool): also save the long recipient tables (one row per
+            Record_ID and recipient role), see recipients
+        workers (int): run the stages of pipeline_stages with the scheduler,
+            this many at a time, skipping stages whose outputs are up to date;
+            the stage report (with the critical path) is saved to
+            RUN_REPORT_PATH. Implied by prescribers, final_generics and force.
+        prescribers (bool): scheduled: also run the prescriber stages first
+        part_d_dir (str): scheduled: full national Part D files for the prescriber stages
+        final_generics (bool): scheduled: also finalize generic names of the final tables
+        force (bool): scheduled: run every stage, even if up to date
+    """
+    enable_copy_on_write()
+    if match_cache_path is not None:
+        os.makedirs(os.path.dirname(match_cache_path), exist_ok=True)
+    if workers is not None or prescribers or final_generics or force:
+        stages = pipeline_stages(
+            years, dataset_types, raw_dir, year2npis_path, compression, match_cache_path, clean_chunksize,
+            validate_npis, dedup, dataset_dir, store_path, cube_path, typed, recipients, prescribers, part_d_dir,
+            final_generics
+        )
+        _, results = run_stages(stages, max_workers=workers, force=force, report_path=RUN_REPORT_PATH)
+        if dedup:
+            # only the years concatenated in this run
+            duplicates_removed = {}
+            for name, n_removed in results.items():
+                step, dataset_type, year = (name.split(":") + [None, None])[:3]
+                if step == "concatenate":
+                    duplicates_removed[(dataset_type, int(year))] = n_removed
+            write_dedup_report(duplicates_removed, DEDUP_REPORT_PATH)
+        return
+    duplicates_removed = {}
     # 1. Filter Prescribers: one-time filtering; done separately using filter_prescribers.py
-    year2npis_path = "data/filtered/prescribers/prescribers_year2npis.json"
-    
-    # 2. Filter Open Payments (2014-2023) in chunks by target drug names
-    prostate_drug_list_path = "data/reference/ProstateDrugList.csv"
-    years = range(2014, 2024)
-    dataset_types = ["general", "research"]
+
+    # 2. Filter Open Payments in chunks by target drug names
     # Filter in chunks and save intermediary files
     for dataset_type in dataset_types:
         for year in years:
             start_time = time.time()
             logger.info("Processing %s, %s", dataset_type, year)
             # get op data file
-            op_data_path = get_op_raw_path(year, dataset_type)
+            op_data_path = get_op_raw_path(year, dataset_type, raw_dir)
             # get dir to save filtered chunks
-            dir_out = f"data/filtered/{dataset_type}_payments/{year}_chunks/"
+            dir_out = get_filtered_chunks_dir(dataset_type, year)
             os.makedirs(dir_out, exist_ok=True)
             # filter op data
             filter_open_payments(
-                year, dataset_type, prostate_drug_list_path, op_data_path, dir_out
+                year, dataset_type, REF_PATH, op_data_path, dir_out,
+                compression=compression, match_cache_path=match_cache_path
                 )
             logger.info("Finished filtering %s payments for %s", dataset_type, year)
             # Concatenate filtered chunks and save to full file
-            op_chunks_dirs = f"data/filtered/{dataset_type}_payments/{year}_chunks/"
-            filtered_op_file = f"data/filtered/{dataset_type}_payments/full_files/{dataset_type}_{year}.csv"
-            concatenate_chunks(op_chunks_dirs, filtered_op_file)
+            filtered_op_file = compressed_path(get_filtered_path(dataset_type, year), compression)
+            concatenate_chunks(dir_out, filtered_op_file)
             logger.info("Finished concatenating %s payments for %s", dataset_type, year)
+            if dedup:
+                duplicates_removed[(dataset_type, year)] = dedup_record_ids(filtered_op_file, filtered_op_file)
 
             # 3. Clean Open Payments data and Save to csv
             logger.info(f"Cleaning {dataset_type} payments for {year}")
-            run_op_cleaner(filtered_op_file, dataset_type, year, year2npis_path)
-            logger.info("Finished cleaning %s payments for year %s")
+            run_op_cleaner(
+                filtered_op_file, dataset_type, year, year2npis_path,
+                compression=compression, match_cache_path=match_cache_path, chunksize=clean_chunksize,
+                validate_npis=validate_npis, dataset_dir=dataset_dir, store_path=store_path,
+                cube_path=cube_path, typed=typed, recipients=recipients
+                )
+            logger.info("Finished cleaning %s payments for year %s", dataset_type, year)
 
             end_time = time.time()
             elapsed_time = end_time - start_time
             logger.info("Total execution time for %s, %s: %.2f seconds", dataset_type, year, elapsed_time)
 
+    if dedup:
+        write_dedup_report(duplicates_removed, DEDUP_REPORT_PATH)
+        logger.info("Saved duplicates removed per year to %s", DEDUP_REPORT_PATH)
+
 
 
 if __name__ == "__main__":
+    setup_logging()
     main()
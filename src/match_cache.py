@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from src._utils import (
+    clean_brand_name,
+)
+from src.fuzzy_match import ACCEPT_SCORE, FuzzyDrugMatcher
+from src.paths import REF_PATH, MATCH_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Bump when clean_brand_name / clean_generic_name change, to invalidate cached decisions
+NORMALIZER_VERSION = 1
+# Parameters per SQLite lookup query
+LOOKUP_BATCH = 500
+# Seconds to wait for another connection's write lock
+SQLITE_TIMEOUT = 60
+MATCH_COLS = ['Cleaned', 'Generic_Name', 'Color']
+
+
+def get_ref_key(ref_path, fuzzy=False):
+    """
+    Get the content key of a reference list: sha256 of ProstateDrugList.csv
+    plus NORMALIZER_VERSION. Any change to either gives a new key. Fuzzy
+    decisions get their own key (with the accept score), so exact runs
+    sharing the cache never see them.
+    Args:
+        ref_path (str): path to ProstateDrugList.csv
+        fuzzy (bool): key of the fuzzy decisions
+    Returns:
+        str
+    """
+    with open(ref_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    key = f"{digest}:v{NORMALIZER_VERSION}"
+    return f"{key}:fuzzy{ACCEPT_SCORE}" if fuzzy else key
+
+
+def _missing(values):
+    """Values the matchers skip: NaN, '' and the string 'nan'."""
+    return values.isna() | values.astype(str).isin(['', 'nan'])
+
+
+class MatchCache:
+    """
+    Cache of raw drug string -> cleaned name (clean_brand_name) -> generic name
+    and color from ProstateDrugList.csv. Lookups are in bulk, over the distinct
+    strings of a column. With db_path, decisions persist across runs in SQLite,
+    per reference list path and keyed by get_ref_key: when the cache is
+    opened, entries of an older version of the same list (or normalizer) are
+    dropped, while other lists sharing the file (e.g. breast and lung lists,
+    see filter_op.filter_lists) keep theirs. With fuzzy, strings that
+    fuzzy-match a reference name (see fuzzy_match) get that name's generic
+    name and color, so rows kept by the fuzzy filter are cleaned like exact
+    matches.
+    """
+
+    def __init__(self, ref_path=REF_PATH, db_path=None, fuzzy=False):
+        """
+        Args:
+            ref_path (str): path to ProstateDrugList.csv
+            db_path (str): path to the SQLite cache, in-memory only if None
+            fuzzy (bool): also match strings to the reference name they
+                fuzzy-match (decisions of fuzzy_matcher)
+        """
+        # imported here, clean_final_tables uses this module
+        from src.clean_final_tables import build_ref_data_maps
+        self.brand2generic, self.brand2color = build_ref_data_maps(ref_path)
+        self.fuzzy_matcher = FuzzyDrugMatcher(list(self.brand2generic)) if fuzzy else None
+        self.ref_key = get_ref_key(ref_path, fuzzy)
+        self.ref_path = os.path.abspath(ref_path)
+        self.memory = {}
+        self.con = None
+        if db_path is not None:
+            # concurrent pipeline stages share the cache: wait for a writer rather than fail
+            self.con = sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT)
+            with self.con:
+                columns = [row[1] for row in self.con.execute("PRAGMA table_info(matches)")]
+                if columns and 'ref_path' not in columns:
+                    # cache written before entries were kept per list: rebuilt
+                    self.con.execute("DROP TABLE matches")
+                self.con.execute(
+                    "CREATE TABLE IF NOT EXISTS matches ("
+                    "ref_path TEXT NOT NULL, ref_key TEXT NOT NULL, raw TEXT NOT NULL, "
+                    "cleaned TEXT, generic_name TEXT, color TEXT, PRIMARY KEY (ref_path, ref_key, raw))"
+                )
+                # drop older versions of this list only, keeping its exact and fuzzy decisions
+                keys = (get_ref_key(ref_path), get_ref_key(ref_path, fuzzy=True))
+                stale = self.con.execute(
+                    "DELETE FROM matches WHERE ref_path = ? AND ref_key NOT IN (?, ?)", (self.ref_path,) + keys
+                ).rowcount
+            if stale:
+                logger.info("Dropped %s cached matches of a previous version of %s", stale, ref_path)
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _decide(self, raw):
+        cleaned = clean_brand_name(raw)
+        name = cleaned
+        if name not in self.brand2generic and self.fuzzy_matcher is not None and self.fuzzy_matcher.decide(raw):
+            name = self.fuzzy_matcher.decisions[raw][1]
+        return cleaned, self.brand2generic.get(name), self.brand2color.get(name)
+
+    def lookup(self, raw_names):
+        """
+        Get the decisions for distinct raw strings: from memory, then the
+        SQLite cache, and only the remaining strings are cleaned and matched
+        (and saved to the cache).
+        Args:
+            raw_names (list): distinct raw drug strings
+        Returns:
+            dict: raw string -> (cleaned, generic name or None, color or None)
+        """
+        todo = [raw for raw in raw_names if raw not in self.memory]
+        if todo and self.con is not None:
+            for start in range(0, len(todo), LOOKUP_BATCH):
+                batch = todo[start:start + LOOKUP_BATCH]
+                rows = self.con.execute(
+                    f"SELECT raw, cleaned, generic_name, color FROM matches "
+                    f"WHERE ref_path = ? AND ref_key = ? AND raw IN ({', '.join(['?'] * len(batch))})",
+                    [self.ref_path, self.ref_key] + batch,
+                )
+                for raw, cleaned, generic_name, color in rows:
+                    self.memory[raw] = (cleaned, generic_name, color)
+            todo = [raw for raw in todo if raw not in self.memory]
+        if todo:
+            new = {raw: self._decide(raw) for raw in todo}
+            self.memory.update(new)
+            if self.con is not None:
+                with self.con:
+                    self.con.executemany(
+                        "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                        [(self.ref_path, self.ref_key, raw) + decision for raw, decision in new.items()],
+                    )
+        return {raw: self.memory[raw] for raw in raw_names}
+
+    def match(self, values: pd.Series) -> pd.DataFrame:
+        """
+        Get the decisions for every value of a drug column, looking up only
+        its distinct strings.
+        Args:
+            values (pd.Series): raw drug strings
+        Returns:
+            pd.DataFrame: cols MATCH_COLS, aligned with values. Missing values
+                get Cleaned '' and no Generic_Name/Color.
+        """
+        present = values[~_missing(values)].astype(str)
+        decisions = self.lookup(present.unique().tolist())
+        table = pd.DataFrame.from_dict(decisions, orient='index', columns=MATCH_COLS)
+        result = table.reindex(present.to_numpy()).set_axis(present.index).reindex(values.index)
+        result['Cleaned'] = result['Cleaned'].fillna('')
+        return result
+
+
+def clean_values(values: pd.Series, cache=None) -> pd.Series:
+    """
+    Apply clean_brand_name to a drug column once per distinct string.
+    Args:
+        values (pd.Series): raw drug strings
+        cache (MatchCache): cache to use, if any
+    Returns:
+        pd.Series: cleaned names, '' for missing values
+    """
+    if cache is not None:
+        return cache.match(values)['Cleaned']
+    present = values[~_missing(values)].astype(str)
+    distinct = present.unique()
+    cleaned = pd.Series([clean_brand_name(raw) for raw in distinct], index=distinct, dtype=object)
+    return pd.Series(cleaned.reindex(present.to_numpy()).to_numpy(), index=present.index, dtype=object).reindex(
+        values.index, fill_value=''
+    )
+
+
+def contains_any(cleaned: pd.Series, names) -> pd.Series:
+    """
+    Get a mask of cleaned values containing any of names as a substring,
+    testing each distinct value once.
+    """
+    distinct = cleaned.unique()
+    hits = np.array([any(name in value for name in names) if value else False for value in distinct], dtype=bool)
+    return cleaned.isin(distinct[hits])
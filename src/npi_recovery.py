@@ -0,0 +1,192 @@
+import functools
+import logging
+import os
+import tempfile
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from src._utils import read_csv
+from src.recipients import RECIPIENT_ROLES, is_present, melt_recipients
+
+logger = logging.getLogger(__name__)
+
+# (profile ID column, NPI column) pairs of the harmonized OP files
+PROFILE_NPI_COLS = {
+    dataset_type: [(profile_col, npi_col) for _, profile_col, npi_col in roles]
+    for dataset_type, roles in RECIPIENT_ROLES.items()
+}
+# Suffix of the prebuilt index saved next to providers_npis_ids.csv
+INDEX_SUFFIX = ".npy"
+
+
+def _as_int64(values):
+    """Parse IDs/NPIs ("123", "123.0", 123.0) to int64, -1 where missing or not an integer."""
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+    ok = np.isfinite(numbers) & (numbers >= 0) & (numbers == np.floor(numbers))
+    return np.where(ok, numbers, -1).astype(np.int64)
+
+
+class ProfileNpiIndex:
+    """
+    Sorted profile ID -> NPI index over CMS' Covered Recipient Profile
+    Supplement (providers_npis_ids.csv, see get_providers.py): two int64
+    arrays, 16 bytes per profile, looked up with np.searchsorted. Saved as one
+    .npy file and loaded with a memory map, so every year reuses it.
+    """
+
+    def __init__(self, table):
+        """
+        Args:
+            table (np.ndarray): int64 array of shape (2, n): profile IDs,
+                sorted and unique, and their NPIs
+        """
+        self.table = table
+        self.profile_ids = table[0]
+        self.npis = table[1]
+
+    def __len__(self):
+        return len(self.profile_ids)
+
+    @classmethod
+    def from_frame(cls, providers_npis_ids):
+        """
+        Build the index from the supplement's (profile ID, NPI) rows, in that
+        column order. Rows without a profile ID or NPI are skipped; for a
+        profile ID listed with several NPIs, the first one is kept.
+        """
+        profile_ids = _as_int64(providers_npis_ids.iloc[:, 0].to_numpy())
+        npis = _as_int64(providers_npis_ids.iloc[:, 1].to_numpy())
+        keep = (profile_ids >= 0) & (npis > 0)
+        profile_ids, npis = profile_ids[keep], npis[keep]
+        # stable sort, so the first NPI of a profile ID comes first
+        order = np.argsort(profile_ids, kind='stable')
+        profile_ids, npis = profile_ids[order], npis[order]
+        first = np.ones(len(profile_ids), dtype=bool)
+        first[1:] = profile_ids[1:] != profile_ids[:-1]
+        n_conflicts = len(np.unique(profile_ids[~first & (npis != np.roll(npis, 1))]))
+        if n_conflicts:
+            logger.warning("%s profile IDs have several NPIs, keeping the first one", n_conflicts)
+        return cls(np.stack([profile_ids[first], npis[first]]))
+
+    @classmethod
+    def from_csv(cls, path):
+        """Build the index from providers_npis_ids.csv."""
+        return cls.from_frame(read_csv(path))
+
+    def save(self, path):
+        """
+        Save the index to path (any suffix). It is written to a temporary file
+        in the same directory, then moved into place, so a stage loading the
+        index while another one builds it never sees a partial file.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_", suffix=INDEX_SUFFIX)
+        try:
+            # a file object, so np.save doesn't append .npy to the name
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, self.table)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load an index saved with save, memory-mapped unless mmap=False."""
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    def lookup(self, profile_ids) -> np.ndarray:
+        """
+        Get the NPIs of profile IDs, in one vectorized pass.
+        Args:
+            profile_ids (array-like): profile IDs as strings or numbers (NaN allowed)
+        Returns:
+            np.ndarray: int64 NPIs, 0 where the profile ID is missing or unknown
+        """
+        ids = _as_int64(profile_ids)
+        if not len(self):
+            return np.zeros(len(ids), dtype=np.int64)
+        pos = np.searchsorted(self.profile_ids, ids)
+        pos = np.minimum(pos, len(self) - 1)
+        found = (ids >= 0) & (self.profile_ids[pos] == ids)
+        return np.where(found, self.npis[pos], 0)
+
+
+def load_profile_npi_index(path_providers_npis_ids):
+    """
+    Get the index of providers_npis_ids.csv: the prebuilt .npy next to it if
+    it is up to date, else built and saved once. Kept in memory per csv
+    version, so a run loads it once for all years.
+    Args:
+        path_providers_npis_ids (str): path to providers_npis_ids.csv
+    Returns:
+        ProfileNpiIndex
+    """
+    path = os.fspath(path_providers_npis_ids)
+    return _load_profile_npi_index(path, os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=4)
+def _load_profile_npi_index(path, mtime):
+    index_path = path + INDEX_SUFFIX
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= mtime:
+        return ProfileNpiIndex.load(index_path)
+    index = ProfileNpiIndex.from_csv(path)
+    try:
+        index.save(index_path)
+        logger.info("Saved profile ID -> NPI index of %s profiles to %s", len(index), index_path)
+    except OSError:
+        logger.warning("Could not save profile ID -> NPI index to %s", index_path)
+    return index
+
+
+def recover_npis(df, dataset_type, index, profile_cols=None):
+    """
+    Fill missing NPIs from profile IDs, for every (profile ID, NPI) column
+    pair of the dataset type (see PROFILE_NPI_COLS), with one index lookup
+    over the long recipient table (see recipients.melt_recipients). NPI
+    columns absent from df (2014 files) are added. Existing NPIs are never
+    overwritten.
+    Args:
+        df (pd.DataFrame): harmonized OP df, before missing-NPI rows are dropped
+        dataset_type (str): "general" or "research"
+        index (ProfileNpiIndex): see load_profile_npi_index
+        profile_cols (list): only use these profile ID columns (default: all)
+    Returns:
+        tuple (pd.DataFrame, Counter): df with NPIs filled, and the number of
+            NPIs recovered per NPI column
+    """
+    roles = [
+        (role, profile_col, npi_col) for role, profile_col, npi_col in RECIPIENT_ROLES[dataset_type]
+        if profile_col in df.columns and (profile_cols is None or profile_col in profile_cols)
+    ]
+    recipients = melt_recipients(df, dataset_type, roles)
+    missing = ~is_present(recipients['NPI'])
+    found = np.zeros(len(recipients), dtype=np.int64)
+    found[missing] = index.lookup(recipients.loc[missing, 'Profile_ID'].to_numpy())
+    fill = found > 0
+    fill_roles = recipients.loc[fill, 'Role'].to_numpy()
+    fill_rows = recipients.loc[fill, 'Row'].to_numpy()
+    fill_npis = found[fill].astype(str).astype(object)
+
+    recovered = Counter()
+    filled = {}
+    for role, _, npi_col in roles:
+        selected = fill_roles == role
+        recovered[npi_col] = int(selected.sum())
+        if selected.any() or npi_col not in df.columns:
+            npis = df[npi_col].to_numpy(dtype=object, copy=True) if npi_col in df.columns \
+                else np.full(len(df), np.nan, dtype=object)
+            npis[fill_rows[selected]] = fill_npis[selected]
+            filled[npi_col] = pd.Series(npis, index=df.index)
+    if recovered.total():
+        logger.info("Recovered NPIs from profile IDs: %s", dict(+recovered))
+    # existing columns are replaced in one assign; columns new to df (2014 has no NPI
+    # columns) are added in one concat, not one insert each into a wide frame
+    added = {col: filled.pop(col) for col in list(filled) if col not in df.columns}
+    df = df.assign(**filled)
+    if added:
+        df = pd.concat([df, pd.DataFrame(added, index=df.index)], axis=1)
+    return df, recovered
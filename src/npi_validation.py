@@ -0,0 +1,98 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src._utils import write_csv
+from src.recipients import is_present
+
+logger = logging.getLogger(__name__)
+
+NPI_LENGTH = 10
+# Luhn sum of the "80840" prefix CMS puts before the NPI (health industry number)
+NPI_PREFIX_SUM = 24
+# Width of the fixed-size string array the NPIs are checked in. Longer
+# strings are invalid anyway, as is any truncated remainder.
+NPI_WIDTH = 24
+# Digit sum of 2 * d, for d = 0..9
+DOUBLED_DIGIT_SUM = np.array([0, 2, 4, 6, 8, 1, 3, 5, 7, 9], dtype=np.int64)
+INVALID_NPI_COLS_COL = 'Invalid_NPI_Cols'
+NPI_COLS = {
+    "general": ['Covered_Recipient_NPI'],
+    "research": ['Covered_Recipient_NPI', 'PI_1_NPI', 'PI_2_NPI', 'PI_3_NPI', 'PI_4_NPI', 'PI_5_NPI'],
+    "prescribers": ['Prscrbr_NPI'],
+}
+
+
+def _as_codes(values):
+    """Get the NPIs as a (n, NPI_WIDTH) array of unicode code points, 0-padded."""
+    strings = pd.Series(values, dtype=object).fillna('').astype(str).to_numpy(dtype=f'U{NPI_WIDTH}')
+    return strings.view(np.uint32).reshape(len(strings), NPI_WIDTH)
+
+
+def is_valid_npi(values) -> np.ndarray:
+    """
+    Check NPIs over a whole array: 10 digits (a float artifact such as
+    "1234567893.0" is accepted) with a valid check digit. The check digit is
+    the Luhn check digit of "80840" + the first 9 digits, the CMS NPI rule.
+    Args:
+        values (array-like): NPIs, as strings (NaN/None allowed)
+    Returns:
+        np.ndarray: bool, True for valid NPIs
+    """
+    codes = _as_codes(values)
+    digits = codes[:, :NPI_LENGTH].astype(np.int64) - ord('0')
+    is_digits = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    # nothing after the 10 digits, or a "." followed only by zeros
+    tail = codes[:, NPI_LENGTH:]
+    clean_tail = (tail == 0).all(axis=1) | (
+        (tail[:, 0] == ord('.')) & ((tail[:, 1:] == ord('0')) | (tail[:, 1:] == 0)).all(axis=1)
+    )
+    digits = np.where(is_digits[:, None], digits, 0)
+    # counting from the check digit, every other digit of the first 9 is doubled
+    total = (
+        NPI_PREFIX_SUM
+        + DOUBLED_DIGIT_SUM[digits[:, 0:9:2]].sum(axis=1)
+        + digits[:, 1:9:2].sum(axis=1)
+    )
+    check_ok = (10 - total % 10) % 10 == digits[:, 9]
+    return is_digits & clean_tail & check_ok
+
+
+def quarantine_invalid_npis(df, npi_cols, path_invalid_npis, append=False):
+    """
+    Quarantine rows with an invalid NPI (see is_valid_npi) in any of npi_cols.
+    All such rows are saved to path_invalid_npis, with the failing columns in
+    Invalid_NPI_Cols. Rows left with no valid NPI are dropped; rows that still
+    have a valid NPI (e.g. a research payment with one bad PI NPI) are kept.
+    Args:
+        df (pd.DataFrame): rows to check, after NPI prep
+        npi_cols (list): NPI columns to check (missing columns are skipped)
+        path_invalid_npis (str): csv to save quarantined rows to
+        append (bool): append to the file (no header), for chunks
+    Returns:
+        pd.DataFrame: rows of df with at least one valid NPI
+    """
+    npi_cols = [col for col in npi_cols if col in df.columns]
+    # all NPI columns stacked into one long array, checked in a single pass
+    npis = pd.Series(
+        np.concatenate([df[col].to_numpy(dtype=object) for col in npi_cols]) if npi_cols
+        else np.zeros(0, dtype=object)
+    )
+    present = is_present(npis).reshape(len(npi_cols), len(df)).T
+    valid = is_valid_npi(npis.to_numpy()).reshape(len(npi_cols), len(df)).T
+    invalid = present & ~valid
+    has_valid = (present & valid).any(axis=1)
+
+    flagged = invalid.any(axis=1)
+    quarantined = df[flagged].copy()
+    quarantined[INVALID_NPI_COLS_COL] = [
+        ";".join(col for col, bad in zip(npi_cols, row) if bad) for row in invalid[flagged]
+    ]
+    write_csv(quarantined, path_invalid_npis, mode='a' if append else 'w', header=not append)
+    if flagged.any():
+        logger.info(
+            "Quarantined %s rows with invalid NPIs to %s, dropped %s",
+            flagged.sum(), path_invalid_npis, (flagged & ~has_valid).sum()
+            )
+    return df[~flagged | has_valid]
@@ -0,0 +1,225 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+
+import pandas as pd
+
+from src._utils import (
+    iter_csv_chunks,
+    open_csv_output,
+    read_csv,
+    read_csv_header,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, partitions are then written as csv
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+PARTITION_COLS = ['dataset_type', 'year']
+MANIFEST_NAME = "_manifest.json"
+FORMATS = ("auto", "parquet", "csv")
+# Columns added by clean_op_data after harmonization (see _clean_frame)
+ADDED_COLS = ['Drug_Name', 'Prostate_Drug_Type', 'Onc_Prescriber']
+
+
+def resolve_format(fmt="auto"):
+    """
+    Resolve the partition file format.
+    Args:
+        fmt (str): "auto" (parquet if pyarrow is installed, else csv), "parquet" or "csv"
+    Returns:
+        str: "parquet" or "csv"
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {FORMATS}")
+    if fmt == "auto":
+        return "parquet" if pq is not None else "csv"
+    if fmt == "parquet" and pq is None:
+        raise ImportError("pyarrow is not installed, use fmt='csv' or fmt='auto'")
+    return fmt
+
+
+def harmonized_schema(path_to_harmonized_cols):
+    """
+    Get the cross-year schema of a dataset type: the union of the harmonized
+    columns of every year in grace_cols.csv, in the most recent year's order
+    (2016+) followed by columns only older years have (2014-2015), then the
+    columns clean_op_data adds. All columns are strings.
+    Args:
+        path_to_harmonized_cols (str): path to grace_cols.csv
+    Returns:
+        list: column names
+    """
+    # imported here, clean_final_tables imports this module
+    from src.clean_final_tables import build_map_year2cols
+    year2cols = build_map_year2cols(None, path_to_harmonized_cols)
+    years = sorted((year for year in year2cols if year.isdigit()), reverse=True)
+    schema = []
+    for year in years:
+        schema.extend(col for col in year2cols[year] if col not in schema)
+    schema.extend(col for col in ADDED_COLS if col not in schema)
+    return schema
+
+
+def get_partition_dir(root, dataset_type, year):
+    """Directory of one partition: {root}/dataset_type={dataset_type}/year={year}/"""
+    return os.path.join(root, f"dataset_type={dataset_type}", f"year={int(year)}")
+
+
+def read_manifest(root):
+    """
+    Read the dataset manifest.
+    Returns:
+        dict: format, partitioning, schemas (dataset type -> columns) and
+            partitions (one entry per dataset type and year); empty
+            manifest if the dataset has none yet
+    """
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"format": None, "partitioning": PARTITION_COLS, "schemas": {}, "partitions": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def write_partition(
+        root, path, dataset_type, year, path_to_harmonized_cols=None, fmt="auto", chunksize=100_000
+        ):
+    """
+    Write a final table as the (dataset_type, year) partition of the
+    cross-year dataset, replacing any previous version of the partition, and
+    record it in the manifest. Every partition of a dataset type has the
+    same columns, in the same order (see harmonized_schema): columns a year
+    doesn't have are written as nulls and listed in the manifest entry.
+    Args:
+        root (str): dataset directory
+        path (str): final table written by clean_op_data (plain or compressed csv)
+        dataset_type (str): "general" or "research"
+        year (int): year of the final table
+        path_to_harmonized_cols (str): grace_cols.csv of the dataset type;
+            if None, the schema already in the manifest (or the table's own
+            columns) is used
+        fmt (str): "auto", "parquet" or "csv", see resolve_format. All
+            partitions of a dataset are in the same format.
+        chunksize (int): rows per chunk (one parquet row group per chunk)
+    Returns:
+        int: number of rows written
+    """
+    fmt = resolve_format(fmt)
+    manifest = read_manifest(root)
+    if manifest["format"] not in (None, fmt):
+        raise ValueError(f"Dataset {root} is in {manifest['format']} format, not {fmt}")
+
+    columns = read_csv_header(path)
+    if path_to_harmonized_cols is not None:
+        schema = harmonized_schema(path_to_harmonized_cols)
+    else:
+        schema = manifest["schemas"].get(dataset_type, columns)
+    extra = [col for col in columns if col not in schema]
+    if extra:
+        logger.warning("%s has columns outside the %s schema, appended: %s", path, dataset_type, extra)
+        schema = schema + extra
+
+    partition_dir = get_partition_dir(root, dataset_type, year)
+    tmp_dir = partition_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    file_name = f"part-0.{fmt}"
+    n_rows = 0
+    chunks = (
+        chunk.reindex(columns=schema)
+        for chunk in iter_csv_chunks(path, chunksize=chunksize, header=columns)
+    )
+    if fmt == "parquet":
+        arrow_schema = pa.schema([(col, pa.string()) for col in schema])
+        with pq.ParquetWriter(os.path.join(tmp_dir, file_name), arrow_schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=arrow_schema, preserve_index=False))
+                n_rows += len(chunk)
+    else:
+        with open_csv_output(os.path.join(tmp_dir, file_name)) as f:
+            pd.DataFrame(columns=schema).to_csv(f, index=False)
+            for chunk in chunks:
+                chunk.to_csv(f, header=False, index=False)
+                n_rows += len(chunk)
+    # swap in the new partition
+    shutil.rmtree(partition_dir, ignore_errors=True)
+    os.replace(tmp_dir, partition_dir)
+
+    manifest["format"] = fmt
+    manifest["schemas"][dataset_type] = schema
+    manifest["partitions"] = [
+        entry for entry in manifest["partitions"]
+        if (entry["dataset_type"], entry["year"]) != (dataset_type, int(year))
+    ]
+    manifest["partitions"].append({
+        "dataset_type": dataset_type,
+        "year": int(year),
+        "path": os.path.relpath(os.path.join(partition_dir, file_name), root),
+        "rows": n_rows,
+        "source": os.fspath(path),
+        "missing_columns": [col for col in schema if col not in columns],
+        "written_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    })
+    manifest["partitions"].sort(key=lambda entry: (entry["dataset_type"], entry["year"]))
+    _write_manifest(root, manifest)
+    logger.info("Wrote %s rows to partition %s", n_rows, partition_dir)
+    return n_rows
+
+
+def read_dataset(root, dataset_type, years=None, columns=None):
+    """
+    Load part of the cross-year dataset, reading only the partitions of the
+    requested years and, from them, only the requested columns.
+    The directory can also be read directly by partition-aware readers,
+    e.g. pyarrow.dataset.dataset(root, partitioning="hive") or DuckDB's
+    read_parquet('{root}/*/*/*.parquet', hive_partitioning = true).
+    Args:
+        root (str): dataset directory
+        dataset_type (str): "general" or "research"
+        years (iterable): years to load (default: all)
+        columns (list): columns to load (default: all)
+    Returns:
+        pd.DataFrame: rows of the selected partitions with a year column
+            (int) first, all other columns as strings
+    """
+    manifest = read_manifest(root)
+    if dataset_type not in manifest["schemas"]:
+        raise ValueError(f"No {dataset_type} partitions in {root}")
+    if columns is not None:
+        unknown = [col for col in columns if col not in manifest["schemas"][dataset_type]]
+        if unknown:
+            raise ValueError(f"Columns not in the {dataset_type} schema: {unknown}")
+    columns = columns or manifest["schemas"][dataset_type]
+    wanted = None if years is None else {int(year) for year in years}
+    frames = []
+    for entry in manifest["partitions"]:
+        if entry["dataset_type"] != dataset_type or (wanted is not None and entry["year"] not in wanted):
+            continue
+        path = os.path.join(root, entry["path"])
+        # partitions written before a schema change may lack newer columns
+        if manifest["format"] == "parquet":
+            available = [col for col in columns if col in pq.read_schema(path).names]
+            df = pq.read_table(path, columns=available).to_pandas()
+        else:
+            available = [col for col in columns if col in read_csv_header(path)]
+            df = read_csv(path, usecols=available)
+        df = df.reindex(columns=columns)
+        df.insert(0, 'year', entry["year"])
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['year'] + columns)
+    return pd.concat(frames, ignore_index=True)
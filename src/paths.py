@@ -0,0 +1,95 @@
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Paths of the pipeline's inputs and outputs. Only the standard library is
+# imported here, so the CLI can plan a run (--dry-run) without loading pandas.
+RAW_DIR = "data/raw/"
+REF_PATH = "data/reference/ProstateDrugList.csv"
+YEAR2NPIS_PATH = "data/filtered/prescribers/prescribers_year2npis.json"
+MATCH_CACHE_PATH = "data/cache/drug_match_cache.sqlite"
+DEDUP_REPORT_PATH = "data/filtered/dedup_report.csv"
+# Cross-year dataset partitioned by dataset_type= and year=, see partitioned_dataset.py
+DATASET_DIR = "data/final_dataset/"
+# SQLite analytics store of the final tables, see analytics_store.py
+STORE_PATH = "data/final_files/op_store.sqlite"
+# Record_ID -> final table row index, see record_index.py
+RECORD_INDEX_PATH = "data/final_files/record_index.sqlite"
+# Pre-aggregated payment cubes, see aggregate_cubes.py
+CUBES_PATH = "data/final_files/cubes.sqlite"
+# Stage report of scheduled runs, see scheduler.py
+RUN_REPORT_PATH = "data/run_report.csv"
+# Arguments of the scheduled stages at their last run, see scheduler.write_stamp
+STAMPS_DIR = "data/stamps/"
+FINAL_GENERICS_DIR = "data/final_files/final_generics/"
+# Filtered files of other drug lists (filter-lists), one directory per list ID
+FILTERED_LISTS_DIR = "data/filtered/lists/"
+YEARS = range(2014, 2024)
+DATASET_TYPES = ("general", "research")
+
+
+def get_filtered_chunks_dir(dataset_type, year):
+    """Directory of the filtered chunks of a year, ending with "/"."""
+    return f"data/filtered/{dataset_type}_payments/{year}_chunks/"
+
+
+def get_filtered_path(dataset_type, year):
+    """Path to the concatenated filtered file of a year (before compression extension)."""
+    return f"data/filtered/{dataset_type}_payments/full_files/{dataset_type}_{year}.csv"
+
+
+def get_list_chunks_dir(list_id, dataset_type, year, lists_dir=FILTERED_LISTS_DIR):
+    """Directory of the filtered chunks of a year for one drug list, ending with "/"."""
+    return f"{lists_dir}{list_id}/{dataset_type}_payments/{year}_chunks/"
+
+
+def get_list_filtered_path(list_id, dataset_type, year, lists_dir=FILTERED_LISTS_DIR):
+    """Path to the concatenated filtered file of a year for one drug list (before compression extension)."""
+    return f"{lists_dir}{list_id}/{dataset_type}_payments/full_files/{dataset_type}_{year}.csv"
+
+
+def get_final_path(dataset_type, year):
+    """Path to the final table of a year (before compression extension)."""
+    return f"data/final_files/{dataset_type}_payments/{dataset_type}_{year}_may8.csv"
+
+
+def get_op_raw_path(year, dataset_type, parent_dir="data/raw/"):
+    """
+    Get the path to the raw Open Payments data for a given year and dataset type.
+    Extracted files in {parent_dir}{dataset_type}_payments/ come first, then
+    the CMS zip bundles (PGYR{year}_P*.zip) in that directory or in parent_dir:
+    a csv inside a bundle is returned as "{zip_path}/{member}", which all
+    csv readers in _utils open without extracting the bundle.
+    Args:
+        year (int): year of data
+        dataset_type (str): "general" or "research"
+        parent_dir (str): raw data directory, ending with "/"
+    Returns:
+        str: path to raw file for given year and dataset type
+    """
+    acronym = "GNRL" if dataset_type == "general" else "RSRCH"
+    dataset_dir = f"{dataset_type}_payments/"
+    prefix = f"OP_DTL_{acronym}_PGYR{year}"
+    # Find the file in dataset_dir that starts with prefix
+    if os.path.isdir(parent_dir + dataset_dir):
+        for file in sorted(os.listdir(parent_dir + dataset_dir)):
+            if file.startswith(prefix) and not file.lower().endswith(".zip"):
+                return os.path.join(parent_dir + dataset_dir, file)
+    # Then look inside the zip bundles
+    for zip_dir in [parent_dir + dataset_dir, parent_dir]:
+        if not os.path.isdir(zip_dir):
+            continue
+        for file in sorted(os.listdir(zip_dir)):
+            if not file.lower().endswith(".zip"):
+                continue
+            zip_path = os.path.join(zip_dir, file)
+            with zipfile.ZipFile(zip_path) as bundle:
+                for member in bundle.namelist():
+                    name = os.path.basename(member)
+                    if name.startswith(prefix) and name.lower().endswith(".csv"):
+                        return f"{zip_path}/{member}"
+    # log ValueError if not file found
+    logger.error(f"No file found for {year} {dataset_type}_payments")
+    raise ValueError(f"No file found for {year} {dataset_type}_payments")
@@ -0,0 +1,296 @@
+import io
+import mmap
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src._utils import (
+    read_csv,
+    is_plain_file,
+    CSV_ENCODING,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def check_plain_file(path):
+    """
+    Byte offsets only make sense in an uncompressed file: raise ValueError for
+    zip members and compressed files.
+    """
+    if not is_plain_file(path):
+        raise ValueError(f"Byte offsets need an extracted, uncompressed csv, got {path}")
+
+
+def iter_offset_records(f):
+    """
+    Split a binary csv stream into raw records with their byte offsets.
+    Quote-aware: a quoted field containing newlines stays in one record.
+    Blank lines are skipped, like pandas does, so the n-th data record is
+    the n-th row label of the chunked readers.
+    Args:
+        f (binary file object): csv stream
+    Yields:
+        tuple (offset, bytes): the header record first, then each data
+            record, line terminator included
+    """
+    offset = 0
+    start = 0
+    record = []
+    in_quotes = False
+    for line in f:
+        record.append(line)
+        offset += len(line)
+        # an odd number of quotes toggles the quoted state ("" escapes are even)
+        if line.count(b'"') % 2:
+            in_quotes = not in_quotes
+        if in_quotes:
+            continue
+        record = b''.join(record)
+        if record.strip(b'\r\n'):
+            yield start, record
+        start = offset
+        record = []
+    if record:
+        yield start, b''.join(record)
+
+
+def iter_record_spans(path):
+    """
+    Yield the byte offset and length of every data record in a csv file,
+    skipping the header (see iter_offset_records).
+    Args:
+        path (str): path to csv file
+    Yields:
+        tuple (offset, length): byte span of the record, line terminator included
+    """
+    check_plain_file(path)
+    with open(path, 'rb') as f:
+        records = iter_offset_records(f)
+        next(records, None)
+        for offset, record in records:
+            yield offset, len(record)
+
+
+def iter_chunks_with_spans(path, chunksize=100_000, encoding=CSV_ENCODING):
+    """
+    Stream a plain csv file in chunks of chunksize rows together with the
+    byte span of every row, in one pass: the raw records are split here
+    (see iter_offset_records) and each batch is parsed with the pandas C
+    engine, so an offsets index needs no second scan of the file.
+    Args:
+        path (str): path to plain csv file
+        chunksize (int): rows per chunk
+        encoding (str): file encoding
+    Yields:
+        tuple (pd.DataFrame, np.ndarray, np.ndarray): chunk (all columns as
+            strings, row labels continuing across chunks), and the byte
+            offset and length of each of its rows
+    """
+    check_plain_file(path)
+
+    def parse(header, batch, start):
+        # the last record of a file may lack a line terminator
+        data = [record if record.endswith(b'\n') else record + b'\n' for _, record in batch]
+        chunk = read_csv(io.BytesIO(header + b''.join(data)), engine="c", encoding=encoding)
+        if len(chunk) != len(batch):
+            raise ValueError(f"Parsed {len(chunk)} rows from {len(batch)} records of {path} at row {start}")
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        offsets = np.array([offset for offset, _ in batch], dtype=np.int64)
+        lengths = np.array([len(record) for _, record in batch], dtype=np.int32)
+        return chunk, offsets, lengths
+
+    with open(path, 'rb') as f:
+        records = iter_offset_records(f)
+        _, header = next(records, (0, b''))
+        header = header if header.endswith(b'\n') else header + b'\n'
+        start = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == chunksize:
+                yield parse(header, batch, start)
+                start += len(batch)
+                batch = []
+        if batch:
+            yield parse(header, batch, start)
+
+
+def get_header_length(path):
+    """
+    Get the length in bytes of the header record (line terminator included).
+    Args:
+        path (str): path to csv file
+    Returns:
+        int
+    """
+    with open(path, 'rb') as f:
+        length = 0
+        in_quotes = False
+        for line in f:
+            length += len(line)
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                return length
+    return length
+
+
+def read_records(path, offsets, lengths, header_length=None):
+    """
+    Parse the records at the given byte spans of a csv file, through a memory
+    map of the file.
+    Args:
+        path (str): path to csv file
+        offsets (list): byte offset of each record
+        lengths (list): byte length of each record
+        header_length (int): length of the header record, if already known
+    Returns:
+        pd.DataFrame: records (all columns as strings), in the order given
+    """
+    if header_length is None:
+        header_length = get_header_length(path)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header = mm[:header_length]
+        records = [mm[offset:offset + length] for offset, length in zip(offsets, lengths)]
+    # the last record of a file may lack a line terminator
+    records = [record if record.endswith(b'\n') else record + b'\n' for record in [header] + records]
+    return read_csv(io.BytesIO(b''.join(records)), engine="c")
+
+
+def build_offsets_index(op_path, rows, index_path, record_ids=None):
+    """
+    Build a sidecar index of the byte offset and length of selected rows of a
+    raw OP file and save it to index_path (.npz).
+    Args:
+        op_path (str): path to raw OP csv file
+        rows (list): row numbers (0-based, header excluded) to index, e.g. the
+            row labels of matched rows in filter_open_payments
+        index_path (str): path to save the index to
+        record_ids (list): Record_ID of each row in rows, if available
+    Returns:
+        int: number of indexed rows
+    """
+    check_plain_file(op_path)
+    rows = np.asarray(rows, dtype=np.int64)
+    order = np.argsort(rows, kind='stable')
+    rows = rows[order]
+    offsets = np.empty(len(rows), dtype=np.int64)
+    lengths = np.empty(len(rows), dtype=np.int32)
+
+    # single pass over the raw file, picking spans of the wanted rows
+    pos = 0
+    if len(rows):
+        for row, (offset, length) in enumerate(iter_record_spans(op_path)):
+            if row == rows[pos]:
+                offsets[pos] = offset
+                lengths[pos] = length
+                pos += 1
+                if pos == len(rows):
+                    break
+    if pos != len(rows):
+        raise ValueError(f"Row {rows[pos]} not found in {op_path}")
+
+    if record_ids is not None:
+        record_ids = np.asarray([str(record_id) for record_id in record_ids], dtype=object)[order]
+    save_offsets_index(index_path, rows, offsets, lengths, get_header_length(op_path), record_ids)
+    logger.info("Indexed %s rows of %s in %s", len(rows), op_path, index_path)
+    return len(rows)
+
+
+def save_offsets_index(index_path, rows, offsets, lengths, header_length, record_ids=None):
+    """
+    Save a sidecar index of raw row byte spans (.npz), see load_offsets_index.
+    Args:
+        index_path (str): path to save the index to, used as is (no .npz
+            appended), so load_offsets_index takes the same path
+        rows (array): row numbers (0-based, header excluded), ascending
+        offsets (array): byte offset of each row
+        lengths (array): byte length of each row
+        header_length (int): length of the header record, see get_header_length
+        record_ids (list): Record_ID of each row, if available
+    Returns:
+        None
+    """
+    if record_ids is None:
+        record_ids = np.array([], dtype='S1')
+    else:
+        record_ids = np.asarray([str(record_id).encode() for record_id in record_ids], dtype='S')
+    # a file object, so np.savez doesn't append .npz to the name
+    with open(index_path, 'wb') as f:
+        np.savez(
+            f,
+            row=np.asarray(rows, dtype=np.int64),
+            offset=np.asarray(offsets, dtype=np.int64),
+            length=np.asarray(lengths, dtype=np.int32),
+            record_id=record_ids,
+            # permutation sorting record_id, for binary search lookups
+            record_order=np.argsort(record_ids, kind='stable'),
+            header_length=np.int64(header_length),
+        )
+
+
+def load_offsets_index(index_path):
+    """
+    Load an index saved by build_offsets_index.
+    Args:
+        index_path (str): path to .npz index
+    Returns:
+        dict: arrays row, offset, length, record_id, record_order, header_length
+    """
+    with np.load(index_path) as index:
+        return {key: index[key] for key in index.files}
+
+
+def _positions_for_rows(index, rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    pos = np.searchsorted(index['row'], rows)
+    found = (pos < len(index['row'])) & (index['row'][np.minimum(pos, len(index['row']) - 1)] == rows)
+    if not found.all():
+        raise KeyError(f"Rows not in index: {rows[~found].tolist()}")
+    return pos
+
+
+def _positions_for_record_ids(index, record_ids):
+    if not len(index['record_id']):
+        raise ValueError("Index was built without Record_IDs")
+    sorted_ids = index['record_id'][index['record_order']]
+    positions = []
+    for record_id in record_ids:
+        key = str(record_id).encode()
+        lo = np.searchsorted(sorted_ids, key, side='left')
+        hi = np.searchsorted(sorted_ids, key, side='right')
+        if lo == hi:
+            raise KeyError(f"Record_ID not in index: {record_id}")
+        positions.extend(index['record_order'][lo:hi].tolist())
+    return np.asarray(positions, dtype=np.int64)
+
+
+def fetch_raw_records(op_path, index_path, record_ids=None, rows=None, index=None):
+    """
+    Fetch full raw OP records by Record_ID or row number, using a memory map
+    of the raw file and the sidecar index, without rescanning the file.
+    Args:
+        op_path (str): path to raw OP csv file the index was built from
+        index_path (str): path to .npz index built by build_offsets_index
+        record_ids (list): Record_IDs to fetch
+        rows (list): row numbers to fetch (used if record_ids is None)
+        index (dict): already loaded index, to skip loading index_path
+    Returns:
+        pd.DataFrame: raw records (all columns as strings), indexed by row number
+    """
+    if index is None:
+        index = load_offsets_index(index_path)
+    if record_ids is not None:
+        positions = _positions_for_record_ids(index, record_ids)
+    elif rows is not None:
+        positions = _positions_for_rows(index, rows)
+    else:
+        raise ValueError("Pass record_ids or rows")
+
+    df = read_records(
+        op_path, index['offset'][positions], index['length'][positions], int(index['header_length'])
+        )
+    df.index = pd.Index(index['row'][positions], name='row')
+    return df
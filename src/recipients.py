@@ -0,0 +1,80 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# (role, profile ID column, NPI column) of each recipient slot of the harmonized OP files
+RECIPIENT_ROLES = {
+    "general": [('Covered_Recipient', 'Covered_Recipient_Profile_ID', 'Covered_Recipient_NPI')],
+    "research": [('Covered_Recipient', 'Covered_Recipient_Profile_ID', 'Covered_Recipient_NPI')] + [
+        (f'PI_{i}', f'PI_{i}_Profile_ID', f'PI_{i}_NPI') for i in range(1, 6)
+    ],
+}
+# Columns of the recipients output, one row per (record, role) with an NPI or profile ID
+RECIPIENT_COLS = ['Record_ID', 'Role', 'NPI', 'Profile_ID']
+
+
+def is_present(values) -> np.ndarray:
+    """True where values are neither missing nor blank strings."""
+    values = pd.Series(values, dtype=object)
+    return values.notna().to_numpy() & (values.fillna('').astype(str).str.strip() != '').to_numpy()
+
+
+def melt_recipients(df, dataset_type, roles=None):
+    """
+    Melt the wide recipient columns of OP rows (Covered_Recipient_NPI,
+    PI_1_NPI ... PI_5_NPI and their profile IDs) into one long table, in a
+    single vectorized pass: each column pair is stacked, not looped over by
+    row. Slots with neither an NPI nor a profile ID are left out.
+    Args:
+        df (pd.DataFrame): harmonized OP rows
+        dataset_type (str): "general" or "research"
+        roles (list): only these (role, profile ID column, NPI column)
+            slots (default: all RECIPIENT_ROLES of the dataset type that
+            have a column in df)
+    Returns:
+        pd.DataFrame: cols Row (position in df), Record_ID, Role, NPI and
+            Profile_ID (missing values as NaN), sorted by Row, then role order
+    """
+    if roles is None:
+        roles = [
+            (role, profile_col, npi_col) for role, profile_col, npi_col in RECIPIENT_ROLES[dataset_type]
+            if profile_col in df.columns or npi_col in df.columns
+        ]
+    n_rows = len(df)
+    empty = np.full(n_rows, np.nan, dtype=object)
+
+    def stack(cols):
+        return np.concatenate(
+            [df[col].to_numpy(dtype=object) if col in df.columns else empty for col in cols]
+        ) if cols else np.zeros(0, dtype=object)
+
+    record_ids = df['Record_ID'].to_numpy(dtype=object) if 'Record_ID' in df.columns else empty
+    long = pd.DataFrame({
+        'Row': np.tile(np.arange(n_rows), len(roles)),
+        'Record_ID': np.tile(record_ids, len(roles)),
+        'Role': np.repeat(np.array([role for role, _, _ in roles], dtype=object), n_rows),
+        'NPI': stack([npi_col for _, _, npi_col in roles]),
+        'Profile_ID': stack([profile_col for _, profile_col, _ in roles]),
+    })
+    long = long[is_present(long['NPI']) | is_present(long['Profile_ID'])]
+    # stacking is role-major, a stable sort on Row groups each record's roles
+    return long.iloc[np.argsort(long['Row'].to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+def rows_with_npi_in(recipients, n_rows, npi_set):
+    """
+    Join the long table on a set of NPIs: which rows of the wide frame have
+    any recipient NPI in npi_set.
+    Args:
+        recipients (pd.DataFrame): see melt_recipients
+        n_rows (int): number of rows of the wide frame
+        npi_set (set): NPIs as strings
+    Returns:
+        np.ndarray: bool per wide row
+    """
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[recipients.loc[recipients['NPI'].isin(npi_set), 'Row'].to_numpy()] = True
+    return mask
@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import logging
+import os
+import re
+import sqlite3
+
+import pandas as pd
+
+from src._utils import (
+    setup_logging,
+    is_plain_file,
+    iter_csv_chunks,
+)
+from src.paths import RECORD_INDEX_PATH
+from src.raw_index import (
+    iter_record_spans,
+    read_records,
+)
+
+logger = logging.getLogger(__name__)
+
+FINAL_FILE_PATTERN = re.compile(r'^(general|research)_(\d{4})')
+
+
+def find_final_files(parent_dir="data/final_files/", compressed=False):
+    """
+    Find the final per-year tables written by run_op_cleaner.
+    Args:
+        parent_dir (str): directory containing {dataset_type}_payments/ dirs
+        compressed (bool): also find .csv.gz/.csv.zst tables (which can't be
+            indexed by byte offset, but can be read)
+    Returns:
+        list of tuples (dataset_type, year, path)
+    """
+    extensions = (".csv", ".csv.gz", ".csv.zst") if compressed else (".csv",)
+    final_files = []
+    for dataset_type in ["general", "research"]:
+        dataset_dir = os.path.join(parent_dir, f"{dataset_type}_payments")
+        if not os.path.isdir(dataset_dir):
+            continue
+        for file in sorted(os.listdir(dataset_dir)):
+            match = FINAL_FILE_PATTERN.match(file)
+            file_path = os.path.join(dataset_dir, file)
+            if match and match.group(1) == dataset_type and os.path.isfile(file_path) and file.endswith(extensions):
+                final_files.append((dataset_type, int(match.group(2)), file_path))
+    return final_files
+
+
+def _connect(index_path):
+    con = sqlite3.connect(index_path)
+    con.execute(
+        """CREATE TABLE IF NOT EXISTS records (
+            record_id TEXT NOT NULL,
+            dataset_type TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            file TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL
+        )"""
+    )
+    return con
+
+
+def index_final_file(con, dataset_type, year, path, chunksize=100_000):
+    """
+    Add the Record_ID -> byte span entries of one final table to the index,
+    replacing any previous entries for that file. Raises ValueError if the
+    parsed rows and the raw records don't line up one to one, rather than
+    storing shifted offsets.
+    Args:
+        con (sqlite3.Connection): open record index
+        dataset_type (str): "general" or "research"
+        year (int): year of the final table
+        path (str): path to the final table
+        chunksize (int): rows per chunk when reading Record_IDs
+    Returns:
+        int: number of indexed rows
+    """
+    path = os.path.abspath(path)
+    con.execute("DELETE FROM records WHERE file = ?", (path,))
+    spans = iter_record_spans(path)
+    n_rows = 0
+    for chunk in iter_csv_chunks(path, chunksize=chunksize, usecols=['Record_ID']):
+        chunk_spans = list(itertools.islice(spans, len(chunk)))
+        if len(chunk_spans) != len(chunk):
+            raise ValueError(f"{path}: parsed {n_rows + len(chunk)} rows but found {n_rows + len(chunk_spans)} records")
+        rows = [
+            (record_id, dataset_type, int(year), path, offset, length)
+            for record_id, (offset, length) in zip(chunk['Record_ID'].fillna('').to_list(), chunk_spans)
+        ]
+        con.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", rows)
+        n_rows += len(rows)
+    if next(spans, None) is not None:
+        raise ValueError(f"{path}: parsed {n_rows} rows but found more records")
+    logger.info("Indexed %s records of %s", n_rows, path)
+    return n_rows
+
+
+def build_record_index(index_path, final_files):
+    """
+    Build (or refresh) the Record_ID index over final tables. Entries are
+    stored in a SQLite file with a B-tree index on record_id. Compressed
+    tables (run --compression) can't be read by byte offset: they are
+    skipped with a warning.
+    Args:
+        index_path (str): path to the SQLite index file
+        final_files (list): tuples (dataset_type, year, path), see find_final_files
+    Returns:
+        int: number of indexed rows
+    """
+    con = _connect(index_path)
+    try:
+        # drop the B-tree during the bulk load, rebuilding it once is faster
+        con.execute("DROP INDEX IF EXISTS idx_records_record_id")
+        n_rows = 0
+        for dataset_type, year, path in final_files:
+            if not is_plain_file(path):
+                logger.warning("Skipped %s: compressed tables can't be indexed by byte offset", path)
+                continue
+            n_rows += index_final_file(con, dataset_type, year, path)
+        con.execute("CREATE INDEX idx_records_record_id ON records (record_id)")
+        con.commit()
+    finally:
+        con.close()
+    return n_rows
+
+
+def lookup_record(index_path, record_id):
+    """
+    Get the final table row(s) for a Record_ID, reading only those rows.
+    Args:
+        index_path (str): path to the SQLite index file
+        record_id (str): Record_ID to look up
+    Returns:
+        pd.DataFrame: matching rows (all columns as strings) with added
+            columns dataset_type, year and file. Empty if not found.
+    """
+    con = _connect(index_path)
+    try:
+        entries = con.execute(
+            "SELECT dataset_type, year, file, offset, length FROM records WHERE record_id = ?",
+            (str(record_id),)
+        ).fetchall()
+    finally:
+        con.close()
+
+    rows = []
+    for dataset_type, year, file, offset, length in entries:
+        row = read_records(file, [offset], [length])
+        row['dataset_type'] = dataset_type
+        row['year'] = year
+        row['file'] = file
+        rows.append(row)
+    if not rows:
+        return pd.DataFrame()
+    return pd.concat(rows, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record_ID index over the final tables")
+    parser.add_argument("--index", default=RECORD_INDEX_PATH, help="path to index file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="index all final tables")
+    build.add_argument("--final-dir", default="data/final_files/")
+    get = subparsers.add_parser("get", help="print the row(s) for a Record_ID")
+    get.add_argument("record_id")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        n_rows = build_record_index(args.index, find_final_files(args.final_dir, compressed=True))
+        print(f"Indexed {n_rows} records in {args.index}")
+    else:
+        result = lookup_record(args.index, args.record_id)
+        if result.empty:
+            print(f"Record_ID {args.record_id} not found")
+        else:
+            print(result.T.to_string(header=False))
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+import pandas as pd
+
+from src._utils import write_csv
+
+logger = logging.getLogger(__name__)
+
+REPORT_COLS = ['stage', 'status', 'start', 'duration', 'depends_on', 'on_critical_path']
+EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One step of a pipeline run: func(*args, **kwargs), which reads inputs and
+    writes outputs (files or directories). A stage depends on the stages
+    producing its inputs. Stages holding a common resource (e.g. a SQLite
+    file they all write to) never run at the same time. A stage with a stamp
+    file is also out of date when its arguments change, e.g. an option that
+    adds a side output (see write_stamp).
+    """
+    name: str
+    func: Callable
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    resources: Tuple[str, ...] = ()
+    stamp: Optional[str] = None
+
+
+def _norm(path):
+    return os.path.normpath(os.fspath(path))
+
+
+def _mtime(path):
+    """Modification time of a file, or of the newest entry of a directory tree."""
+    mtime = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                mtime = max(mtime, os.path.getmtime(os.path.join(root, name)))
+    return mtime
+
+
+def get_dependencies(stages):
+    """
+    Get the stages each stage depends on, from their inputs and outputs.
+    Args:
+        stages (list): Stage objects with unique names and outputs
+    Returns:
+        dict: stage name -> sorted names of the stages producing its inputs
+    """
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            if _norm(path) in producers:
+                raise ValueError(f"{path} is an output of both {producers[_norm(path)]} and {stage.name}")
+            producers[_norm(path)] = stage.name
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique")
+    return {
+        stage.name: sorted({producers[_norm(path)] for path in stage.inputs if _norm(path) in producers} - {stage.name})
+        for stage in stages
+    }
+
+
+def topological_order(stages, dependencies):
+    """Stage names, each after the stages it depends on (ValueError on a cycle)."""
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Stage dependency cycle: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dep in dependencies[name]:
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name, [])
+    return order
+
+
+def critical_path(order, dependencies, durations):
+    """
+    Get the longest chain of dependent stages by duration: the stages that
+    set the run's length, however many workers there are.
+    Args:
+        order (list): stage names in topological order
+        dependencies (dict): see get_dependencies
+        durations (dict): stage name -> seconds (0 for skipped stages)
+    Returns:
+        tuple (list, float): stage names along the path, and its length in seconds
+    """
+    finish, previous = {}, {}
+    for name in order:
+        deps = dependencies[name]
+        before = max(deps, key=lambda dep: finish[dep]) if deps else None
+        finish[name] = durations.get(name, 0.0) + (finish[before] if before else 0.0)
+        previous[name] = before
+    if not finish:
+        return [], 0.0
+    name = max(order, key=lambda name: finish[name])
+    length = finish[name]
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], length
+
+
+def write_stamp(stage):
+    """
+    Save a stage's arguments to its stamp file, rewriting it only when they
+    changed: the stamp counts as an input of the stage, so a stage run with
+    other options is no longer up to date.
+    Returns:
+        bool: True if the stamp was (re)written
+    """
+    content = json.dumps({'args': stage.args, 'kwargs': stage.kwargs}, sort_keys=True, default=repr)
+    if os.path.exists(stage.stamp):
+        with open(stage.stamp) as f:
+            if f.read() == content:
+                return False
+    os.makedirs(os.path.dirname(stage.stamp) or ".", exist_ok=True)
+    with open(stage.stamp, "w") as f:
+        f.write(content)
+    return True
+
+
+def is_up_to_date(stage):
+    """True if every output of stage exists and is newer than all its inputs and its stamp."""
+    if not stage.outputs or not all(os.path.exists(path) for path in stage.outputs):
+        return False
+    inputs = stage.inputs + ((stage.stamp,) if stage.stamp is not None else ())
+    if not all(os.path.exists(path) for path in inputs):
+        return False
+    newest_input = max((_mtime(path) for path in inputs), default=0.0)
+    return min(_mtime(path) for path in stage.outputs) >= newest_input
+
+
+def run_stages(stages, max_workers=None, executor="thread", force=False, report_path=None):
+    """
+    Run pipeline stages in dependency order, independent stages concurrently
+    on a pool of max_workers. A stage is skipped if its outputs are up to
+    date (see is_up_to_date) and none of the stages it depends on ran. When
+    a stage fails, the stages depending on it are blocked and the others
+    still run; RuntimeError is raised at the end.
+    Args:
+        stages (list): Stage objects
+        max_workers (int): stages run at the same time (default: CPU count)
+        executor (str): "thread" or "process" (stage functions and arguments
+            must then be picklable)
+        force (bool): run every stage, even if up to date
+        report_path (str): if set, save the run report to this csv
+    Returns:
+        tuple (pd.DataFrame, dict): run report (cols REPORT_COLS: status ran,
+            skipped, failed or blocked; start and duration in seconds;
+            critical path stages flagged), and stage name -> func result
+    """
+    dependencies = get_dependencies(stages)
+    order = topological_order(stages, dependencies)
+    by_name = {stage.name: stage for stage in stages}
+    produced = {_norm(path) for stage in stages for path in stage.outputs}
+    missing = sorted({
+        os.fspath(path) for stage in stages for path in stage.inputs
+        if _norm(path) not in produced and not os.path.exists(path)
+    })
+    if missing:
+        raise FileNotFoundError(f"Missing pipeline inputs: {missing}")
+    for stage in stages:
+        if stage.stamp is not None and write_stamp(stage):
+            logger.info("Arguments of stage %s changed", stage.name)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    status, start, duration, results = {}, {}, {}, {}
+    pending = list(order)
+    running = {}
+    held = set()
+    run_start = time.monotonic()
+    with EXECUTORS[executor](max_workers=max_workers) as pool:
+        while pending or running:
+            for name in list(pending):
+                stage, deps = by_name[name], dependencies[name]
+                if any(dep not in status for dep in deps):
+                    continue
+                if any(status[dep] in ("failed", "blocked") for dep in deps):
+                    status[name] = "blocked"
+                    pending.remove(name)
+                    logger.warning("Stage %s blocked by a failed upstream stage", name)
+                elif not force and not any(status[dep] == "ran" for dep in deps) and is_up_to_date(stage):
+                    status[name] = "skipped"
+                    pending.remove(name)
+                    logger.info("Stage %s is up to date, skipped", name)
+                elif len(running) < max_workers and not held & set(stage.resources):
+                    start[name] = time.monotonic() - run_start
+                    running[pool.submit(stage.func, *stage.args, **stage.kwargs)] = name
+                    held.update(stage.resources)
+                    pending.remove(name)
+                    logger.info("Started stage %s", name)
+            if not running:
+                # skipped or blocked stages may have released their dependents
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                held.difference_update(by_name[name].resources)
+                duration[name] = time.monotonic() - run_start - start[name]
+                try:
+                    results[name] = future.result()
+                    status[name] = "ran"
+                    logger.info("Finished stage %s in %.2f seconds", name, duration[name])
+                except Exception:
+                    status[name] = "failed"
+                    logger.exception("Stage %s failed", name)
+
+    path, length = critical_path(order, dependencies, duration)
+    report = pd.DataFrame(
+        [
+            (name, status[name], start.get(name), duration.get(name, 0.0), ";".join(dependencies[name]), name in path)
+            for name in order
+        ],
+        columns=REPORT_COLS,
+    )
+    if report_path is not None:
+        write_csv(report, report_path)
+    logger.info(
+        "Ran %s stages, skipped %s in %.2f seconds; critical path (%.2f seconds): %s",
+        (report['status'] == "ran").sum(), (report['status'] == "skipped").sum(),
+        time.monotonic() - run_start, length, " -> ".join(path) or "none",
+    )
+    failed = report.loc[report['status'] == "failed", 'stage'].to_list()
+    if failed:
+        raise RuntimeError(f"Pipeline stages failed: {failed}, see the log")
+    return report, results
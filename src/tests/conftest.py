@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.fixture
+def write_final(tmp_path):
+    """
+    Writer of final tables laid out like run_op_cleaner's output:
+    {final_dir}/{dataset_type}_payments/{dataset_type}_{year}_may8.csv[extension],
+    compressed by pandas according to extension. final_dir defaults to
+    tmp_path / "final_files". Returns the table's path.
+    """
+    def write(df, dataset_type="general", year=2022, extension="", final_dir=None):
+        dataset_dir = (final_dir or tmp_path / "final_files") / f"{dataset_type}_payments"
+        dataset_dir.mkdir(parents=True, exist_ok=True)
+        path = dataset_dir / f"{dataset_type}_{year}_may8.csv{extension}"
+        df.to_csv(path, index=False)
+        return path
+    return write
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from src.aggregate_cubes import (
+    build_cube,
+    query_cube,
+    update_cube,
+)
+
+
+COLUMNS = [
+    'Record_ID', 'Drug_Name', 'Onc_Prescriber', 'Applic_Manuf_or_GPO_Paying_Name', 'Recipient_State',
+    'Total_Amt_of_Payment_USDollars',
+]
+FINAL_2020 = pd.DataFrame([
+    ['1', 'enzalutamide', '1', 'Astellas', 'MA', '10.5'],
+    ['2', 'enzalutamide', '1', 'Astellas', 'MA', '4.5'],
+    ['3', 'enzalutamide', '0', 'Astellas', 'NY', '100'],
+    ['4', 'abiraterone', '1', 'Janssen', 'MA', ''],
+    ['5', '', '', 'Janssen', '', '1'],
+], columns=COLUMNS)
+FINAL_2021 = pd.DataFrame([
+    ['6', 'enzalutamide', '1', 'Astellas', 'CA', '7'],
+], columns=COLUMNS)
+
+
+@pytest.mark.parametrize("chunksize", [2, 100])
+def test_build_cube(write_final, chunksize):
+    cube = build_cube(write_final(FINAL_2020, "general", 2020), chunksize=chunksize)
+    cube = cube.sort_values(['Drug_Name', 'Recipient_State'], na_position='last', ignore_index=True)
+    assert cube['Drug_Name'].fillna('').to_list() == ['abiraterone', 'enzalutamide', 'enzalutamide', '']
+    assert cube['Total_Amount'].to_list() == [0, 15, 100, 1]
+    assert cube['Amount_Count'].to_list() == [0, 2, 1, 1]
+    assert cube['Record_Count'].to_list() == [1, 2, 1, 1]
+
+
+def test_update_and_query_cube(tmp_path, write_final):
+    db_path = tmp_path / "cubes.sqlite"
+    assert update_cube(db_path, write_final(FINAL_2020, "general", 2020), "general", 2020) == 4
+    update_cube(db_path, write_final(FINAL_2021, "general", 2021), "general", 2021)
+
+    by_year = query_cube(db_path, "general", ['Year'])
+    assert by_year[['Year', 'Total_Amount', 'Record_Count']].values.tolist() == [[2020, 116, 5], [2021, 7, 1]]
+
+    result = query_cube(db_path, "general", ['Drug_Name'], where={'Onc_Prescriber': '1'})
+    assert result[['Drug_Name', 'Total_Amount', 'Amount_Count', 'Record_Count']].values.tolist() == [
+        ['abiraterone', 0, 0, 1], ['enzalutamide', 22, 3, 3]
+    ]
+    assert result['Average_Amount'].isna().to_list() == [True, False]
+
+    total = query_cube(db_path, "general", [], years=[2021])
+    assert total[['Total_Amount', 'Record_Count']].values.tolist() == [[7, 1]]
+
+    # reprocessing a year replaces only its slice
+    update_cube(db_path, write_final(FINAL_2020.iloc[:1], "general", 2020), "general", 2020)
+    by_year = query_cube(db_path, "general", ['Year'])
+    assert by_year[['Year', 'Total_Amount', 'Record_Count']].values.tolist() == [[2020, 10.5, 1], [2021, 7, 1]]
+
+    with pytest.raises(ValueError):
+        query_cube(db_path, "general", ['Record_ID'])
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from src.analytics_store import (
+    get_table_name,
+    load_final_file,
+    query_store,
+)
+
+
+def final_table(npis, drugs, amounts, extra_col=False):
+    df = pd.DataFrame({
+        'Covered_Recipient_NPI': npis,
+        'Total_Amt_of_Payment_USDollars': amounts,
+        'Drug_Name': drugs,
+        'Onc_Prescriber': ['1'] + ['0'] * (len(npis) - 1),
+    })
+    if extra_col:
+        df['Program_Year'] = '2023'
+    return df
+
+
+def test_get_table_name():
+    assert get_table_name("general") == "general_payments"
+    with pytest.raises(ValueError):
+        get_table_name("ownership")
+
+
+def test_load_final_file_upserts_year(tmp_path, write_final):
+    db_path = tmp_path / "store.sqlite"
+    path_2022 = write_final(final_table(['1', '2'], ['olaparib', 'docetaxel'], ['10.5', '4']), "general", 2022)
+    path_2023 = write_final(final_table(['1'], ['olaparib'], ['1'], extra_col=True), "general", 2023)
+
+    assert load_final_file(db_path, path_2022, "general", 2022) == 2
+    assert load_final_file(db_path, path_2023, "general", 2023) == 1
+
+    totals = query_store(
+        db_path,
+        'SELECT "Year", SUM("Total_Amt_of_Payment_USDollars") AS total FROM general_payments GROUP BY "Year" ORDER BY "Year"'
+        )
+    assert totals['total'].to_list() == [14.5, 1.0]
+
+    # reprocess 2022: its rows are replaced, 2023 is untouched
+    path_2022 = write_final(final_table(['3'], ['goserelin'], ['2']), "general", 2022)
+    load_final_file(db_path, path_2022, "general", 2022)
+    result = query_store(db_path, 'SELECT "Year", "Drug_Name", "Program_Year" FROM general_payments ORDER BY "Year"')
+    assert result['Drug_Name'].to_list() == ['goserelin', 'olaparib']
+    assert result['Program_Year'].isna().to_list() == [True, False]
+
+
+def test_load_final_file_indexes(tmp_path, write_final):
+    db_path = tmp_path / "store.sqlite"
+    path = write_final(final_table(['1'], ['olaparib'], ['1']), "research", 2016)
+    load_final_file(db_path, path, "research", 2016)
+    con = sqlite3.connect(db_path)
+    indexes = {row[1] for row in con.execute("PRAGMA index_list(research_payments)")}
+    con.close()
+    assert indexes == {
+        'idx_research_payments_Year',
+        'idx_research_payments_Covered_Recipient_NPI',
+        'idx_research_payments_Drug_Name',
+        'idx_research_payments_Onc_Prescriber',
+    }
@@ -1,18 +1,36 @@
+import tracemalloc
+import warnings
+
+import numpy as np
 import pandas as pd
+import pytest
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
 from src.clean_final_tables import (
+    SchemaMismatchError,
     add_new_columns,
     add_npis_2014, 
     build_map_year2cols, 
     build_ref_data_maps,
     clean_op_data,
+    compile_schema_plan,
+    get_raw_cols_path,
+    record_raw_headers,
     get_harmonized_drug_cols,
     get_prostate_drug_type, 
     harmonize_col_names,
+    MERGE_COLS_2014_2015,
     is_onc_prescriber,
     merge_cols_2014_2015,
     prep_general_data,
     prep_research_data
 )
+from src._utils import ARROW_BLOCK_SIZE, concatenate_chunks, read_csv, resolve_csv_engine
+from src.filter_op import filter_open_payments
+from src.fix_final_generic_names import finalize_generic_names
 
 
 def test_build_map_year2cols(tmp_path):
@@ -172,6 +190,27 @@ def test_add_new_columns():
     assert set(result['Onc_Prescriber'].values) == set(expected_result['Onc_Prescriber'].values)
 
 
+
+def test_add_new_columns_research():
+    test_df = pd.DataFrame({
+        'Drug_Biological_Device_Med_Sup_1': ['Xtandi', 'aspirin', None],
+        'Drug_Biological_Device_Med_Sup_2': ['LYNPARZA', 'Lynparza', 'aspirin'],
+        'Covered_Recipient_NPI': ['', '1', ''],
+        'PI_1_NPI': ['', '', ''],
+        'PI_2_NPI': ['2', '', ''],
+    })
+    drug_cols = ['Drug_Biological_Device_Med_Sup_1', 'Drug_Biological_Device_Med_Sup_2']
+
+    result = add_new_columns(test_df, drug_cols, ['2', '1'], 'research')
+
+    # first drug column with a target drug wins
+    assert result['Drug_Name'].to_list()[:2] == ['enzalutamide', 'olaparib']
+    assert pd.isna(result['Drug_Name'][2])
+    assert result['Prostate_Drug_Type'].to_list()[:2] == [0.0, 1.0]
+    # enzalutamide is green, so PI_2_NPI being in npi_set doesn't count
+    assert result['Onc_Prescriber'].to_list()[:2] == [0.0, 1.0]
+    assert result[['Prostate_Drug_Type', 'Onc_Prescriber']].iloc[2].isna().all()
+
 def test_prep_general_data(tmp_path):
     test_df = pd.DataFrame({
         'Covered_Recipient_NPI': ['123.0', pd.NA, '456.0', '789.0', pd.NA],
@@ -253,6 +292,107 @@ def test_merge_cols_2014_2015():
     assert set(result['Drug_Biological_Device_Med_Sup_5'].values) == set(expected_result['Drug_Biological_Device_Med_Sup_5'].values)
 
 
+class TestSchemaPlan:
+    raw_2014 = [
+        'Change_Type',
+        'Name_of_Associated_Covered_Drug_or_Biological1',
+        'Name_of_Associated_Covered_Drug_or_Biological2',
+        'Physician_Profile_ID',
+        'Name_of_Associated_Covered_Device_or_Medical_Supply1',
+        'Name_of_Associated_Covered_Device_or_Medical_Supply2',
+        'Name_of_Associated_Covered_Drug_or_Biological3',
+        'Name_of_Associated_Covered_Drug_or_Biological4',
+        'Name_of_Associated_Covered_Drug_or_Biological5',
+        'Name_of_Associated_Covered_Device_or_Medical_Supply3',
+        'Name_of_Associated_Covered_Device_or_Medical_Supply4',
+        'Name_of_Associated_Covered_Device_or_Medical_Supply5',
+        'Record_ID',
+    ]
+
+    @pytest.fixture
+    def path_to_cols(self, tmp_path):
+        pd.DataFrame({
+            '2014': ['Change_Type', 'Covered_Recipient_Profile_ID', 'Record_ID'] + [
+                f'Drug_Biological_Device_Med_Sup_{i}' for i in range(1, 6)
+            ],
+            '2016': ['Change_Type', 'Covered_Recipient_Profile_ID', 'Record_ID'] + [None] * 5,
+        }).to_csv(tmp_path / 'cols.csv', index=False)
+        return tmp_path / 'cols.csv'
+
+    def test_plan_2014_matches_merge_and_harmonize(self, path_to_cols):
+        df = pd.DataFrame([
+            ['NEW', 'DRUG_A', '', '1', '', 'DEV_B', None, '', 'DRUG_E', 'DEV_C', 'DEV_D', '', '10'],
+            ['NEW', '', 'DRUG_B', '2', 'DEV_A', None, 'DRUG_C', 'DRUG_D', None, None, None, None, '11'],
+        ], columns=self.raw_2014)
+        plan = compile_schema_plan('general', 2014, path_to_cols, df.columns)
+        result = plan.apply(df)
+
+        expected = harmonize_col_names(merge_cols_2014_2015(df.copy()), 2014, 'general', path_to_cols)
+        assert result.columns.to_list() == expected.columns.to_list()
+        assert result.equals(expected)
+        assert result['Drug_Biological_Device_Med_Sup_1'].to_list() == ['DRUG_A', 'DEV_A']
+        assert result['Drug_Biological_Device_Med_Sup_2'].to_list() == ['DEV_B', 'DRUG_B']
+
+    def test_plan_renames_2016(self, path_to_cols):
+        df = pd.DataFrame([['NEW', '1', '10']], columns=['Change_Type', 'Physician_Profile_ID', 'Record_ID'])
+        result = compile_schema_plan('general', '2016', path_to_cols, df.columns).apply(df)
+        assert result.columns.to_list() == ['Change_Type', 'Covered_Recipient_Profile_ID', 'Record_ID']
+        assert result.iloc[0].to_list() == ['NEW', '1', '10']
+
+    def test_plan_is_cached(self, path_to_cols):
+        cols = ['Change_Type', 'Physician_Profile_ID', 'Record_ID']
+        assert compile_schema_plan('general', 2016, path_to_cols, cols) is compile_schema_plan(
+            'general', 2016, path_to_cols, pd.Index(cols))
+
+    def test_plan_extra_column(self, path_to_cols):
+        cols = ['Change_Type', 'Physician_Profile_ID', 'New_CMS_Column', 'Record_ID']
+        with pytest.raises(SchemaMismatchError) as err:
+            compile_schema_plan('general', 2016, path_to_cols, cols)
+        assert "expected 3 columns after merge, found 4" in str(err.value)
+
+    def test_plan_recorded_raw_header(self, path_to_cols):
+        cols = ['Change_Type', 'Physician_Profile_ID', 'Record_ID']
+        pd.DataFrame({'2016': cols}).to_csv(get_raw_cols_path(path_to_cols), index=False)
+        assert compile_schema_plan('general', 2016, path_to_cols, cols).harmonized_cols == (
+            'Change_Type', 'Covered_Recipient_Profile_ID', 'Record_ID'
+        )
+        # same column count, but a renamed raw column: caught by the recorded raw header only
+        with pytest.raises(SchemaMismatchError) as err:
+            compile_schema_plan('general', 2016, path_to_cols, ['Change_Type', 'Recipient_Profile_ID', 'Record_ID'])
+        assert "- Physician_Profile_ID" in str(err.value)
+        assert "+ Recipient_Profile_ID" in str(err.value)
+        # reordered raw columns
+        with pytest.raises(SchemaMismatchError):
+            compile_schema_plan('general', 2016, path_to_cols, ['Physician_Profile_ID', 'Change_Type', 'Record_ID'])
+
+    def test_record_raw_headers(self, tmp_path, path_to_cols):
+        raw_dir = tmp_path / "raw"
+        (raw_dir / "general_payments").mkdir(parents=True)
+        raw_2014 = pd.DataFrame(columns=self.raw_2014)
+        raw_2014.to_csv(raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2014_P01302025.csv", index=False)
+        raw_2016 = pd.DataFrame(columns=['Change_Type', 'Physician_Profile_ID', 'Record_ID'])
+        raw_2016.to_csv(raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2016_P01302025.csv", index=False)
+
+        record_raw_headers('general', [2016], path_to_cols, f"{raw_dir}/")
+        path = record_raw_headers('general', [2014], path_to_cols, f"{raw_dir}/")
+
+        # years recorded before are kept
+        assert build_map_year2cols(None, path) == {'2014': self.raw_2014, '2016': list(raw_2016.columns)}
+        compile_schema_plan('general', 2014, path_to_cols, self.raw_2014)
+        with pytest.raises(SchemaMismatchError):
+            compile_schema_plan('general', 2014, path_to_cols, self.raw_2014[::-1])
+
+    def test_plan_moved_column(self, path_to_cols):
+        cols = ['Change_Type', 'Record_ID', 'Physician_Profile_ID']
+        with pytest.raises(SchemaMismatchError) as err:
+            compile_schema_plan('general', 2016, path_to_cols, cols)
+        assert "position 1: expected 'Covered_Recipient_Profile_ID', found 'Record_ID'" in str(err.value)
+
+    def test_plan_missing_merge_columns(self, path_to_cols):
+        with pytest.raises(SchemaMismatchError):
+            compile_schema_plan('general', 2014, path_to_cols, self.raw_2014[:-2] + ['Record_ID'])
+
+
 class TestAddNpis2014:
     def test_add_npis_2014_general(tmp_path):
         test_df = pd.DataFrame({
@@ -494,3 +634,446 @@ class TestCleanOpData:
         assert set(result['Drug_Name'].values) == set(expected_result['Drug_Name'].values)
         assert set(result['Prostate_Drug_Type'].values) == set(expected_result['Prostate_Drug_Type'].values)
         assert set(result['Onc_Prescriber'].values) == set(expected_result['Onc_Prescriber'].values)
+
+    @pytest.mark.parametrize("dataset_type", ["general", "research"])
+    def test_clean_op_data_chunked_matches_whole_file(self, tmp_path, dataset_type):
+        test_data = pd.DataFrame({
+            'Covered_Recipient_NPI': ['123', '', '789.0', '', '456', '321', ''],
+            'Covered_Recipient_Profile_ID': ['1', '2', '3', '4', '5', '6', '7'],
+            'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1': [
+                'Trelstar', 'Pluvicto', 'DRUG_C', 'Xtandi', 'Zytiga', 'Lupron', 'Casodex'
+            ],
+            'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_2': ['DRUG_D', '', 'Rubraca', '', '', '', ''],
+        })
+        test_data.to_csv(tmp_path / "test_data.csv", index=False)
+        pd.DataFrame({
+            '2016': ['Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID',
+                     'Drug_Biological_Device_Med_Sup_1', 'Drug_Biological_Device_Med_Sup_2']
+        }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+        pd.DataFrame({
+            'Covered_Recipient_Profile_ID': ['1'], 'Covered_Recipient_NPI': ['123']
+        }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+
+        for chunksize in [None, 2]:
+            dir_missing_npis = tmp_path / f"missing_npis_{chunksize}"
+            dir_missing_npis.mkdir()
+            clean_op_data(
+                tmp_path / "test_data.csv",
+                tmp_path / f"cleaned_{chunksize}.csv",
+                "cleaned.csv",
+                2016,
+                ['123', '456'],
+                dataset_type,
+                tmp_path / "test_harmonized_cols.csv",
+                tmp_path / "test_providers_npis_ids.csv",
+                f"{dir_missing_npis}/",
+                chunksize=chunksize,
+            )
+
+        whole = pd.read_csv(tmp_path / "cleaned_None.csv", dtype=str)
+        chunked = pd.read_csv(tmp_path / "cleaned_2.csv", dtype=str)
+        assert len(whole) == 4
+        assert chunked.equals(whole)
+        missing_whole = pd.read_csv(tmp_path / "missing_npis_None" / "cleaned.csv", dtype=str)
+        missing_chunked = pd.read_csv(tmp_path / "missing_npis_2" / "cleaned.csv", dtype=str)
+        # appended per chunk, under one header
+        assert missing_chunked['Covered_Recipient_Profile_ID'].to_list() == ['2', '4', '7']
+        assert missing_chunked.equals(missing_whole)
+
+    def test_clean_op_data_quarantines_invalid_npis(self, tmp_path):
+        pd.DataFrame({
+            # a malformed, non-numeric NPI is quarantined too, not a parse failure
+            'Covered_Recipient_NPI': ['1234567893', '123', '1234567894.0', '', '12345X7893'],
+            'Covered_Recipient_Profile_ID': ['1', '2', '3', '4', '5'],
+            'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1': [
+                'Xtandi', 'Zytiga', 'Lupron', 'Casodex', 'Xtandi'
+            ],
+        }).to_csv(tmp_path / "test_data.csv", index=False)
+        pd.DataFrame({
+            '2016': ['Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID', 'Drug_Biological_Device_Med_Sup_1']
+        }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+        pd.DataFrame({
+            'Covered_Recipient_Profile_ID': ['1'], 'Covered_Recipient_NPI': ['1234567893']
+        }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+        (tmp_path / "missing_npis").mkdir()
+        (tmp_path / "invalid_npis").mkdir()
+
+        clean_op_data(
+            tmp_path / "test_data.csv",
+            tmp_path / "cleaned.csv",
+            "cleaned.csv",
+            2016,
+            ['1234567893'],
+            'general',
+            tmp_path / "test_harmonized_cols.csv",
+            tmp_path / "test_providers_npis_ids.csv",
+            f"{tmp_path / 'missing_npis'}/",
+            dir_invalid_npis=f"{tmp_path / 'invalid_npis'}/",
+        )
+
+        result = pd.read_csv(tmp_path / "cleaned.csv", dtype=str)
+        assert result['Covered_Recipient_NPI'].to_list() == ['1234567893']
+        assert result['Onc_Prescriber'].to_list() == ['0']
+        invalid = pd.read_csv(tmp_path / "invalid_npis" / "cleaned.csv", dtype=str)
+        assert invalid['Covered_Recipient_Profile_ID'].to_list() == ['2', '3', '5']
+        assert invalid['Covered_Recipient_NPI'].to_list() == ['123', '1234567894', '12345X7893']
+        missing = pd.read_csv(tmp_path / "missing_npis" / "cleaned.csv", dtype=str)
+        assert missing['Covered_Recipient_Profile_ID'].to_list() == ['4']
+
+    @pytest.mark.parametrize("chunksize", [None, 2])
+    def test_clean_op_data_recovers_npis(self, tmp_path, chunksize):
+        pd.DataFrame({
+            'Covered_Recipient_NPI': ['', '123', '', ''],
+            'Covered_Recipient_Profile_ID': ['1', '2', '3', '4'],
+            'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1': ['Trelstar', 'Zytiga', 'Lupron', 'Casodex'],
+        }).to_csv(tmp_path / "test_data.csv", index=False)
+        pd.DataFrame({
+            '2016': ['Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID', 'Drug_Biological_Device_Med_Sup_1']
+        }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+        pd.DataFrame({
+            'Covered_Recipient_Profile_ID': ['1', '2', '3'], 'Covered_Recipient_NPI': ['111', '222', '333']
+        }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+        (tmp_path / "missing_npis").mkdir()
+
+        recovered = clean_op_data(
+            tmp_path / "test_data.csv",
+            tmp_path / "cleaned.csv",
+            "cleaned.csv",
+            2016,
+            ['111'],
+            'general',
+            tmp_path / "test_harmonized_cols.csv",
+            tmp_path / "test_providers_npis_ids.csv",
+            f"{tmp_path / 'missing_npis'}/",
+            chunksize=chunksize,
+        )
+
+        # rows with a known profile ID are kept, existing NPIs are not replaced
+        assert recovered == {'Covered_Recipient_NPI': 2}
+        result = pd.read_csv(tmp_path / "cleaned.csv", dtype=str)
+        assert result['Covered_Recipient_NPI'].to_list() == ['111', '123', '333']
+        assert result['Onc_Prescriber'].to_list() == ['1', '0', '0']
+        missing = pd.read_csv(tmp_path / "missing_npis" / "cleaned.csv", dtype=str)
+        assert missing['Covered_Recipient_Profile_ID'].to_list() == ['4']
+
+    @pytest.mark.parametrize("chunksize", [None, 1])
+    def test_clean_op_data_research_2014_keeps_rows_without_npis(self, tmp_path, chunksize):
+        # as add_npis_2014 did: profile IDs lose their decimals and research rows
+        # with no NPI found are kept with empty NPIs
+        raw = pd.DataFrame({
+            'Covered_Recipient_Profile_ID': ['1.0', '9.0'],
+            'Principal_Investigator_1_Profile_ID': ['7.0', '8.0'],
+        })
+        for col in [col for pair in MERGE_COLS_2014_2015 for col in pair]:
+            raw[col] = ''
+        raw['Name_of_Associated_Covered_Drug_or_Biological1'] = ['Trelstar', 'Zytiga']
+        raw.to_csv(tmp_path / "test_data.csv", index=False)
+        pd.DataFrame({
+            '2014': ['Covered_Recipient_Profile_ID', 'PI_1_Profile_ID'] + [
+                f'Drug_Biological_Device_Med_Sup_{i}' for i in range(1, 6)
+            ]
+        }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+        pd.DataFrame({
+            'Covered_Recipient_Profile_ID': ['1', '7'], 'Covered_Recipient_NPI': ['111', '777']
+        }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+        (tmp_path / "missing_npis").mkdir()
+
+        clean_op_data(
+            tmp_path / "test_data.csv",
+            tmp_path / "cleaned.csv",
+            "cleaned.csv",
+            2014,
+            ['111'],
+            'research',
+            tmp_path / "test_harmonized_cols.csv",
+            tmp_path / "test_providers_npis_ids.csv",
+            f"{tmp_path / 'missing_npis'}/",
+            chunksize=chunksize,
+        )
+
+        result = pd.read_csv(tmp_path / "cleaned.csv", dtype=str, keep_default_na=False)
+        assert result['Covered_Recipient_Profile_ID'].to_list() == ['1', '9']
+        assert result['PI_1_Profile_ID'].to_list() == ['7', '8']
+        assert result['Covered_Recipient_NPI'].to_list() == ['111', '']
+        assert result['PI_1_NPI'].to_list() == ['777', '']
+
+
+class TestCleanOpDataMemory:
+    """Peak memory of clean_op_data on a synthetic year, as a multiple of the input frame size."""
+
+    @staticmethod
+    def write_synthetic_year(tmp_path, n_rows=20_000):
+        rng = np.random.default_rng(0)
+        drugs = np.array(['Trelstar', 'Pluvicto', 'Xtandi', 'DRUG_C', 'Zytiga', ''])
+        df = pd.DataFrame({
+            'Covered_Recipient_NPI': np.where(
+                rng.random(n_rows) < 0.1, '', rng.integers(10**9, 2 * 10**9, n_rows).astype(str)
+            ),
+            'Covered_Recipient_Profile_ID': rng.integers(1, 10**6, n_rows).astype(str),
+            'Record_ID': np.arange(n_rows).astype(str),
+            'Total_Amount_of_Payment_USDollars': rng.random(n_rows).round(2).astype(str),
+            'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1': rng.choice(drugs, n_rows),
+            'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_2': rng.choice(drugs, n_rows),
+        })
+        df.to_csv(tmp_path / "year.csv", index=False)
+        pd.DataFrame({
+            '2016': list(df.columns[:4]) + ['Drug_Biological_Device_Med_Sup_1', 'Drug_Biological_Device_Med_Sup_2']
+        }).to_csv(tmp_path / "cols.csv", index=False)
+        pd.DataFrame({
+            'Covered_Recipient_Profile_ID': df['Covered_Recipient_Profile_ID'][:1000],
+            'Covered_Recipient_NPI': '1234567893',
+        }).to_csv(tmp_path / "providers_npis_ids.csv", index=False)
+        (tmp_path / "missing_npis").mkdir()
+        return read_csv(tmp_path / "year.csv", engine="c").memory_usage(deep=True).sum()
+
+    @pytest.fixture(autouse=True)
+    def copy_on_write(self):
+        # as set by main.main, see enable_copy_on_write
+        with pd.option_context("mode.copy_on_write", True):
+            yield
+
+    @staticmethod
+    def measure_peak(tmp_path, engine, chunksize):
+        """
+        Peak bytes allocated while cleaning: tracemalloc sees Python/NumPy
+        allocations, pyarrow's memory pool is tracked through a proxy pool.
+        Both peaks are added, an upper bound of the true peak. The pool's
+        fixed reader buffers (ARROW_BLOCK_SIZE) don't grow with the input
+        and are left out.
+        """
+        pool = old_pool = None
+        if pa is not None:
+            old_pool = pa.default_memory_pool()
+            pool = pa.proxy_memory_pool(old_pool)
+            pa.set_memory_pool(pool)
+        tracemalloc.start()
+        try:
+            clean_op_data(
+                tmp_path / "year.csv",
+                tmp_path / "cleaned.csv",
+                "cleaned.csv",
+                2016,
+                ['1234567893'],
+                'general',
+                tmp_path / "cols.csv",
+                tmp_path / "providers_npis_ids.csv",
+                f"{tmp_path / 'missing_npis'}/",
+                engine=engine,
+                chunksize=chunksize,
+            )
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            if pool is not None:
+                pa.set_memory_pool(old_pool)
+        return peak + (max(pool.max_memory() - ARROW_BLOCK_SIZE, 0) if pool is not None else 0)
+
+    # default engine: pyarrow's table and the frame converted from it coexist when reading the whole file
+    @pytest.mark.parametrize("engine, chunksize, max_ratio", [
+        ("c", None, 1.45), ("c", 2_000, 0.5), ("auto", None, 1.6), ("auto", 2_000, 0.5),
+    ])
+    def test_peak_memory(self, tmp_path, engine, chunksize, max_ratio):
+        input_size = self.write_synthetic_year(tmp_path)
+        peak = self.measure_peak(tmp_path, engine, chunksize)
+        assert len(pd.read_csv(tmp_path / "cleaned.csv", dtype=str)) > 0
+        assert peak <= max_ratio * input_size, f"peak {peak / input_size:.2f}x the input size"
+
+
+@pytest.mark.parametrize("chunksize", [None, 2])
+def test_clean_op_data_writes_recipients(tmp_path, chunksize):
+    pd.DataFrame({
+        'Record_ID': ['10', '11', '12'],
+        'Covered_Recipient_NPI': ['123', '', ''],
+        'Covered_Recipient_Profile_ID': ['1.0', '', ''],
+        'Principal_Investigator_1_NPI': ['', '456', ''],
+        'Principal_Investigator_1_Profile_ID': ['', '2', ''],
+        'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1': ['Trelstar', 'Trelstar', 'Zytiga'],
+    }).to_csv(tmp_path / "test_data.csv", index=False)
+    pd.DataFrame({
+        '2016': ['Record_ID', 'Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID', 'PI_1_NPI', 'PI_1_Profile_ID',
+                 'Drug_Biological_Device_Med_Sup_1']
+    }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+    pd.DataFrame({
+        'Covered_Recipient_Profile_ID': ['9'], 'Covered_Recipient_NPI': ['999']
+    }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+    (tmp_path / "missing_npis").mkdir()
+
+    clean_op_data(
+        tmp_path / "test_data.csv",
+        tmp_path / "cleaned.csv",
+        "cleaned.csv",
+        2016,
+        ['456'],
+        'research',
+        tmp_path / "test_harmonized_cols.csv",
+        tmp_path / "test_providers_npis_ids.csv",
+        f"{tmp_path / 'missing_npis'}/",
+        chunksize=chunksize,
+        path_recipients=tmp_path / "recipients.csv",
+    )
+
+    recipients = pd.read_csv(tmp_path / "recipients.csv", dtype=str).fillna('')
+    assert recipients.to_dict('list') == {
+        'Record_ID': ['10', '11'],
+        'Role': ['Covered_Recipient', 'PI_1'],
+        'NPI': ['123', '456'],
+        'Profile_ID': ['1', '2'],
+    }
+    cleaned = pd.read_csv(tmp_path / "cleaned.csv", dtype=str)
+    assert cleaned['Onc_Prescriber'].to_list() == ['0', '1']
+
+
+@pytest.mark.parametrize("engine", ["c", pytest.param("pyarrow", marks=pytest.mark.skipif(
+    resolve_csv_engine("auto") != "pyarrow", reason="pyarrow not installed"))])
+def test_concatenated_chunks_with_empty_cells_clean(tmp_path, engine):
+    chunks_dir = tmp_path / "chunks"
+    chunks_dir.mkdir()
+    raw_cols = [
+        'Record_ID', 'Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID', 'Principal_Investigator_1_NPI',
+        'Principal_Investigator_1_Profile_ID', 'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1',
+        'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_2',
+    ]
+    rows = [
+        ['1', '123', '1', '', '', 'Trelstar', ''],
+        ['2', '', '', '456', '2', 'Xtandi', ''],
+        ['3', '789.0', '', '', '', '', 'Zytiga'],
+        ['4', '', '', '', '', 'Lupron', ''],
+        ['5', '321', '5', '654', '', 'Casodex', 'DRUG_D'],
+    ]
+    for i, start in enumerate(range(0, len(rows), 2)):
+        pd.DataFrame(rows[start:start + 2], columns=raw_cols).to_csv(chunks_dir / f"chunk_{i}.csv", index=False)
+    concatenate_chunks(chunks_dir, tmp_path / "filtered.csv", engine=engine)
+
+    filtered = pd.read_csv(tmp_path / "filtered.csv", dtype=str, keep_default_na=False)
+    assert len(filtered) == 5
+    assert not filtered.isin(['None', 'nan']).any().any()
+
+    pd.DataFrame({
+        '2016': ['Record_ID', 'Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID', 'PI_1_NPI', 'PI_1_Profile_ID',
+                 'Drug_Biological_Device_Med_Sup_1', 'Drug_Biological_Device_Med_Sup_2']
+    }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+    pd.DataFrame({
+        'Covered_Recipient_Profile_ID': ['9'], 'Covered_Recipient_NPI': ['999']
+    }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+    (tmp_path / "missing_npis").mkdir()
+    clean_op_data(
+        tmp_path / "filtered.csv",
+        tmp_path / "cleaned.csv",
+        "cleaned.csv",
+        2016,
+        ['456'],
+        'research',
+        tmp_path / "test_harmonized_cols.csv",
+        tmp_path / "test_providers_npis_ids.csv",
+        f"{tmp_path / 'missing_npis'}/",
+        engine=engine,
+    )
+
+    cleaned = pd.read_csv(tmp_path / "cleaned.csv", dtype=str, keep_default_na=False)
+    assert sorted(cleaned['Record_ID']) == ['1', '2', '3', '5']
+    assert not cleaned.isin(['None', 'nan']).any().any()
+    missing = pd.read_csv(tmp_path / "missing_npis" / "cleaned.csv", dtype=str)
+    assert missing['Record_ID'].to_list() == ['4']
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_fuzzy_filtered_rows_clean_and_finalize(tmp_path, cached):
+    ref_path = "data/reference/ProstateDrugList.csv"
+    match_cache_path = tmp_path / "cache.sqlite" if cached else None
+    pd.DataFrame({
+        'Record_ID': ['1', '2', '3', '4'],
+        'Covered_Recipient_NPI': ['123', '456', '789', '321'],
+        'Covered_Recipient_Profile_ID': ['1', '2', '3', '4'],
+        'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1': ['Xtandii', 'Keytruda', 'Zytiga', ''],
+        'Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_2': ['', 'Trelstarr', '', 'Keytruda'],
+    }).to_csv(tmp_path / "raw.csv", index=False)
+    (tmp_path / "chunks").mkdir()
+    filter_open_payments(
+        2022, "general", ref_path, tmp_path / "raw.csv", f"{tmp_path / 'chunks'}/", fuzzy=True,
+        match_cache_path=match_cache_path,
+    )
+    concatenate_chunks(tmp_path / "chunks", tmp_path / "filtered.csv")
+
+    pd.DataFrame({
+        '2022': ['Record_ID', 'Covered_Recipient_NPI', 'Covered_Recipient_Profile_ID',
+                 'Drug_Biological_Device_Med_Sup_1', 'Drug_Biological_Device_Med_Sup_2']
+    }).to_csv(tmp_path / "test_harmonized_cols.csv", index=False)
+    pd.DataFrame({
+        'Covered_Recipient_Profile_ID': ['9'], 'Covered_Recipient_NPI': ['999']
+    }).to_csv(tmp_path / "test_providers_npis_ids.csv", index=False)
+    (tmp_path / "missing_npis").mkdir()
+    clean_op_data(
+        tmp_path / "filtered.csv",
+        tmp_path / "general_2022.csv",
+        "general_2022.csv",
+        2022,
+        ['456'],
+        'general',
+        tmp_path / "test_harmonized_cols.csv",
+        tmp_path / "test_providers_npis_ids.csv",
+        f"{tmp_path / 'missing_npis'}/",
+        match_cache_path=match_cache_path,
+        fuzzy=True,
+    )
+    cleaned = pd.read_csv(tmp_path / "general_2022.csv", dtype=str).set_index('Record_ID')
+    # fuzzy accepted strings get their matched reference drug, like exact matches
+    assert cleaned['Drug_Name'].to_dict() == {'1': 'enzalutamide', '2': 'triptorelin', '3': 'abiraterone'}
+    assert cleaned['Prostate_Drug_Type'].to_dict() == {'1': '0', '2': '1', '3': '0'}
+    assert cleaned['Onc_Prescriber'].to_dict() == {'1': '0', '2': '1', '3': '0'}
+
+    finalize_generic_names(tmp_path / "general_2022.csv", f"{tmp_path / 'final_generics'}/")
+    final = pd.read_csv(tmp_path / "final_generics" / "general_2022_final.csv", dtype=str)
+    assert final['Drug_Name'].to_list() == ['Enzalutamide', 'Triptorelin', 'Abiraterone']
+
+
+@pytest.mark.parametrize("dataset_type, year", [("general", 2016), ("research", 2016), ("research", 2014)])
+@pytest.mark.parametrize("chunksize", [None, 20])
+def test_clean_op_data_wide_frame_not_fragmented(tmp_path, dataset_type, year, chunksize):
+    # as wide as the raw research files: harmonized frames hold one block per column, and
+    # inserting columns one at a time into them warns about fragmentation
+    extra_cols = [f"Extra_{i}" for i in range(150)]
+    pi_cols = [(f"Principal_Investigator_{i}_Profile_ID", f"PI_{i}_Profile_ID") for i in range(1, 6)]
+    if year >= 2016:
+        pi_cols += [(f"Principal_Investigator_{i}_NPI", f"PI_{i}_NPI") for i in range(1, 6)]
+    cols = [("Record_ID", "Record_ID"), ("Covered_Recipient_Profile_ID", "Covered_Recipient_Profile_ID")]
+    # 2014 has no NPI columns, they are recovered from profile IDs
+    if year >= 2016:
+        cols.append(("Covered_Recipient_NPI", "Covered_Recipient_NPI"))
+    cols += (pi_cols if dataset_type == "research" else []) + [(col, col) for col in extra_cols]
+    if year < 2016:
+        drug_cols = [col for pair in MERGE_COLS_2014_2015 for col in pair]
+    else:
+        drug_cols = [f"Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_{i}" for i in range(1, 6)]
+    harmonized_drug_cols = [f"Drug_Biological_Device_Med_Sup_{i}" for i in range(1, 6)]
+    n_rows = 50
+    raw = pd.DataFrame({raw_col: [str(i) for i in range(n_rows)] for raw_col, _ in cols})
+    for col in drug_cols:
+        raw[col] = ""
+    raw[drug_cols[0]] = "Trelstar"
+    raw.to_csv(tmp_path / "raw.csv", index=False)
+    pd.DataFrame({str(year): [col for _, col in cols] + harmonized_drug_cols}).to_csv(
+        tmp_path / "cols.csv", index=False
+    )
+    pd.DataFrame({
+        'Covered_Recipient_Profile_ID': [str(i) for i in range(n_rows)], 'Covered_Recipient_NPI': '1234567893',
+    }).to_csv(tmp_path / "providers_npis_ids.csv", index=False)
+    (tmp_path / "missing_npis").mkdir()
+
+    with pd.option_context("mode.copy_on_write", True), warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.PerformanceWarning)
+        clean_op_data(
+            tmp_path / "raw.csv",
+            tmp_path / "cleaned.csv",
+            "cleaned.csv",
+            year,
+            ['1234567893'],
+            dataset_type,
+            tmp_path / "cols.csv",
+            tmp_path / "providers_npis_ids.csv",
+            f"{tmp_path / 'missing_npis'}/",
+            chunksize=chunksize,
+            path_recipients=tmp_path / "recipients.csv",
+        )
+    cleaned = pd.read_csv(tmp_path / "cleaned.csv", dtype=str)
+    assert len(cleaned) == n_rows
+    assert cleaned['Drug_Name'].eq('triptorelin').all()
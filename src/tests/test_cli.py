@@ -0,0 +1,109 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.cli import (
+    parse_years,
+    parse_datasets,
+    main,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_python(code, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+
+
+def test_parse_years():
+    assert parse_years("2022") == [2022]
+    assert parse_years("2020-2023") == [2020, 2021, 2022, 2023]
+    assert parse_years("2014, 2021-2022") == [2014, 2021, 2022]
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_years("last")
+
+
+def test_parse_datasets():
+    assert parse_datasets("general,research") == ["general", "research"]
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_datasets("ownership")
+
+
+def test_cli_imports_no_pandas(tmp_path):
+    result = run_python("import sys, src.cli; print('pandas' in sys.modules)", tmp_path)
+    assert result.stdout.strip() == "False"
+
+
+def test_imports_create_no_log_files(tmp_path):
+    modules = [
+        "_utils", "filter_op", "filter_prescribers", "clean_final_tables", "main", "raw_index",
+        "record_index", "analytics_store", "join_prescribing", "fuzzy_match", "match_cache",
+    ]
+    run_python("; ".join(f"import src.{module}" for module in modules), tmp_path)
+    assert not (tmp_path / "data").exists()
+
+
+def test_setup_logging_once(tmp_path):
+    result = run_python(
+        "from src.log_config import setup_logging; print(setup_logging() == setup_logging())", tmp_path
+        )
+    assert result.stdout.strip() == "True"
+    assert len(os.listdir(tmp_path / "data" / "logs")) == 1
+
+
+def test_dry_run(tmp_path, capsys):
+    raw_dir = tmp_path / "raw"
+    (raw_dir / "general_payments").mkdir(parents=True)
+    (raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025.csv").write_text("a\n")
+    year2npis = tmp_path / "year2npis.json"
+    year2npis.write_text("{}")
+    argv = ["run", "--years", "2022", "--datasets", "general", "--raw-dir", f"{raw_dir}/",
+            "--year2npis", str(year2npis), "--compression", "gzip", "--dry-run"]
+
+    assert main(argv) == 0
+    out = capsys.readouterr().out
+    assert f"general 2022: {raw_dir}/general_payments/OP_DTL_GNRL_PGYR2022_P01302025.csv" in out
+    assert "data/final_files/general_payments/general_2022_may8.csv.gz" in out
+
+    argv[argv.index("2022")] = "2022-2023"
+    assert main(argv) == 1
+    assert "general 2023: MISSING" in capsys.readouterr().out
+
+
+def test_run_store_option(monkeypatch):
+    import src.main
+    calls = []
+    monkeypatch.setattr(src.main, "main", lambda **kwargs: calls.append(kwargs))
+
+    assert main(["--no-log-file", "run", "--years", "2022", "--store"]) == 0
+    assert main(["--no-log-file", "run", "--years", "2022"]) == 0
+    assert [call["store_path"] for call in calls] == ["data/final_files/op_store.sqlite", None]
+
+
+def test_index_and_get_record(tmp_path, capsys):
+    general_dir = tmp_path / "final_files" / "general_payments"
+    general_dir.mkdir(parents=True)
+    (general_dir / "general_2022_may8.csv").write_text("Record_ID,Drug_Name\n1,olaparib\n2,docetaxel\n")
+    index = str(tmp_path / "record_index.sqlite")
+
+    assert main(["--no-log-file", "index-records", "--final-dir", f"{tmp_path / 'final_files'}/", "--index", index]) == 0
+    assert main(["--no-log-file", "get-record", "2", "--index", index]) == 0
+    assert "docetaxel" in capsys.readouterr().out
+
+
+def test_filter_lists_command(monkeypatch):
+    import src.filter_op
+    calls = []
+    monkeypatch.setattr(src.filter_op, "filter_lists", lambda *args: calls.append(args))
+
+    argv = ["--no-log-file", "filter-lists", "--list", "breast=breast.csv", "--list", "lung=lung.csv", "--years", "2022"]
+    assert main(argv) == 0
+    ref_paths, years, dataset_types = calls[0][:3]
+    assert ref_paths == {"breast": "breast.csv", "lung": "lung.csv"}
+    assert years == [2022]
+    with pytest.raises(SystemExit):
+        main(["--no-log-file", "filter-lists", "--list", "breast"])
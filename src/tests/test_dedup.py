@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.dedup import (
+    hash_record_ids,
+    latest_version_mask,
+    dedup_record_ids,
+    write_dedup_report,
+)
+
+
+def test_hash_record_ids():
+    hashes = hash_record_ids(['101', ' 101', '101.0', '102', None, ''])
+    assert hashes[0] == hashes[1] == hashes[2]
+    assert hashes[3] != hashes[0]
+    assert hashes[4] == hashes[5] == 0
+
+
+def test_latest_version_mask():
+    hashes = np.array([5, 7, 5, 0, 0, 9, 7], dtype=np.uint64)
+    assert latest_version_mask(hashes).tolist() == [False, False, True, True, True, True, True]
+
+
+@pytest.mark.parametrize("chunksize", [2, 100])
+@pytest.mark.parametrize("extension", ["", ".gz"])
+def test_dedup_record_ids(tmp_path, chunksize, extension):
+    df = pd.DataFrame({
+        'Record_ID': ['1', '2', '1', '3', '', '2', '1'],
+        'Change_Type': ['NEW', 'NEW', 'CHANGED', 'NEW', 'NEW', 'UNCHANGED', 'CHANGED'],
+        'Amount': ['10', '20', '11', '30', '40', '20', '12'],
+    })
+    path = tmp_path / f"general_2020.csv{extension}"
+    df.to_csv(path, index=False)
+
+    # in place
+    assert dedup_record_ids(path, path, chunksize=chunksize) == 3
+    result = pd.read_csv(path, dtype=str, keep_default_na=False)
+    assert result['Record_ID'].to_list() == ['3', '', '2', '1']
+    assert result['Amount'].to_list() == ['30', '40', '20', '12']
+    assert not list(tmp_path.glob(".dedup_tmp_*"))
+
+
+def test_dedup_record_ids_releases(tmp_path):
+    # a refreshed release overrides the older one
+    old = pd.DataFrame({'Record_ID': ['1', '2'], 'Amount': ['10', '20']})
+    new = pd.DataFrame({'Record_ID': ['2', '3'], 'Amount': ['21', '30']})
+    old.to_csv(tmp_path / "old.csv", index=False)
+    new.to_csv(tmp_path / "new.csv", index=False)
+
+    removed = dedup_record_ids([tmp_path / "old.csv", tmp_path / "new.csv"], tmp_path / "out.csv")
+
+    assert removed == 1
+    result = pd.read_csv(tmp_path / "out.csv", dtype=str)
+    assert result.to_dict('list') == {'Record_ID': ['1', '2', '3'], 'Amount': ['10', '21', '30']}
+
+
+def test_dedup_record_ids_no_record_id(tmp_path):
+    pd.DataFrame({'Amount': ['1']}).to_csv(tmp_path / "in.csv", index=False)
+    with pytest.raises(ValueError):
+        dedup_record_ids(tmp_path / "in.csv", tmp_path / "out.csv")
+
+
+def test_write_dedup_report(tmp_path):
+    report = write_dedup_report({("research", 2021): 0, ("general", 2021): 4}, tmp_path / "report.csv")
+    assert report.values.tolist() == [["general", 2021, 4], ["research", 2021, 0]]
@@ -0,0 +1,143 @@
+import gzip
+import io
+import os
+import zipfile
+
+import pandas as pd
+
+from src.dev_fixtures import (
+    build_fixtures,
+    iter_raw_records,
+    op_row_matcher,
+    prescriber_row_matcher,
+    sample_raw_file,
+)
+from src._utils import read_csv
+from src.filter_op import filter_open_payments
+from src.paths import get_op_raw_path
+
+REF_PATH = "data/reference/ProstateDrugList.csv"
+DRUG_COL = "Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1"
+
+
+def make_raw_op(n_rows=200, bom=True, crlf=True):
+    """Raw OP bytes with a BOM, CRLF terminators and a quoted newline; every 20th row is Xtandi."""
+    newline = '\r\n' if crlf else '\n'
+    lines = [f'Record_ID,{DRUG_COL},Contextual_Information']
+    for i in range(n_rows):
+        drug = 'XTANDI' if i % 20 == 0 else f'drug{i}'
+        context = '"two\nlines, ""quoted"""' if i % 7 == 0 else f'row {i}'
+        lines.append(f'{1000 + i},{drug},{context}')
+    content = newline.join(lines) + newline
+    return (b'\xef\xbb\xbf' if bom else b'') + content.encode('utf-8')
+
+
+def test_iter_raw_records():
+    records = list(iter_raw_records(io.BytesIO(b'a,b\r\n1,"x\r\ny"\r\n\r\n2,z')))
+    assert records == [b'a,b\r\n', b'1,"x\r\ny"\r\n', b'2,z']
+
+
+def test_sample_raw_file(tmp_path):
+    raw = make_raw_op()
+    (tmp_path / "raw.csv").write_bytes(raw)
+
+    counts = sample_raw_file(
+        tmp_path / "raw.csv", tmp_path / "fixture.csv", op_row_matcher(2022, REF_PATH), n_sample=15, seed=1, chunksize=32
+    )
+
+    assert counts == {'rows': 200, 'matched': 10, 'sampled': 15}
+    fixture = (tmp_path / "fixture.csv").read_bytes()
+    # header and record bytes are the original ones
+    assert fixture.startswith(raw.split(b'\r\n')[0] + b'\r\n')
+    raw_records = list(iter_raw_records(io.BytesIO(raw)))
+    fixture_records = list(iter_raw_records(io.BytesIO(fixture)))
+    assert all(record in raw_records for record in fixture_records)
+    df = pd.read_csv(tmp_path / "fixture.csv", dtype=str)
+    assert len(df) == 25
+    assert (df[DRUG_COL] == 'XTANDI').sum() == 10
+    # sampled rows are in raw file order, after the matched rows
+    assert df['Record_ID'].iloc[10:].astype(int).is_monotonic_increasing
+
+
+def test_sample_raw_file_deterministic(tmp_path):
+    (tmp_path / "raw.csv").write_bytes(make_raw_op())
+    matcher = op_row_matcher(2022, REF_PATH)
+    for name, seed in [("a.csv", 3), ("b.csv", 3), ("c.csv", 4)]:
+        sample_raw_file(tmp_path / "raw.csv", tmp_path / name, matcher, n_sample=15, seed=seed, chunksize=50)
+    assert (tmp_path / "a.csv").read_bytes() == (tmp_path / "b.csv").read_bytes()
+    assert (tmp_path / "a.csv").read_bytes() != (tmp_path / "c.csv").read_bytes()
+
+
+def test_sample_raw_file_small_input(tmp_path):
+    with gzip.open(tmp_path / "raw.csv.gz", "wb") as f:
+        f.write(make_raw_op(n_rows=5, bom=False, crlf=False).rstrip(b'\n'))
+    counts = sample_raw_file(tmp_path / "raw.csv.gz", tmp_path / "fixture.csv", op_row_matcher(2022, REF_PATH))
+    assert counts == {'rows': 5, 'matched': 1, 'sampled': 4}
+    assert len(pd.read_csv(tmp_path / "fixture.csv")) == 5
+
+
+def test_fixture_keeps_filter_matches(tmp_path):
+    (tmp_path / "raw.csv").write_bytes(make_raw_op())
+    sample_raw_file(tmp_path / "raw.csv", tmp_path / "fixture.csv", op_row_matcher(2022, REF_PATH), n_sample=5)
+    for name in ["raw", "fixture"]:
+        (tmp_path / name).mkdir()
+        filter_open_payments(2022, "general", REF_PATH, tmp_path / f"{name}.csv", f"{tmp_path / name}/")
+    matched = [
+        pd.concat([pd.read_csv(path, dtype=str) for path in sorted((tmp_path / name).iterdir())])
+        for name in ["raw", "fixture"]
+    ]
+    assert sorted(matched[0]['Record_ID']) == sorted(matched[1]['Record_ID'])
+
+
+def test_prescriber_row_matcher():
+    chunk = pd.DataFrame({
+        'Prscrbr_NPI': ['1', '2', '3'],
+        'Brnd_Name': ['Xtandi', 'Zytiga', 'Tylenol'],
+        'Gnrc_Name': ['Enzalutamide', 'Abiraterone Acetate', 'Acetaminophen'],
+    })
+    assert prescriber_row_matcher(chunk).tolist() == [True, True, False]
+
+
+def test_build_fixtures(tmp_path):
+    raw_dir = tmp_path / "raw"
+    (raw_dir / "prescribers").mkdir(parents=True)
+    with zipfile.ZipFile(raw_dir / "PGYR2022_P01302025.zip", "w") as bundle:
+        bundle.writestr("OP_DTL_GNRL_PGYR2022_P01302025.csv", make_raw_op())
+    pd.DataFrame({
+        'Prscrbr_NPI': [str(i) for i in range(50)],
+        'Prscrbr_Type': 'Urology',
+        'Brnd_Name': ['Xtandi' if i < 3 else 'Other' for i in range(50)],
+        'Gnrc_Name': ['Enzalutamide' if i < 3 else 'Other' for i in range(50)],
+    }).to_csv(raw_dir / "prescribers" / "2021_Urology.csv", index=False)
+
+    out_dir = tmp_path / "fixtures"
+    fixtures = build_fixtures(
+        f"{out_dir}/", years=[2022], dataset_types=["general"], raw_dir=f"{raw_dir}/", ref_path=REF_PATH,
+        prescribers_dir=raw_dir / "prescribers", n_sample=10
+    )
+
+    assert [counts for _, counts in fixtures] == [
+        {'rows': 200, 'matched': 10, 'sampled': 10},
+        {'rows': 50, 'matched': 3, 'sampled': 10},
+    ]
+    assert (out_dir / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025.csv").exists()
+    assert (out_dir / "prescribers" / "chunks" / "2021_Urology.csv").exists()
+
+
+def test_build_fixtures_compressed_input(tmp_path):
+    raw_dir = tmp_path / "raw"
+    (raw_dir / "research_payments").mkdir(parents=True)
+    with gzip.open(raw_dir / "research_payments" / "OP_DTL_RSRCH_PGYR2022_P01302025.csv.gz", "wb") as f:
+        f.write(make_raw_op())
+
+    out_dir = tmp_path / "fixtures"
+    build_fixtures(
+        f"{out_dir}/", years=[2022], dataset_types=["research"], raw_dir=f"{raw_dir}/", ref_path=REF_PATH,
+        prescribers_dir=None, n_sample=10
+    )
+
+    # a plain csv fixture under a plain csv name, which the pipeline reads back
+    fixture = out_dir / "research_payments" / "OP_DTL_RSRCH_PGYR2022_P01302025.csv"
+    assert os.listdir(out_dir / "research_payments") == [fixture.name]
+    assert get_op_raw_path(2022, "research", f"{out_dir}/") == str(fixture)
+    assert len(read_csv(fixture)) == 20
@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from src.diff_runs import (
+    diff_final_file,
+    diff_runs,
+)
+
+
+OLD = pd.DataFrame({
+    'Record_ID': ['1', '2', '3', '4'],
+    'Drug_Name': ['enzalutamide', 'abiraterone', 'leuprolide', 'apalutamide'],
+    'Onc_Prescriber': ['1', '0', '1', '0'],
+    'Amount': ['10', '20', '30', '40'],
+})
+NEW = pd.DataFrame({
+    'Record_ID': ['5', '3', '2', '1'],
+    'Drug_Name': ['darolutamide', 'leuprolide', 'abiraterone', 'Enzalutamide'],
+    'Onc_Prescriber': ['1', '0', '0', '0'],
+    'Amount': ['50', '30', '20', '10'],
+    'Prostate_Drug_Type': ['1', '1', '1', '1'],
+})
+
+
+@pytest.mark.parametrize("chunksize", [1, 100])
+def test_diff_final_file(tmp_path, write_final, chunksize):
+    path_a = write_final(OLD, "general", 2020, final_dir=tmp_path / "a")
+    path_b = write_final(NEW, "general", 2020, ".gz", final_dir=tmp_path / "b")
+
+    counts, by_column = diff_final_file(path_a, path_b, tmp_path / "details.csv", chunksize=chunksize)
+
+    assert counts == {
+        'rows_a': 4, 'rows_b': 4, 'added': 1, 'removed': 1, 'changed': 2, 'unchanged': 1,
+        'columns_added': 'Prostate_Drug_Type', 'columns_removed': '',
+    }
+    # row order doesn't matter, only Record_ID
+    assert by_column == {'Drug_Name': 1, 'Onc_Prescriber': 2}
+    details = pd.read_csv(tmp_path / "details.csv", dtype=str, keep_default_na=False)
+    assert sorted(details.itertuples(index=False, name=None)) == [
+        ('1', 'changed', 'Drug_Name;Onc_Prescriber'),
+        ('3', 'changed', 'Onc_Prescriber'),
+        ('4', 'removed', ''),
+        ('5', 'added', ''),
+    ]
+
+
+def test_diff_final_file_no_record_id(tmp_path):
+    pd.DataFrame({'Amount': ['1']}).to_csv(tmp_path / "a.csv", index=False)
+    with pytest.raises(ValueError):
+        diff_final_file(tmp_path / "a.csv", tmp_path / "a.csv")
+
+
+def test_diff_runs(tmp_path, write_final):
+    write_final(OLD, "general", 2020, final_dir=tmp_path / "a")
+    write_final(NEW, "general", 2020, final_dir=tmp_path / "b")
+    write_final(OLD, "research", 2021, final_dir=tmp_path / "a")
+    write_final(OLD, "research", 2021, final_dir=tmp_path / "b")
+    # new table in b
+    write_final(OLD, "general", 2022, final_dir=tmp_path / "b")
+
+    summary = diff_runs(tmp_path / "a", tmp_path / "b", tmp_path / "diff")
+
+    assert summary[['dataset_type', 'year', 'added', 'removed', 'changed', 'unchanged']].values.tolist() == [
+        ['general', 2020, 1, 1, 2, 1],
+        ['general', 2022, 4, 0, 0, 0],
+        ['research', 2021, 0, 0, 0, 4],
+    ]
+    saved = pd.read_csv(tmp_path / "diff" / "summary.csv", keep_default_na=False)
+    assert saved['changed'].to_list() == [2, 0, 0]
+    assert saved['columns_added'].to_list() == ['Prostate_Drug_Type', 'Record_ID;Drug_Name;Onc_Prescriber;Amount', '']
+    changed_columns = pd.read_csv(tmp_path / "diff" / "changed_columns.csv")
+    assert changed_columns.values.tolist() == [
+        ['general', 2020, 'Drug_Name', 1], ['general', 2020, 'Onc_Prescriber', 2]
+    ]
+    assert len(pd.read_csv(tmp_path / "diff" / "rows" / "general_2022.csv")) == 4
+    assert len(pd.read_csv(tmp_path / "diff" / "rows" / "research_2021.csv")) == 0
@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+import zipfile
 
 import pytest
 
@@ -8,8 +9,15 @@ from src.filter_op import (
     get_op_raw_path,
     get_op_drug_columns,
     find_matches_op,
-    filter_open_payments
+    find_fuzzy_matches_op,
+    filter_open_payments,
+    build_multi_list_lookup,
+    find_matches_op_multi,
+    filter_open_payments_multi,
+    filter_lists,
 )
+from src.fuzzy_match import FuzzyDrugMatcher
+from src._utils import concatenate_chunks
 
 
 def test_get_ref_drug_names(tmp_path):
@@ -55,6 +63,24 @@ class TestGetOpRawPath():
         with pytest.raises(ValueError):
             get_op_raw_path(year, dataset_type)
 
+    def test_zip_bundle(self, tmp_path):
+        raw_dir = tmp_path / "raw"
+        (raw_dir / "general_payments").mkdir(parents=True)
+        with zipfile.ZipFile(raw_dir / "PGYR2022_P01302025_01212025.zip", "w") as bundle:
+            bundle.writestr("OP_PGYR2022_README_P01302025.txt", "readme")
+            bundle.writestr("OP_DTL_RSRCH_PGYR2022_P01302025_01212025.csv", "a\n1\n")
+            bundle.writestr("OP_DTL_GNRL_PGYR2022_P01302025_01212025.csv", "a\n1\n")
+        assert get_op_raw_path(2022, "general", f"{raw_dir}/") == (
+            f"{raw_dir}/PGYR2022_P01302025_01212025.zip/OP_DTL_GNRL_PGYR2022_P01302025_01212025.csv"
+            )
+        # extracted files win over bundles
+        (raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025_01212025.csv").write_text("a\n1\n")
+        assert get_op_raw_path(2022, "general", f"{raw_dir}/") == (
+            f"{raw_dir}/general_payments/OP_DTL_GNRL_PGYR2022_P01302025_01212025.csv"
+            )
+        with pytest.raises(ValueError):
+            get_op_raw_path(2021, "general", f"{raw_dir}/")
+
 
 class TestGetOpDrugColumns():
     def test_op_drug_cols_2014_2015(self):
@@ -178,4 +204,196 @@ class TestFilterOpenPayments():
         filtered_chunk = pd.read_csv(dir_out / "general_2022_chunk_0.csv")
         assert filtered_chunk.equals(expected_chunk)
 
+    def test_filter_open_payments_pipelined(self, tmp_path):
+        ref_path = "data/reference/ProstateDrugList.csv"
+        test_data = pd.DataFrame({
+            "name_of_drug_or_biological_or_device_or_medical_supply_1": ["Lynparza", "drug1", "Xtandi"] * 20,
+            "other_column": [str(i) for i in range(60)],
+        })
+        op_path = tmp_path / "test_filter_op_file.csv"
+        test_data.to_csv(op_path, index=False)
+
+        outputs = {}
+        for pipelined in [False, True]:
+            dir_out = tmp_path / f"chunks_{pipelined}"
+            dir_out.mkdir()
+            filter_open_payments(
+                2022, "general", ref_path, op_path, f"{dir_out}/", pipelined=pipelined, queue_size=1, chunksize=7
+                )
+            outputs[pipelined] = {
+                file: pd.read_csv(dir_out / file, dtype=str) for file in sorted(os.listdir(dir_out))
+            }
+
+        assert len(outputs[True]) == 9
+        assert list(outputs[True]) == list(outputs[False])
+        for file, df in outputs[True].items():
+            assert df.equals(outputs[False][file])
+        assert sum(len(df) for df in outputs[True].values()) == 40
+
+    def test_filter_open_payments_zip_to_gzip(self, tmp_path):
+        ref_path = "data/reference/ProstateDrugList.csv"
+        test_data = pd.DataFrame({
+            "name_of_drug_or_biological_or_device_or_medical_supply_1": ["Lynparza", "drug1", "Xtandi"],
+            "other_column": ["1", "2", "3"],
+        })
+        zip_path = tmp_path / "PGYR2022_P01302025.zip"
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr("OP_DTL_GNRL_PGYR2022_P01302025.csv", test_data.to_csv(index=False))
+        op_path = f"{zip_path}/OP_DTL_GNRL_PGYR2022_P01302025.csv"
+
+        dir_out = tmp_path / "chunks"
+        dir_out.mkdir()
+        filter_open_payments(2022, "general", ref_path, op_path, f"{dir_out}/", compression="gzip")
+        assert os.listdir(dir_out) == ["general_2022_chunk_0.csv.gz"]
+        result = pd.read_csv(dir_out / "general_2022_chunk_0.csv.gz", dtype=str)
+        assert result["other_column"].to_list() == ["1", "3"]
+
+        # byte offsets need the extracted file
+        with pytest.raises(ValueError):
+            filter_open_payments(
+                2022, "general", ref_path, op_path, f"{dir_out}/", offsets_index_path=tmp_path / "index.npz"
+                )
+
+    def test_filter_open_payments_replaces_previous_chunks(self, tmp_path):
+        ref_path = "data/reference/ProstateDrugList.csv"
+        op_path = tmp_path / "raw.csv"
+        pd.DataFrame({
+            "name_of_drug_or_biological_or_device_or_medical_supply_1": ["Lynparza", "drug1", "Xtandi"] * 4,
+            "other_column": [str(i) for i in range(12)],
+        }).to_csv(op_path, index=False)
+        dir_out = tmp_path / "chunks"
+        dir_out.mkdir()
+        (dir_out / "general_2021_chunk_0.csv").write_text("other year\n")
+
+        filter_open_payments(2022, "general", ref_path, op_path, f"{dir_out}/", chunksize=2, compression="gzip")
+        assert len(os.listdir(dir_out)) == 7
+        # another compression and chunk size: only the new chunks are left
+        filter_open_payments(2022, "general", ref_path, op_path, f"{dir_out}/", chunksize=5)
+        assert sorted(os.listdir(dir_out)) == [
+            "general_2021_chunk_0.csv", "general_2022_chunk_0.csv", "general_2022_chunk_1.csv",
+            "general_2022_chunk_2.csv",
+        ]
+        (dir_out / "general_2021_chunk_0.csv").unlink()
+        concatenate_chunks(dir_out, tmp_path / "filtered.csv")
+        result = pd.read_csv(tmp_path / "filtered.csv", dtype=str)
+        assert result["other_column"].to_list() == ["0", "2", "3", "5", "6", "8", "9", "11"]
+
+    def test_filter_open_payments_fuzzy(self, tmp_path):
+        ref_path = "data/reference/ProstateDrugList.csv"
+        test_data = pd.DataFrame({
+            "name_of_drug_or_biological_or_device_or_medical_supply_1": [
+                "Xtandii", "Keytruda", "abiraterone acetate", "", "Lupkynis"
+            ],
+            "name_of_drug_or_biological_or_device_or_medical_supply_2": ["", "", "", "Lupron Depot-Ped", ""],
+            "other_column": ["1", "2", "3", "4", "5"],
+        })
+        op_path = tmp_path / "test_filter_op_file.csv"
+        test_data.to_csv(op_path, index=False)
+
+        dir_out = tmp_path / "chunks"
+        dir_out.mkdir()
+        filter_open_payments(2022, "general", ref_path, op_path, f"{dir_out}/")
+        assert os.listdir(dir_out) == []
+        filter_open_payments(
+            2022, "general", ref_path, op_path, f"{dir_out}/", fuzzy=True, review_path=tmp_path / "review.csv"
+            )
+        result = pd.read_csv(dir_out / "general_2022_chunk_0.csv", dtype=str)
+        assert result["other_column"].to_list() == ["1", "3", "4"]
+        review = pd.read_csv(tmp_path / "review.csv")
+        assert set(review["Raw_Drug_Name"]) == {"Xtandii", "abiraterone acetate", "Lupron Depot-Ped"}
+
+
+def test_find_fuzzy_matches_op_keeps_exact_matches():
+    chunk = pd.DataFrame({
+        "drug_1": ["KEYTRUDA", "Xtandi", "drug1"],
+        "drug_2": ["LYNPARZA", "", None],
+    })
+    matcher = FuzzyDrugMatcher(["keytruda", "lynparza", "xtandi"])
+    result = find_fuzzy_matches_op(chunk, ["drug_1", "drug_2"], matcher)
+    expected = find_matches_op(chunk, ["drug_1", "drug_2"], ["keytruda", "lynparza", "xtandi"])
+    assert result.equals(expected)
+
+
+def make_drug_list(path, generic_names, brand_names):
+    pd.DataFrame({
+        'Generic_name': generic_names,
+        'Color': ['yellow'] * len(generic_names),
+        'Brand_name1': brand_names,
+    }).to_csv(path, index=False)
+    return path
+
+
+class TestMultiListFilter():
+    def make_lists(self, tmp_path):
+        return {
+            "prostate": "data/reference/ProstateDrugList.csv",
+            "breast": make_drug_list(tmp_path / "BreastDrugList.csv", ['Olaparib PO', 'Tamoxifen PO'], ['Lynparza', 'Soltamox']),
+            "lung": make_drug_list(tmp_path / "LungDrugList.csv", ['Osimertinib PO', 'Docetaxel IV'], ['Tagrisso', 'Taxotere']),
+        }
+
+    def test_build_multi_list_lookup(self, tmp_path):
+        name2lists = build_multi_list_lookup(self.make_lists(tmp_path))
+        assert name2lists['lynparza'] == ('prostate', 'breast')
+        assert name2lists['tamoxifen'] == ('breast',)
+        assert name2lists['taxotere'] == ('prostate', 'lung')
+        assert 'keytruda' not in name2lists
+
+    def test_find_matches_op_multi(self, tmp_path):
+        ref_paths = self.make_lists(tmp_path)
+        chunk = pd.DataFrame({
+            "drug_1": ["Lynparza", "Soltamox", "Xtandi", "aspirin", None],
+            "drug_2": ["", "Tagrisso", "", "", "Taxotere"],
+        })
+        result = find_matches_op_multi(chunk, ["drug_1", "drug_2"], build_multi_list_lookup(ref_paths), list(ref_paths))
+        assert result["prostate"].index.to_list() == [0, 2, 4]
+        assert result["breast"].index.to_list() == [0, 1]
+        assert result["lung"].index.to_list() == [1, 4]
+        # same rows as a separate exact-match pass per list
+        for list_id, ref_path in ref_paths.items():
+            expected = find_matches_op(chunk, ["drug_1", "drug_2"], get_ref_drug_names(ref_path))
+            assert result[list_id].equals(expected)
+
+    def test_filter_open_payments_multi(self, tmp_path):
+        ref_paths = self.make_lists(tmp_path)
+        test_data = pd.DataFrame({
+            "name_of_drug_or_biological_or_device_or_medical_supply_1": ["Lynparza", "Soltamox", "Xtandi", "aspirin"] * 3,
+            "other_column": [str(i) for i in range(12)],
+        })
+        op_path = tmp_path / "test_filter_op_file.csv"
+        test_data.to_csv(op_path, index=False)
+        dirs_out = {}
+        for list_id in ref_paths:
+            (tmp_path / list_id).mkdir()
+            dirs_out[list_id] = f"{tmp_path / list_id}/"
+
+        counts = filter_open_payments_multi(2022, "general", ref_paths, op_path, dirs_out, chunksize=5, pipelined=True)
+        assert counts == {"prostate": 6, "breast": 6, "lung": 0}
+        assert sorted(os.listdir(tmp_path / "breast")) == [
+            "general_2022_chunk_0.csv", "general_2022_chunk_1.csv"
+        ]
+        assert os.listdir(tmp_path / "lung") == []
+        prostate = pd.concat(
+            pd.read_csv(tmp_path / "prostate" / file, dtype=str) for file in sorted(os.listdir(tmp_path / "prostate"))
+        )
+        assert prostate["other_column"].to_list() == ["0", "2", "4", "6", "8", "10"]
+
+    def test_filter_lists(self, tmp_path):
+        ref_paths = self.make_lists(tmp_path)
+        raw_dir = tmp_path / "raw"
+        (raw_dir / "general_payments").mkdir(parents=True)
+        pd.DataFrame({
+            "Name_of_Drug_or_Biological_or_Device_or_Medical_Supply_1": ["Lynparza", "Soltamox", "Xtandi", "aspirin"] * 3,
+            "other_column": [str(i) for i in range(12)],
+        }).to_csv(raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025.csv", index=False)
+        lists_dir = tmp_path / "lists"
+        # chunks of a previous run with a smaller chunk size must not be concatenated again
+        stale_dir = lists_dir / "breast" / "general_payments" / "2022_chunks"
+        stale_dir.mkdir(parents=True)
+        pd.DataFrame({"other_column": ["stale"]}).to_csv(stale_dir / "general_2022_chunk_7.csv", index=False)
+
+        counts = filter_lists(ref_paths, [2022], ["general"], f"{raw_dir}/", f"{lists_dir}/")
 
+        assert counts == {("prostate", "general", 2022): 6, ("breast", "general", 2022): 6, ("lung", "general", 2022): 0}
+        breast = pd.read_csv(lists_dir / "breast" / "general_payments" / "full_files" / "general_2022.csv", dtype=str)
+        assert breast["other_column"].to_list() == ["0", "1", "4", "5", "8", "9"]
+        assert not (lists_dir / "lung" / "general_payments" / "full_files" / "general_2022.csv").exists()
@@ -1,11 +1,15 @@
 import json
 import pandas as pd
+import pytest
 
 from src.filter_prescribers import (
     add_years_to_raw_prescriber_chunks,
     find_matches_prescribers,
     filter_prescribers_by_drug_names,
+    filter_full_prescriber_file,
+    filter_full_prescriber_files,
     get_final_npis,
+    get_part_d_year,
 )
 
 
@@ -177,3 +181,68 @@ def test_get_final_npis(tmp_path):
 
 
 
+
+
+def test_get_final_npis_quarantines_invalid_npis(tmp_path):
+    pd.DataFrame({
+        'Prscrbr_NPI': ['1234567893'] * 3 + ['1234567894'] * 3,
+        'Year': [2019, 2020, 2021] * 2,
+    }).to_csv(tmp_path / "prescribers.csv", index=False)
+
+    get_final_npis(
+        tmp_path / "prescribers.csv", tmp_path / "year2npis.json", invalid_npis_path=tmp_path / "invalid_npis.csv"
+        )
+
+    with open(tmp_path / "year2npis.json") as f:
+        assert json.load(f) == {"2022": ["1234567893"]}
+    assert len(pd.read_csv(tmp_path / "invalid_npis.csv")) == 3
+
+
+def make_full_part_d(path, npi_prefix="1"):
+    """Full national Part D file: all prescriber types, extra columns."""
+    pd.DataFrame({
+        'Prscrbr_NPI': [f"{npi_prefix}00{i}" for i in range(6)],
+        'Prscrbr_Last_Org_Name': ['A', 'B', 'C', 'D', 'E', 'F'],
+        'Prscrbr_Type': [
+            'Urology', 'Family Practice', 'Hematology/Oncology', 'Medical Oncology', 'Radiation Oncology', 'Urology'
+        ],
+        'Brnd_Name': ['Xtandi', 'Xtandi', 'Zytiga', 'Lipitor', 'Casodex', 'Erleada'],
+        'Gnrc_Name': ['Enzalutamide', 'Enzalutamide', 'Abiraterone Acetate', 'Atorvastatin', 'Bicalutamide', 'Apalutamide'],
+        'Tot_Clms': ['11', '12', '13', '14', '15', '16'],
+    }).to_csv(path, index=False)
+
+
+class TestFullPartDFiles():
+    def test_get_part_d_year(self):
+        assert get_part_d_year("data/raw/MUP_DPR_RY24_P04_V10_DY22_NPIBN.csv") == 2022
+        assert get_part_d_year("part_d_2019.csv.gz") == 2019
+        with pytest.raises(ValueError):
+            get_part_d_year("part_d.csv")
+
+    @pytest.mark.parametrize("chunksize", [2, 100])
+    def test_filter_full_prescriber_file(self, tmp_path, chunksize):
+        make_full_part_d(tmp_path / "full.csv")
+        n_kept = filter_full_prescriber_file(tmp_path / "full.csv", 2021, tmp_path / "out.csv", chunksize=chunksize)
+        result = pd.read_csv(tmp_path / "out.csv", dtype=str)
+        assert n_kept == 4
+        assert result.columns.tolist() == ['Prscrbr_NPI', 'Prscrbr_Type', 'Brnd_Name', 'Gnrc_Name', 'Year']
+        # Family Practice and non-target drugs are left out
+        assert result['Prscrbr_NPI'].tolist() == ['1000', '1002', '1004', '1005']
+        assert (result['Year'] == '2021').all()
+
+    def test_filter_full_prescriber_files(self, tmp_path):
+        make_full_part_d(tmp_path / "MUP_DPR_RY23_P04_V10_DY21_NPIBN.csv", npi_prefix="1")
+        make_full_part_d(tmp_path / "MUP_DPR_RY24_P04_V10_DY22_NPIBN.csv", npi_prefix="2")
+        dir_out = tmp_path / "out"
+        counts = filter_full_prescriber_files(
+            [tmp_path / "MUP_DPR_RY23_P04_V10_DY21_NPIBN.csv", tmp_path / "MUP_DPR_RY24_P04_V10_DY22_NPIBN.csv"],
+            f"{dir_out}/", max_workers=2,
+        )
+        assert counts == {2021: 4, 2022: 4}
+        result = pd.read_csv(dir_out / "prescribers_2022.csv", dtype=str)
+        assert result['Prscrbr_NPI'].str.startswith('2').all()
+        assert (result['Year'] == '2022').all()
+
+    def test_duplicate_years(self, tmp_path):
+        with pytest.raises(ValueError):
+            filter_full_prescriber_files(["a_DY22.csv", "b_DY22.csv"], f"{tmp_path}/")
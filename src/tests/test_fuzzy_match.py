@@ -0,0 +1,51 @@
+import pandas as pd
+
+from src.fuzzy_match import (
+    trigrams,
+    TrigramIndex,
+    FuzzyDrugMatcher,
+    REVIEW_COLS,
+)
+
+REF_NAMES = ['xtandi', 'lupron', 'abiraterone', 'leuprolide', 'taxotere', 'zytiga']
+
+
+def test_trigrams():
+    assert trigrams('xtandi') == {'$xt', 'xta', 'tan', 'and', 'ndi'}
+    assert trigrams('ab') == {'$ab'}
+
+
+def test_trigram_index_best_match():
+    index = TrigramIndex(REF_NAMES)
+    assert index.best_match('xtandii') == ('xtandi', 1.0)
+    assert index.best_match('abirateroneacetate') == ('abiraterone', 1.0)
+    name, score = index.best_match('taxol')
+    assert name == 'taxotere' and score < 0.75
+    # no shared trigrams, nothing is scored
+    assert index.best_match('keytruda') == (None, 0.0)
+
+
+def test_matcher_caches_decisions():
+    matcher = FuzzyDrugMatcher(REF_NAMES)
+    values = pd.Series(['Xtandii', 'Keytruda', None, '', 'Xtandii', 'Lupron Depot-Ped', 'ZYTIGA'])
+    assert matcher.match_mask(values).to_list() == [True, False, False, False, True, True, True]
+    # one decision per distinct string
+    assert set(matcher.decisions) == {'Xtandii', 'Keytruda', 'Lupron Depot-Ped', 'ZYTIGA'}
+    assert matcher.counts['Xtandii'] == 2
+    matcher.match_mask(pd.Series(['Xtandii']))
+    assert matcher.counts['Xtandii'] == 3
+
+
+def test_review_report(tmp_path):
+    matcher = FuzzyDrugMatcher(REF_NAMES, review_score=0.6)
+    matcher.match_mask(pd.Series(['Xtandii', 'Xtandii', 'Zytiga', 'Taxol', 'Keytruda']))
+    report = matcher.review_report()
+    assert report.columns.to_list() == REVIEW_COLS
+    # exact matches and low scores are left out
+    assert report['Raw_Drug_Name'].to_list() == ['Xtandii', 'Taxol']
+    assert report['Decision'].to_list() == ['accepted', 'rejected']
+    assert report['Count'].to_list() == [2, 1]
+
+    path = tmp_path / 'review.csv'
+    assert matcher.write_review_report(path) == 2
+    assert pd.read_csv(path)['Matched_Name'].to_list() == ['xtandi', 'taxotere']
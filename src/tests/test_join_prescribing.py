@@ -0,0 +1,104 @@
+import pandas as pd
+import pytest
+
+from src.join_prescribing import (
+    clean_npis,
+    partition_prescribers_by_year,
+    aggregate_prescribing,
+    aggregate_payments,
+    join_payments_prescribing,
+)
+
+
+def make_prescribers(tmp_path):
+    path = tmp_path / "prescribers_filtered_type_drug_names.csv"
+    pd.DataFrame({
+        'Prscrbr_NPI': ['111', '111', '111', '222', '333'],
+        'Prscrbr_Type': ['Urology'] * 5,
+        'Brnd_Name': ['Xtandi', 'Zytiga', 'Xtandi', 'Casodex', 'Erleada'],
+        'Gnrc_Name': ['Enzalutamide', 'Abiraterone Acetate', 'Enzalutamide', 'Bicalutamide', 'Apalutamide'],
+        'Tot_Clms': ['10', '5', '7', '3', '1'],
+        'Year': ['2022', '2022', '2023', '2022', '2023'],
+    }).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def final_files(write_final):
+    general = write_final(pd.DataFrame({
+        'Covered_Recipient_NPI': ['111', '111', '444', ''],
+        'Total_Amt_of_Payment_USDollars': ['10.5', '4.5', '20', '1'],
+    }), "general", 2022)
+    research = write_final(pd.DataFrame({
+        'Covered_Recipient_NPI': ['', '222'],
+        'PI_1_NPI': ['111', '222'],
+        'PI_2_NPI': ['222', ''],
+        'Total_Amt_of_Payment_USDollars': ['100', '50'],
+    }), "research", 2022)
+    general_2023 = write_final(pd.DataFrame({
+        'Covered_Recipient_NPI': ['333.0'],
+        'Total_Amt_of_Payment_USDollars': ['2'],
+    }), "general", 2023)
+    return [("general", 2022, general), ("research", 2022, research), ("general", 2023, general_2023)]
+
+
+def test_clean_npis():
+    result = clean_npis(pd.Series(['123.0', ' 456 ', None, '789']))
+    assert result.to_list() == ['123', '456', '', '789']
+
+
+def test_partition_and_aggregate_prescribing(tmp_path):
+    parts_dir = tmp_path / "parts"
+    parts_dir.mkdir()
+    year2path = partition_prescribers_by_year(make_prescribers(tmp_path), parts_dir, chunksize=2)
+    assert sorted(year2path) == [2022, 2023]
+    result = aggregate_prescribing(year2path[2022])
+    assert result.loc['111', 'Prescribing_Rows'] == 2
+    assert result.loc['111', 'Target_Drug_Count'] == 2
+    assert result.loc['111', 'Tot_Clms'] == 15
+    assert result.loc['222', 'Tot_Clms'] == 3
+
+
+def test_aggregate_payments_research(final_files):
+    _, (_, _, research), _ = final_files
+    result = aggregate_payments(research, "research", chunksize=1)
+    # 222 is on both records, and twice on the second one
+    assert result.loc['222', 'research_Payment_Total'] == 150
+    assert result.loc['222', 'research_Payment_Count'] == 2
+    assert result.loc['111', 'research_Payment_Total'] == 100
+
+
+def test_join_payments_prescribing(tmp_path, final_files):
+    fileout = tmp_path / "npi_year.csv"
+    n_rows = join_payments_prescribing(
+        make_prescribers(tmp_path), final_files, fileout, chunksize=2
+        )
+    result = pd.read_csv(fileout, dtype={'NPI': str})
+    assert n_rows == len(result) == 4
+    assert result.columns.to_list() == [
+        'Year', 'NPI',
+        'general_Payment_Total', 'general_Payment_Count',
+        'research_Payment_Total', 'research_Payment_Count',
+        'Prescribing_Rows', 'Target_Drug_Count', 'Tot_Clms',
+    ]
+    row = result[(result['Year'] == 2022) & (result['NPI'] == '111')].iloc[0]
+    assert row['general_Payment_Total'] == 15
+    assert row['research_Payment_Total'] == 100
+    assert row['Prescribing_Rows'] == 2
+    # paid but no prescribing
+    row = result[(result['Year'] == 2022) & (result['NPI'] == '444')].iloc[0]
+    assert row['Prescribing_Rows'] == 0
+    assert row['research_Payment_Count'] == 0
+    row = result[result['Year'] == 2023].iloc[0]
+    assert row['NPI'] == '333'
+    assert row['Tot_Clms'] == 1
+
+
+def test_join_payments_prescribing_outer(tmp_path, final_files):
+    fileout = tmp_path / "npi_year.csv"
+    join_payments_prescribing(make_prescribers(tmp_path), final_files[:1], fileout, how="outer")
+    result = pd.read_csv(fileout, dtype={'NPI': str})
+    # prescribers without payments are kept, including 2023 with no OP table
+    assert set(zip(result['Year'], result['NPI'])) == {
+        (2022, '111'), (2022, '222'), (2022, '444'), (2023, '111'), (2023, '333')
+    }
@@ -0,0 +1,120 @@
+import sqlite3
+
+import pandas as pd
+
+from src.match_cache import (
+    MatchCache,
+    get_ref_key,
+    clean_values,
+    contains_any,
+    MATCH_COLS,
+)
+
+
+def make_ref(path, color='yellow'):
+    pd.DataFrame({
+        'Generic_name': ['Olaparib PO', 'Leuprolide IM'],
+        'Color': [color, 'green'],
+        'Brand_name1': ['Lynparza', 'Lupron'],
+        'Brand_name2': ['', 'Eligard'],
+        'Brand_name3': ['', ''],
+        'Brand_name4': ['', ''],
+    }).to_csv(path, index=False)
+    return path
+
+
+def test_get_ref_key(tmp_path):
+    ref_path = make_ref(tmp_path / 'ref.csv')
+    key = get_ref_key(ref_path)
+    assert key.endswith(':v1')
+    assert get_ref_key(make_ref(tmp_path / 'ref.csv')) == key
+    assert get_ref_key(make_ref(tmp_path / 'ref.csv', color='green')) != key
+
+
+def test_match_aligned_with_values(tmp_path):
+    cache = MatchCache(make_ref(tmp_path / 'ref.csv'))
+    values = pd.Series(['LynpA-rza', None, 'aspirin', '', 'ELIGARD', 'LynpA-rza'], index=[5, 6, 7, 8, 9, 10])
+    result = cache.match(values)
+    assert result.columns.to_list() == MATCH_COLS
+    assert result.index.to_list() == [5, 6, 7, 8, 9, 10]
+    assert result['Cleaned'].to_list() == ['lynparza', '', 'aspirin', '', 'eligard', 'lynparza']
+    assert result['Generic_Name'].to_list()[::4] == ['olaparib', 'leuprolide']
+    assert result['Generic_Name'].isna().to_list() == [False, True, True, True, False, False]
+    assert result['Color'][9] == 'green'
+    assert sorted(cache.memory) == ['ELIGARD', 'LynpA-rza', 'aspirin']
+
+
+def test_persistent_cache_invalidates_on_ref_change(tmp_path):
+    ref_path = make_ref(tmp_path / 'ref.csv')
+    db_path = tmp_path / 'cache.sqlite'
+    with MatchCache(ref_path, db_path) as cache:
+        cache.lookup(['Lynparza', 'aspirin'])
+
+    with MatchCache(ref_path, db_path) as cache:
+        # served from SQLite, nothing recomputed
+        cache._decide = None
+        assert cache.lookup(['Lynparza'])['Lynparza'] == ('lynparza', 'olaparib', 'yellow')
+
+    make_ref(ref_path, color='green')
+    with MatchCache(ref_path, db_path) as cache:
+        assert cache.lookup(['Lynparza'])['Lynparza'] == ('lynparza', 'olaparib', 'green')
+    con = sqlite3.connect(db_path)
+    assert con.execute("SELECT COUNT(*), COUNT(DISTINCT ref_key) FROM matches").fetchone() == (1, 1)
+    con.close()
+
+
+def test_persistent_cache_keeps_other_lists(tmp_path):
+    prostate = make_ref(tmp_path / 'prostate.csv')
+    breast = make_ref(tmp_path / 'breast.csv', color='green')
+    db_path = tmp_path / 'cache.sqlite'
+    for ref_path in [prostate, breast, prostate]:
+        with MatchCache(ref_path, db_path) as cache:
+            cache.lookup(['Lynparza'])
+
+    # each list keeps its entries, opening another list doesn't evict them
+    with MatchCache(breast, db_path) as cache:
+        cache._decide = None
+        assert cache.lookup(['Lynparza'])['Lynparza'] == ('lynparza', 'olaparib', 'green')
+    make_ref(breast, color='yellow')
+    with MatchCache(breast, db_path):
+        pass
+    con = sqlite3.connect(db_path)
+    # only the older version of the edited list was dropped
+    assert con.execute("SELECT COUNT(*) FROM matches").fetchone() == (1,)
+    con.close()
+
+
+def test_persistent_cache_rebuilds_old_table(tmp_path):
+    db_path = tmp_path / 'cache.sqlite'
+    con = sqlite3.connect(db_path)
+    con.execute(
+        "CREATE TABLE matches (ref_key TEXT NOT NULL, raw TEXT NOT NULL, cleaned TEXT, generic_name TEXT, "
+        "color TEXT, PRIMARY KEY (ref_key, raw))"
+    )
+    con.commit()
+    con.close()
+    with MatchCache(make_ref(tmp_path / 'ref.csv'), db_path) as cache:
+        assert cache.lookup(['Lynparza'])['Lynparza'] == ('lynparza', 'olaparib', 'yellow')
+
+
+def test_clean_values_and_contains_any(tmp_path):
+    values = pd.Series(['Bicalutamide 50MG', 'aspirin', None, 'nan', 'bicalutamide 50mg'])
+    cleaned = clean_values(values)
+    assert cleaned.to_list() == ['bicalutamide50mg', 'aspirin', '', '', 'bicalutamide50mg']
+    cache = MatchCache(make_ref(tmp_path / 'ref.csv'))
+    assert clean_values(values, cache).to_list() == cleaned.to_list()
+    assert contains_any(cleaned, ['bicalutamide']).to_list() == [True, False, False, False, True]
+
+
+def test_fuzzy_decisions_cached_separately(tmp_path):
+    ref_path = make_ref(tmp_path / 'ref.csv')
+    db_path = tmp_path / 'cache.sqlite'
+    with MatchCache(ref_path, db_path, fuzzy=True) as cache:
+        assert cache.lookup(['Lynparzaa'])['Lynparzaa'] == ('lynparzaa', 'olaparib', 'yellow')
+
+    with MatchCache(ref_path, db_path) as cache:
+        # exact decisions don't see the fuzzy ones
+        assert cache.lookup(['Lynparzaa'])['Lynparzaa'] == ('lynparzaa', None, None)
+    with MatchCache(ref_path, db_path, fuzzy=True) as cache:
+        cache._decide = None
+        assert cache.lookup(['Lynparzaa'])['Lynparzaa'] == ('lynparzaa', 'olaparib', 'yellow')
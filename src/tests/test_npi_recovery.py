@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.npi_recovery import (
+    ProfileNpiIndex,
+    load_profile_npi_index,
+    recover_npis,
+)
+
+
+def make_providers():
+    return pd.DataFrame({
+        'Covered_Recipient_Profile_ID': ['30', '10', '20', '', '40', '10'],
+        'Covered_Recipient_NPI': ['3000000003', '1000000001', '2000000002.0', '9', '', '1111111111'],
+    })
+
+
+def test_profile_npi_index_lookup():
+    index = ProfileNpiIndex.from_frame(make_providers())
+    # rows without a profile ID or NPI are skipped, the first NPI of a profile is kept
+    assert index.profile_ids.tolist() == [10, 20, 30]
+    assert index.npis.tolist() == [1000000001, 2000000002, 3000000003]
+    result = index.lookup(['20', '10.0', '40', '', None, 'abc', '5', '99'])
+    assert result.tolist() == [2000000002, 1000000001, 0, 0, 0, 0, 0, 0]
+
+
+def test_profile_npi_index_empty():
+    index = ProfileNpiIndex.from_frame(pd.DataFrame({'id': [], 'npi': []}))
+    assert index.lookup(['1']).tolist() == [0]
+
+
+def test_load_profile_npi_index(tmp_path):
+    path = tmp_path / "providers_npis_ids.csv"
+    make_providers().to_csv(path, index=False)
+
+    index = load_profile_npi_index(path)
+    # prebuilt next to the csv, then memory-mapped
+    assert os.path.exists(f"{path}.npy")
+    assert load_profile_npi_index(path) is index
+    loaded = ProfileNpiIndex.load(f"{path}.npy")
+    assert isinstance(loaded.table, np.memmap)
+    assert loaded.lookup(['30']).tolist() == [3000000003]
+
+
+def test_profile_npi_index_save(tmp_path):
+    index = ProfileNpiIndex.from_frame(make_providers())
+    # saved under the exact name, moved into place: no temporary file left behind
+    index.save(tmp_path / "index.bin")
+    assert os.listdir(tmp_path) == ["index.bin"]
+    assert ProfileNpiIndex.load(tmp_path / "index.bin").lookup(['20']).tolist() == [2000000002]
+
+
+def test_recover_npis_research():
+    index = ProfileNpiIndex.from_frame(make_providers())
+    df = pd.DataFrame({
+        'Covered_Recipient_NPI': [np.nan, '5555555555', '', np.nan],
+        'Covered_Recipient_Profile_ID': ['10', '20', '30', '99'],
+        'PI_1_Profile_ID': ['20', np.nan, '', '30'],
+        'PI_1_NPI': ['', np.nan, np.nan, np.nan],
+        # PI_2_NPI is missing, as in 2014 files
+        'PI_2_Profile_ID': ['', '10', '', ''],
+    })
+
+    result, recovered = recover_npis(df, 'research', index)
+
+    # existing NPIs are kept
+    assert result['Covered_Recipient_NPI'].to_list()[:3] == ['1000000001', '5555555555', '3000000003']
+    assert pd.isna(result['Covered_Recipient_NPI'].iloc[3])
+    assert result['PI_1_NPI'].to_list()[::3] == ['2000000002', '3000000003']
+    assert result['PI_2_NPI'].iloc[1] == '1000000001'
+    assert recovered == {'Covered_Recipient_NPI': 2, 'PI_1_NPI': 2, 'PI_2_NPI': 1}
+    assert result.columns.to_list() == df.columns.to_list() + ['PI_2_NPI']
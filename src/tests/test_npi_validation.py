@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from src.npi_validation import (
+    is_valid_npi,
+    quarantine_invalid_npis,
+    NPI_COLS,
+)
+
+
+def luhn_npi(first_9):
+    """Reference implementation: Luhn check digit of "80840" + first_9."""
+    total = 0
+    for i, char in enumerate(reversed("80840" + first_9)):
+        digit = int(char) * (2 if i % 2 == 0 else 1)
+        total += digit - 9 if digit > 9 else digit
+    return first_9 + str((10 - total % 10) % 10)
+
+
+def test_is_valid_npi():
+    values = [
+        '1234567893', '1234567893.0', '1234567894', '123456789', '12345678930',
+        'abcdefghij', None, np.nan, '', '1234567893.5', ' 1234567893',
+    ]
+    assert is_valid_npi(values).tolist() == [True, True] + [False] * 9
+
+
+def test_is_valid_npi_matches_reference():
+    rng = np.random.default_rng(0)
+    npis = [luhn_npi(str(n)) for n in rng.integers(100_000_000, 1_000_000_000, 1000)]
+    assert is_valid_npi(pd.Series(npis)).all()
+    # any other check digit is wrong
+    wrong = [npi[:9] + str((int(npi[9]) + 1) % 10) for npi in npis]
+    assert not is_valid_npi(wrong).any()
+
+
+def test_quarantine_invalid_npis_research(tmp_path):
+    df = pd.DataFrame({
+        'Covered_Recipient_NPI': ['1234567893', '', '1234567894', '', np.nan],
+        'PI_1_NPI': ['', '1234567894', '1234567893', '999', ''],
+        'Record_ID': ['1', '2', '3', '4', '5'],
+    })
+    path = tmp_path / "invalid_npis.csv"
+    result = quarantine_invalid_npis(df, NPI_COLS["research"], path)
+    # row 3 keeps a valid NPI, rows 2 and 4 have none left
+    assert result['Record_ID'].to_list() == ['1', '3', '5']
+
+    quarantined = pd.read_csv(path, dtype=str)
+    assert quarantined['Record_ID'].to_list() == ['2', '3', '4']
+    assert quarantined['Invalid_NPI_Cols'].to_list() == ['PI_1_NPI', 'Covered_Recipient_NPI', 'PI_1_NPI']
+
+    # chunks append under one header
+    quarantine_invalid_npis(df.iloc[:2], NPI_COLS["research"], path, append=True)
+    assert pd.read_csv(path, dtype=str)['Record_ID'].to_list() == ['2', '3', '4', '2']
@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.partitioned_dataset import (
+    get_partition_dir,
+    harmonized_schema,
+    read_dataset,
+    read_manifest,
+    write_partition,
+)
+
+
+@pytest.fixture
+def path_to_cols(tmp_path):
+    # 2014 has no Covered_Recipient_NPI (added by NPI recovery) and an older-only column
+    pd.DataFrame({
+        '2016': ['Record_ID', 'Covered_Recipient_NPI', 'Total_Amount', 'Drug_Biological_Device_Med_Sup_1'],
+        '2014': ['Record_ID', 'Total_Amount', 'Old_Col', 'Drug_Biological_Device_Med_Sup_1'],
+    }).to_csv(tmp_path / "grace_cols.csv", index=False)
+    return tmp_path / "grace_cols.csv"
+
+
+def test_harmonized_schema(path_to_cols):
+    assert harmonized_schema(path_to_cols) == [
+        'Record_ID', 'Covered_Recipient_NPI', 'Total_Amount', 'Drug_Biological_Device_Med_Sup_1', 'Old_Col',
+        'Drug_Name', 'Prostate_Drug_Type', 'Onc_Prescriber',
+    ]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_write_and_read_partitions(tmp_path, path_to_cols, write_final, fmt):
+    root = tmp_path / "dataset"
+    final_2014 = write_final(pd.DataFrame({
+        'Record_ID': ['1', '2'], 'Total_Amount': ['10', '20'], 'Old_Col': ['a', 'b'],
+        'Drug_Biological_Device_Med_Sup_1': ['Xtandi', 'Zytiga'], 'Covered_Recipient_NPI': ['111', '222'],
+        'Drug_Name': ['enzalutamide', 'abiraterone'], 'Prostate_Drug_Type': ['1', '1'], 'Onc_Prescriber': ['1', '0'],
+    }), "general", 2014)
+    final_2016 = write_final(pd.DataFrame({
+        'Record_ID': ['3'], 'Covered_Recipient_NPI': ['333'], 'Total_Amount': ['30'],
+        'Drug_Biological_Device_Med_Sup_1': ['Lupron'],
+        'Drug_Name': ['leuprolide'], 'Prostate_Drug_Type': ['0'], 'Onc_Prescriber': [''],
+    }), "general", 2016)
+
+    assert write_partition(root, final_2014, "general", 2014, path_to_cols, fmt=fmt, chunksize=1) == 2
+    assert write_partition(root, final_2016, "general", 2016, path_to_cols, fmt=fmt) == 1
+
+    assert os.path.exists(os.path.join(get_partition_dir(root, "general", 2016), f"part-0.{fmt}"))
+    manifest = read_manifest(root)
+    assert manifest["format"] == fmt
+    assert [(entry["year"], entry["rows"], entry["missing_columns"]) for entry in manifest["partitions"]] == [
+        (2014, 2, []), (2016, 1, ['Old_Col']),
+    ]
+    assert manifest["partitions"][1]["path"] == f"dataset_type=general/year=2016/part-0.{fmt}"
+
+    # partition pruning and column projection
+    df = read_dataset(root, "general", years=[2016], columns=['Drug_Name', 'Record_ID'])
+    assert df.columns.to_list() == ['year', 'Drug_Name', 'Record_ID']
+    assert df.values.tolist() == [[2016, 'leuprolide', '3']]
+
+    # same columns in every year
+    df = read_dataset(root, "general")
+    assert df.columns.to_list() == ['year'] + manifest["schemas"]["general"]
+    assert df['year'].to_list() == [2014, 2014, 2016]
+    assert df['Old_Col'].isna().to_list() == [False, False, True]
+
+    # rewriting a partition replaces it
+    write_partition(root, final_2016, "general", 2016, path_to_cols, fmt=fmt)
+    assert len(read_dataset(root, "general", years=[2016])) == 1
+    assert len(read_manifest(root)["partitions"]) == 2
+
+    with pytest.raises(ValueError):
+        read_dataset(root, "general", columns=['Not_A_Col'])
+    with pytest.raises(ValueError):
+        read_dataset(root, "research")
+
+
+def test_write_partition_format_mismatch(tmp_path, path_to_cols, write_final):
+    final = write_final(pd.DataFrame({'Record_ID': ['1']}), "general", 2016)
+    write_partition(tmp_path / "dataset", final, "general", 2016, path_to_cols, fmt="csv")
+    with pytest.raises(ValueError):
+        write_partition(tmp_path / "dataset", final, "general", 2016, path_to_cols, fmt="parquet")
+
+
+def test_parquet_partitions_readable_by_pyarrow_dataset(tmp_path, path_to_cols, write_final):
+    ds = pytest.importorskip("pyarrow.dataset")
+    final = write_final(pd.DataFrame({'Record_ID': ['1', '2']}), "general", 2016)
+    write_partition(tmp_path / "dataset", final, "general", 2016, path_to_cols, fmt="parquet")
+    dataset = ds.dataset(tmp_path / "dataset", format="parquet", partitioning="hive", exclude_invalid_files=True)
+    table = dataset.to_table(columns=['Record_ID', 'year'], filter=ds.field('year') == 2016)
+    assert table.column('Record_ID').to_pylist() == ['1', '2']
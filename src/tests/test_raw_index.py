@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.filter_op import filter_open_payments
+from src.raw_index import (
+    iter_chunks_with_spans,
+    iter_record_spans,
+    get_header_length,
+    build_offsets_index,
+    load_offsets_index,
+    fetch_raw_records,
+)
+
+
+@pytest.fixture
+def raw_path(tmp_path):
+    # quoted newline in row 1 and a quoted comma in row 2
+    content = (
+        'Record_ID,name_of_drug_or_biological_or_device_or_medical_supply_1,Contextual_Information\n'
+        '100,Lynparza,plain\n'
+        '101,drug1,"two\nlines"\n'
+        '102,Xtandi,"a, ""quoted"" value"\n'
+        '103,tylenol,last'
+    )
+    path = tmp_path / "raw.csv"
+    path.write_bytes(content.encode('utf-8'))
+    return path
+
+
+def test_iter_record_spans(raw_path):
+    content = raw_path.read_bytes()
+    spans = list(iter_record_spans(raw_path))
+    assert len(spans) == 4
+    assert [content[o:o + n] for o, n in spans] == [
+        b'100,Lynparza,plain\n',
+        b'101,drug1,"two\nlines"\n',
+        b'102,Xtandi,"a, ""quoted"" value"\n',
+        b'103,tylenol,last',
+    ]
+
+
+def test_get_header_length(raw_path):
+    assert get_header_length(raw_path) == raw_path.read_bytes().index(b'\n') + 1
+
+
+def test_build_and_fetch(raw_path, tmp_path):
+    index_path = tmp_path / "raw_offsets.npz"
+    n = build_offsets_index(raw_path, [3, 1, 2], index_path, record_ids=['103', '101', '102'])
+    assert n == 3
+    index = load_offsets_index(index_path)
+    assert index['row'].tolist() == [1, 2, 3]
+
+    by_row = fetch_raw_records(raw_path, index_path, rows=[2, 1])
+    assert by_row.index.to_list() == [2, 1]
+    assert by_row['Contextual_Information'].to_list() == ['a, "quoted" value', 'two\nlines']
+
+    by_id = fetch_raw_records(raw_path, index_path, record_ids=['103'])
+    assert by_id['name_of_drug_or_biological_or_device_or_medical_supply_1'].to_list() == ['tylenol']
+
+    with pytest.raises(KeyError):
+        fetch_raw_records(raw_path, index_path, rows=[0])
+    with pytest.raises(KeyError):
+        fetch_raw_records(raw_path, index_path, record_ids=['999'])
+
+
+def test_index_path_without_npz_suffix(raw_path, tmp_path):
+    # the index is saved under the exact path given, so the same path loads it
+    index_path = tmp_path / "raw.offsets"
+    build_offsets_index(raw_path, [2], index_path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["raw.csv", "raw.offsets"]
+    assert load_offsets_index(index_path)['row'].tolist() == [2]
+    assert fetch_raw_records(raw_path, index_path, rows=[2])['Record_ID'].to_list() == ['102']
+
+
+def test_iter_chunks_with_spans(raw_path):
+    content = raw_path.read_bytes()
+    chunks = list(iter_chunks_with_spans(raw_path, chunksize=3))
+    assert [chunk.index.to_list() for chunk, _, _ in chunks] == [[0, 1, 2], [3]]
+    assert chunks[0][0]['Contextual_Information'].to_list() == ['plain', 'two\nlines', 'a, "quoted" value']
+    spans = [(o, n) for _, offsets, lengths in chunks for o, n in zip(offsets, lengths)]
+    assert spans == list(iter_record_spans(raw_path))
+    assert content[spans[3][0]:].decode() == '103,tylenol,last'
+
+
+def test_filter_open_payments_offsets_index(raw_path, tmp_path, monkeypatch):
+    dir_out = tmp_path / "chunks"
+    dir_out.mkdir()
+    index_path = tmp_path / "general_2022_offsets.npz"
+    # the spans are recorded while filtering: no second scan of the raw file
+    monkeypatch.setattr("src.raw_index.iter_record_spans", None)
+    filter_open_payments(
+        2022, "general", "data/reference/ProstateDrugList.csv", raw_path, f"{dir_out}/",
+        offsets_index_path=index_path, chunksize=2
+        )
+    monkeypatch.undo()
+    index = load_offsets_index(index_path)
+    assert index['row'].tolist() == [0, 2]
+    assert index['record_id'].tolist() == [b'100', b'102']
+    build_offsets_index(raw_path, [0, 2], tmp_path / "rescanned.npz", record_ids=['100', '102'])
+    rescanned = load_offsets_index(tmp_path / "rescanned.npz")
+    for key in index:
+        assert np.array_equal(index[key], rescanned[key]), key
+
+    result = fetch_raw_records(raw_path, index_path, record_ids=['102', '100'])
+    assert result['Record_ID'].to_list() == ['102', '100']
+    assert np.array_equal(result.index.to_numpy(), [2, 0])
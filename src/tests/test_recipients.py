@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from src.recipients import (
+    RECIPIENT_COLS,
+    melt_recipients,
+    rows_with_npi_in,
+)
+
+
+def make_research_rows():
+    return pd.DataFrame({
+        'Record_ID': ['10', '11', '12'],
+        'Covered_Recipient_NPI': ['123', np.nan, ''],
+        'Covered_Recipient_Profile_ID': ['1', np.nan, ''],
+        'PI_1_NPI': ['456', '789', np.nan],
+        'PI_1_Profile_ID': [np.nan, '2', np.nan],
+        'PI_2_NPI': [np.nan, np.nan, np.nan],
+        'PI_2_Profile_ID': [np.nan, '3', np.nan],
+    }, index=[7, 8, 9])
+
+
+def test_melt_recipients_research():
+    long = melt_recipients(make_research_rows(), 'research')
+    assert long.columns.to_list() == ['Row'] + RECIPIENT_COLS
+    assert long['Row'].to_list() == [0, 0, 1, 1]
+    assert long['Record_ID'].to_list() == ['10', '10', '11', '11']
+    assert long['Role'].to_list() == ['Covered_Recipient', 'PI_1', 'PI_1', 'PI_2']
+    assert long['NPI'].fillna('').to_list() == ['123', '456', '789', '']
+    assert long['Profile_ID'].fillna('').to_list() == ['1', '', '2', '3']
+
+
+def test_melt_recipients_general():
+    df = make_research_rows()
+    long = melt_recipients(df, 'general')
+    assert long['Role'].to_list() == ['Covered_Recipient']
+    # 2014 files have profile IDs but no NPI column
+    long = melt_recipients(df.drop(columns=['Covered_Recipient_NPI']), 'general')
+    assert long['NPI'].isna().all() and long['Profile_ID'].to_list() == ['1']
+
+
+def test_melt_recipients_empty():
+    long = melt_recipients(make_research_rows().iloc[:0], 'research')
+    assert long.empty and long.columns.to_list() == ['Row'] + RECIPIENT_COLS
+
+
+def test_rows_with_npi_in():
+    long = melt_recipients(make_research_rows(), 'research')
+    assert rows_with_npi_in(long, 3, {'789'}).tolist() == [False, True, False]
+    assert rows_with_npi_in(long, 3, {'456', '123'}).tolist() == [True, False, False]
+    assert not rows_with_npi_in(long, 3, set()).any()
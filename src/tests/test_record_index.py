@@ -0,0 +1,94 @@
+import gzip
+
+import pandas as pd
+import pytest
+
+from src.record_index import (
+    find_final_files,
+    build_record_index,
+    lookup_record,
+)
+
+
+@pytest.fixture
+def final_dir(tmp_path, write_final):
+    write_final(pd.DataFrame({
+        'Record_ID': ['1', '2', '3'],
+        'Contextual_Information': ['a', 'multi\nline', 'c'],
+        'Drug_Name': ['olaparib', 'docetaxel', 'goserelin'],
+    }), "general", 2022)
+    write_final(pd.DataFrame({
+        'Record_ID': ['4', '5'],
+        'Contextual_Information': ['d', 'e'],
+        'Drug_Name': ['rucaparib', 'olaparib'],
+    }), "general", 2023)
+    write_final(pd.DataFrame({
+        'Record_ID': ['9'],
+        'Drug_Name': ['xofigo'],
+    }), "research", 2016)
+    # not a final table
+    missing_dir = tmp_path / "final_files" / "general_payments" / "missing_npis"
+    missing_dir.mkdir()
+    pd.DataFrame({'Record_ID': ['7']}).to_csv(missing_dir / "general_2022_may8.csv", index=False)
+    return tmp_path / "final_files"
+
+
+def test_find_final_files(final_dir):
+    result = [(dataset_type, year) for dataset_type, year, _ in find_final_files(final_dir)]
+    assert result == [("general", 2022), ("general", 2023), ("research", 2016)]
+
+
+def test_build_record_index_and_lookup(tmp_path, final_dir):
+    index_path = tmp_path / "record_index.sqlite"
+    assert build_record_index(index_path, find_final_files(final_dir)) == 6
+
+    result = lookup_record(index_path, '2')
+    assert len(result) == 1
+    assert result['Contextual_Information'][0] == 'multi\nline'
+    assert result['Drug_Name'][0] == 'docetaxel'
+    assert result['dataset_type'][0] == 'general'
+    assert result['year'][0] == 2022
+
+    result = lookup_record(index_path, 9)
+    assert result['Drug_Name'].to_list() == ['xofigo']
+    assert result['dataset_type'][0] == 'research'
+
+    assert lookup_record(index_path, '404').empty
+
+
+def test_rebuild_record_index_replaces_entries(tmp_path, final_dir, write_final):
+    index_path = tmp_path / "record_index.sqlite"
+    build_record_index(index_path, find_final_files(final_dir))
+    # reprocess one year: rows shift, the index must follow
+    path = write_final(pd.DataFrame({
+        'Record_ID': ['6', '5'],
+        'Contextual_Information': ['new', 'moved'],
+        'Drug_Name': ['docetaxel', 'olaparib'],
+    }), "general", 2023)
+    build_record_index(index_path, [("general", 2023, path)])
+
+    assert lookup_record(index_path, '4').empty
+    result = lookup_record(index_path, '5')
+    assert len(result) == 1
+    assert result['Contextual_Information'][0] == 'moved'
+
+
+def test_record_index_rejects_misaligned_spans(tmp_path, final_dir, monkeypatch):
+    import src.record_index
+    path = final_dir / "general_payments" / "general_2022_may8.csv"
+    # one raw record fewer than parsed rows, e.g. a quoted newline split by the parser
+    spans = list(src.record_index.iter_record_spans(path))
+    monkeypatch.setattr(src.record_index, "iter_record_spans", lambda _: iter(spans[:-1]))
+
+    with pytest.raises(ValueError, match="parsed 3 rows but found 2 records"):
+        build_record_index(tmp_path / "record_index.sqlite", [("general", 2022, path)])
+
+
+def test_record_index_skips_compressed_tables(tmp_path, final_dir):
+    general_dir = final_dir / "general_payments"
+    with gzip.open(general_dir / "general_2021_may8.csv.gz", "wb") as f:
+        f.write((general_dir / "general_2023_may8.csv").read_bytes())
+    final_files = find_final_files(final_dir, compressed=True)
+    assert ("general", 2021, str(general_dir / "general_2021_may8.csv.gz")) in final_files
+
+    assert build_record_index(tmp_path / "record_index.sqlite", final_files) == 6
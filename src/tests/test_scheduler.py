@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from src.filter_prescribers import FILTERED_PRESCRIBERS_PATH, INVALID_PRESCRIBER_NPIS_PATH
+from src.main import pipeline_stages
+from src.paths import YEAR2NPIS_PATH
+from src.scheduler import (
+    Stage,
+    critical_path,
+    get_dependencies,
+    run_stages,
+    topological_order,
+)
+
+
+def copy_file(path_in, path_out, suffix=""):
+    with open(path_in) as f_in, open(path_out, "w") as f_out:
+        f_out.write(f_in.read() + suffix)
+    return path_out
+
+
+def fail():
+    raise ValueError("boom")
+
+
+def make_chain(tmp_path):
+    """a.txt -> b.txt -> c.txt, and a.txt -> d.txt"""
+    if not (tmp_path / "a.txt").exists():
+        (tmp_path / "a.txt").write_text("a")
+    paths = {name: str(tmp_path / f"{name}.txt") for name in "abcd"}
+    return [
+        Stage("c", copy_file, args=(paths["b"], paths["c"], "c"), inputs=(paths["b"],), outputs=(paths["c"],)),
+        Stage("b", copy_file, args=(paths["a"], paths["b"], "b"), inputs=(paths["a"],), outputs=(paths["b"],)),
+        Stage("d", copy_file, args=(paths["a"], paths["d"], "d"), inputs=(paths["a"],), outputs=(paths["d"],)),
+    ]
+
+
+def test_dependencies_and_order(tmp_path):
+    stages = make_chain(tmp_path)
+    dependencies = get_dependencies(stages)
+    assert dependencies == {"c": ["b"], "b": [], "d": []}
+    assert topological_order(stages, dependencies) == ["b", "c", "d"]
+
+
+def test_cycle(tmp_path):
+    stages = [
+        Stage("x", copy_file, inputs=("y.txt",), outputs=("x.txt",)),
+        Stage("y", copy_file, inputs=("x.txt",), outputs=("y.txt",)),
+    ]
+    with pytest.raises(ValueError, match="cycle"):
+        topological_order(stages, get_dependencies(stages))
+
+
+def test_duplicate_outputs():
+    with pytest.raises(ValueError):
+        get_dependencies([Stage("x", copy_file, outputs=("a.txt",)), Stage("y", copy_file, outputs=("./a.txt",))])
+
+
+def test_critical_path():
+    dependencies = {"b": [], "c": ["b"], "d": [], "e": ["c", "d"]}
+    path, length = critical_path(["b", "c", "d", "e"], dependencies, {"b": 1.0, "c": 2.0, "d": 5.0, "e": 1.0})
+    assert path == ["d", "e"] and length == 6.0
+
+
+def test_run_stages_and_skip_up_to_date(tmp_path):
+    report, results = run_stages(make_chain(tmp_path), max_workers=2, report_path=tmp_path / "report.csv")
+    assert (tmp_path / "c.txt").read_text() == "abc"
+    assert report.set_index("stage")["status"].to_dict() == {"b": "ran", "c": "ran", "d": "ran"}
+    assert results["c"] == str(tmp_path / "c.txt")
+    assert report["on_critical_path"].any()
+    assert (tmp_path / "report.csv").exists()
+
+    report, _ = run_stages(make_chain(tmp_path))
+    assert set(report["status"]) == {"skipped"}
+
+    # a newer b.txt only reruns c
+    later = os.path.getmtime(tmp_path / "c.txt") + 10
+    os.utime(tmp_path / "b.txt", (later, later))
+    report, _ = run_stages(make_chain(tmp_path))
+    assert report.set_index("stage")["status"].to_dict() == {"b": "skipped", "c": "ran", "d": "skipped"}
+
+    report, _ = run_stages(make_chain(tmp_path), force=True)
+    assert set(report["status"]) == {"ran"}
+
+
+def test_run_stages_concurrently(tmp_path):
+    # each stage waits for the other: only passes if both run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    stages = [Stage(name, barrier.wait, outputs=(str(tmp_path / name),)) for name in ["x", "y"]]
+    report, _ = run_stages(stages, max_workers=2)
+    assert set(report["status"]) == {"ran"}
+
+
+def test_resources_serialize_stages(tmp_path):
+    intervals = {}
+
+    def record(name):
+        start = time.monotonic()
+        time.sleep(0.05)
+        intervals[name] = (start, time.monotonic())
+
+    stages = [
+        Stage(name, record, args=(name,), outputs=(str(tmp_path / name),), resources=("cubes",))
+        for name in ["x", "y"]
+    ]
+    run_stages(stages, max_workers=2)
+    (start_x, end_x), (start_y, end_y) = intervals["x"], intervals["y"]
+    assert end_x <= start_y or end_y <= start_x
+
+
+def test_failed_stage_blocks_dependents(tmp_path, caplog):
+    stages = make_chain(tmp_path)
+    stages[1] = Stage("b", fail, inputs=(str(tmp_path / "a.txt"),), outputs=(str(tmp_path / "b.txt"),))
+    with pytest.raises(RuntimeError, match="'b'"):
+        run_stages(stages, report_path=tmp_path / "report.csv")
+    assert (tmp_path / "d.txt").exists()
+    assert not (tmp_path / "c.txt").exists()
+    report = pd.read_csv(tmp_path / "report.csv")
+    assert report.set_index("stage")["status"].to_dict() == {"b": "failed", "c": "blocked", "d": "ran"}
+
+
+def test_missing_inputs(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        run_stages([Stage("x", copy_file, inputs=(str(tmp_path / "nope.txt"),), outputs=(str(tmp_path / "x"),))])
+
+
+def test_pipeline_stages(tmp_path):
+    raw_dir = tmp_path / "raw"
+    (raw_dir / "general_payments").mkdir(parents=True)
+    for year in [2021, 2022]:
+        (raw_dir / "general_payments" / f"OP_DTL_GNRL_PGYR{year}_P01302025.csv").write_text("Record_ID\n")
+
+    stages = pipeline_stages(
+        years=[2021, 2022], dataset_types=["general"], raw_dir=f"{raw_dir}/", compression="gzip",
+        cube_path="cubes.sqlite", prescribers=True, final_generics=True,
+    )
+    dependencies = get_dependencies(stages)
+
+    assert dependencies["npi_qualification"] == ["prescriber_ingest"]
+    assert dependencies["concatenate:general:2022"] == ["filter:general:2022"]
+    assert dependencies["clean:general:2022"] == ["concatenate:general:2022", "npi_qualification"]
+    assert dependencies["final_generics:general:2022"] == ["clean:general:2022"]
+    # filtering waits for nothing
+    assert dependencies["filter:general:2021"] == []
+    clean = {stage.name: stage for stage in stages}["clean:general:2021"]
+    assert clean.outputs == ("data/final_files/general_payments/general_2021_may8.csv.gz",)
+    assert clean.resources == ("cubes",)
+
+
+def test_pipeline_stages_validate_prescriber_npis(tmp_path):
+    raw_dir = tmp_path / "raw"
+    (raw_dir / "general_payments").mkdir(parents=True)
+    (raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025.csv").write_text("Record_ID\n")
+
+    for validate_npis in [False, True]:
+        stages = pipeline_stages(
+            years=[2022], dataset_types=["general"], raw_dir=f"{raw_dir}/", validate_npis=validate_npis,
+            prescribers=True,
+        )
+        qualification = {stage.name: stage for stage in stages}["npi_qualification"]
+        invalid_npis_path = INVALID_PRESCRIBER_NPIS_PATH if validate_npis else None
+        assert qualification.args == (FILTERED_PRESCRIBERS_PATH, YEAR2NPIS_PATH, invalid_npis_path)
+        assert qualification.outputs == (YEAR2NPIS_PATH,) + ((INVALID_PRESCRIBER_NPIS_PATH,) if validate_npis else ())
+
+
+def test_pipeline_stages_store(tmp_path):
+    raw_dir = tmp_path / "raw"
+    (raw_dir / "general_payments").mkdir(parents=True)
+    (raw_dir / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025.csv").write_text("Record_ID\n")
+
+    stages = pipeline_stages(years=[2022], dataset_types=["general"], raw_dir=f"{raw_dir}/", store_path="store.sqlite")
+    clean = {stage.name: stage for stage in stages}["clean:general:2022"]
+    assert clean.kwargs["store_path"] == "store.sqlite"
+    # clean stages loading into the shared store run one at a time
+    assert clean.resources == ("store",)
+
+
+def test_stamp_reruns_stage_with_new_arguments(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    paths = [str(tmp_path / name) for name in ["a.txt", "b.txt"]]
+
+    def stages(suffix):
+        return [Stage(
+            "b", copy_file, args=tuple(paths), kwargs={"suffix": suffix}, inputs=(paths[0],), outputs=(paths[1],),
+            stamp=str(tmp_path / "stamps" / "b.json"),
+        )]
+
+    assert run_stages(stages("b"))[0]["status"].to_list() == ["ran"]
+    assert run_stages(stages("b"))[0]["status"].to_list() == ["skipped"]
+    assert run_stages(stages("x"))[0]["status"].to_list() == ["ran"]
+    assert (tmp_path / "b.txt").read_text() == "ax"
+
+
+def test_pipeline_option_added_in_second_run(tmp_path, monkeypatch):
+    import src.main
+
+    def fake_filter(year, dataset_type, op_data_path, dir_out, **kwargs):
+        os.makedirs(dir_out, exist_ok=True)
+        copy_file(op_data_path, os.path.join(dir_out, "chunk_0.csv"))
+
+    def fake_concatenate(dir_out, filtered_op_file, dedup=False):
+        os.makedirs(os.path.dirname(filtered_op_file), exist_ok=True)
+        copy_file(os.path.join(dir_out, "chunk_0.csv"), filtered_op_file)
+
+    def fake_cleaner(file_to_clean, dataset_type, year, year2npis_path, typed=None, **kwargs):
+        fileout = src.main.get_final_path(dataset_type, year)
+        os.makedirs(os.path.dirname(fileout), exist_ok=True)
+        copy_file(file_to_clean, fileout)
+        if typed is not None:
+            copy_file(file_to_clean, fileout.replace(".csv", ".parquet"))
+
+    monkeypatch.setattr(src.main, "_filter_stage", fake_filter)
+    monkeypatch.setattr(src.main, "_concatenate_stage", fake_concatenate)
+    monkeypatch.setattr(src.main, "run_op_cleaner", fake_cleaner)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "raw" / "general_payments").mkdir(parents=True)
+    (tmp_path / "raw" / "general_payments" / "OP_DTL_GNRL_PGYR2022_P01302025.csv").write_text("Record_ID\n1\n")
+    (tmp_path / "data" / "reference" / "col_names" / "general_payments").mkdir(parents=True)
+    (tmp_path / "data" / "reference" / "ProstateDrugList.csv").write_text("Brand_Name\n")
+    (tmp_path / "data" / "reference" / "col_names" / "general_payments" / "grace_cols.csv").write_text("x\n")
+    (tmp_path / "year2npis.json").write_text("{}")
+
+    def run(**options):
+        stages = pipeline_stages(
+            years=[2022], dataset_types=["general"], raw_dir="raw/", year2npis_path="year2npis.json", **options
+        )
+        return run_stages(stages)[0].set_index("stage")["status"].to_dict()
+
+    assert set(run().values()) == {"ran"}
+    assert set(run().values()) == {"skipped"}
+    # only the clean stage has a new option: it reruns, writing the typed copy
+    assert run(typed="float") == {
+        "filter:general:2022": "skipped", "concatenate:general:2022": "skipped", "clean:general:2022": "ran",
+    }
+    assert (tmp_path / "data" / "final_files" / "general_payments" / "general_2022_may8.parquet").exists()
+    assert set(run(typed="float").values()) == {"skipped"}
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.typed_output import (
+    apply_typed_schema,
+    get_typed_path,
+    parse_amounts,
+    parse_dates,
+    typed_schema,
+    write_typed_table,
+)
+
+COLUMNS = [
+    'Record_ID', 'Total_Amt_of_Payment_USDollars', 'Date_of_Payment', 'Num_Payments_Included_Total_Amt',
+    'Program_Year', 'Payment_Publication_Date', 'Drug_Name',
+]
+
+
+def test_typed_schema():
+    assert typed_schema(COLUMNS) == {
+        'Total_Amt_of_Payment_USDollars': 'float64',
+        'Date_of_Payment': 'datetime64[ns]',
+        'Num_Payments_Included_Total_Amt': 'Int64',
+        'Program_Year': 'Int64',
+        'Payment_Publication_Date': 'datetime64[ns]',
+    }
+    assert typed_schema(COLUMNS, "cents")['Total_Amt_of_Payment_USDollars'] == 'cents'
+    with pytest.raises(ValueError):
+        typed_schema(COLUMNS, "decimal")
+
+
+def test_parse_dates():
+    cache = {}
+    values = pd.Series(['01/15/2020', '2020-01-16', np.nan, '01/15/2020', 'not a date'], index=[5, 6, 7, 8, 9])
+    result = parse_dates(values, cache)
+    assert result.dtype == 'datetime64[ns]'
+    assert result.index.to_list() == [5, 6, 7, 8, 9]
+    assert result.to_list()[:2] == [pd.Timestamp('2020-01-15'), pd.Timestamp('2020-01-16')]
+    assert result.isna().to_list() == [False, False, True, False, True]
+    # parsed once per distinct string, reused by later chunks
+    assert len(cache) == 3
+    cache['01/15/2020'] = np.datetime64('1999-01-01')
+    assert parse_dates(pd.Series(['01/15/2020']), cache).iloc[0] == pd.Timestamp('1999-01-01')
+
+
+def test_parse_amounts():
+    values = pd.Series(['10.10', '0.29', '', 'abc', '1234567.99'])
+    assert parse_amounts(values, "cents").to_list() == [1010, 29, pd.NA, pd.NA, 123456799]
+    floats = parse_amounts(values)
+    assert floats.dtype == 'float64' and floats.iloc[0] == 10.1
+
+
+def test_apply_typed_schema():
+    df = pd.DataFrame([['1', '10.5', '02/01/2021', '2', '2021', '06/30/2022', 'enzalutamide']], columns=COLUMNS)
+    typed = apply_typed_schema(df, typed_schema(COLUMNS))
+    assert typed.dtypes.astype(str).to_list() == [
+        'object', 'float64', 'datetime64[ns]', 'Int64', 'Int64', 'datetime64[ns]', 'object'
+    ]
+
+
+@pytest.mark.parametrize("amount_type", ["float", "cents"])
+def test_write_typed_table(tmp_path, amount_type):
+    pytest.importorskip("pyarrow")
+    pd.DataFrame([
+        ['1', '10.5', '02/01/2021', '2', '2021', '06/30/2022', 'enzalutamide'],
+        ['2', '', '02/01/2021', '', '2021', '', ''],
+        ['3', '3', '', '1', '2021', '06/30/2022', 'abiraterone'],
+    ], columns=COLUMNS).to_csv(tmp_path / "general_2021_may8.csv.gz", index=False)
+
+    path_out = write_typed_table(tmp_path / "general_2021_may8.csv.gz", amount_type=amount_type, chunksize=2)
+
+    assert path_out == str(tmp_path / "general_2021_may8.parquet")
+    result = pd.read_parquet(path_out)
+    assert result.columns.to_list() == COLUMNS
+    assert result['Date_of_Payment'].dtype == 'datetime64[ns]'
+    assert result['Date_of_Payment'].isna().to_list() == [False, False, True]
+    amounts = result['Total_Amt_of_Payment_USDollars']
+    if amount_type == "float":
+        assert amounts.iloc[0] == 10.5 and np.isnan(amounts.iloc[1])
+    else:
+        assert amounts.iloc[0] == 1050 and amounts.iloc[2] == 300
+    assert result['Num_Payments_Included_Total_Amt'].isna().to_list() == [False, True, False]
+
+
+def test_get_typed_path():
+    assert get_typed_path("data/final_files/general_payments/general_2020_may8.csv") == \
+        "data/final_files/general_payments/general_2020_may8.parquet"
+    assert get_typed_path("general_2020_may8.csv.zst") == "general_2020_may8.parquet"
@@ -2,11 +2,22 @@ import unittest
 import math
 import pandas as pd
 import numpy as np
+import pytest
 from src._utils import (
     clean_brand_name,
     clean_generic_name,
     concatenate_chunks,
+    CsvChunkWriter,
+    iter_csv_chunks,
+    prefetch,
+    read_csv,
+    read_csv_header,
+    resolve_csv_engine,
+    split_zip_path,
+    compressed_path,
+    open_csv_source,
 )
+import zipfile
 
 
 
@@ -161,6 +172,13 @@ class TestConcatenateChunks():
         })
         assert result.equals(expected)
 
+    def test_chunk_number_order(self, tmp_path):
+        (tmp_path / 'chunks').mkdir()
+        for i in [10, 2, 1]:
+            pd.DataFrame({'col1': [i]}).to_csv(tmp_path / 'chunks' / f'general_2022_chunk_{i}.csv', index=False)
+        concatenate_chunks(tmp_path / 'chunks', tmp_path / 'output.csv')
+        assert pd.read_csv(tmp_path / 'output.csv')['col1'].to_list() == [1, 2, 10]
+
     def test_single_chunk(self, tmp_path):
         # Test with just one file
         df = pd.DataFrame({'col1': [1, 2], 'col2': ['a', 'b']})
@@ -173,6 +191,156 @@ class TestConcatenateChunks():
         assert result.equals(df)
 
 
+class TestCsvReaders():
+    engines = ["c", pytest.param("pyarrow", marks=pytest.mark.skipif(
+        resolve_csv_engine("auto") != "pyarrow", reason="pyarrow not installed"))]
+
+    @pytest.fixture
+    def csv_path(self, tmp_path):
+        df = pd.DataFrame({
+            'Record_ID': ['1', '2', '3', '4', '5'],
+            'Drug': ['Xtandi', '', 'Café', 'Lupron', None],
+            'Amount': ['1.50', '2', '3', '4', '5'],
+        })
+        df.to_csv(tmp_path / 'data.csv', index=False, encoding='utf-8')
+        return tmp_path / 'data.csv'
+
+    def test_resolve_csv_engine(self):
+        assert resolve_csv_engine("c") == "c"
+        assert resolve_csv_engine("auto") in ("c", "pyarrow")
+        with pytest.raises(ValueError):
+            resolve_csv_engine("python")
+
+    def test_read_csv_header(self, csv_path):
+        assert read_csv_header(csv_path) == ['Record_ID', 'Drug', 'Amount']
+
+    @pytest.mark.parametrize("engine", engines)
+    def test_read_csv_strings(self, csv_path, engine):
+        df = read_csv(csv_path, engine=engine)
+        assert df['Record_ID'].to_list() == ['1', '2', '3', '4', '5']
+        assert df['Drug'][2] == 'Café'
+        # empty cells are missing values with both engines
+        assert df['Drug'].isna().to_list() == [False, True, False, False, True]
+
+    @pytest.mark.parametrize("engine", engines)
+    def test_read_csv_dtype_schema_and_usecols(self, csv_path, engine):
+        df = read_csv(csv_path, engine=engine, usecols=['Amount', 'Record_ID'], dtype={'Amount': 'float64'})
+        assert df.columns.to_list() == ['Record_ID', 'Amount']
+        assert df['Amount'].dtype == np.float64
+        assert df['Record_ID'].to_list() == ['1', '2', '3', '4', '5']
+
+    @pytest.mark.parametrize("engine", engines)
+    def test_iter_csv_chunks(self, csv_path, engine):
+        chunks = list(iter_csv_chunks(csv_path, chunksize=2, engine=engine))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        # row labels continue across chunks
+        assert [list(chunk.index) for chunk in chunks] == [[0, 1], [2, 3], [4]]
+        assert pd.concat(chunks)['Record_ID'].to_list() == ['1', '2', '3', '4', '5']
+
+    @pytest.mark.parametrize("engine", engines)
+    def test_quoted_newlines_across_blocks(self, tmp_path, engine, monkeypatch):
+        # small blocks, so quoted newlines fall on block boundaries as in the multi-GB OP files
+        monkeypatch.setattr("src._utils.ARROW_BLOCK_SIZE", 64)
+        df = pd.DataFrame({
+            'Record_ID': [str(i) for i in range(200)],
+            'Context': [f"line one\nline two of {i}" for i in range(200)],
+            'Drug': 'Xtandi',
+        })
+        df.to_csv(tmp_path / 'data.csv', index=False)
+
+        assert read_csv(tmp_path / 'data.csv', engine=engine).equals(df)
+        chunks = list(iter_csv_chunks(tmp_path / 'data.csv', chunksize=30, engine=engine))
+        assert pd.concat(chunks).equals(df)
+
+
+
+class TestPipelineHelpers():
+    def test_prefetch_order(self):
+        assert list(prefetch(iter(range(10)), maxsize=2)) == list(range(10))
+
+    def test_prefetch_reraises(self):
+        def failing():
+            yield 1
+            raise OSError("disk gone")
+        result = []
+        with pytest.raises(OSError, match="disk gone"):
+            for item in prefetch(failing()):
+                result.append(item)
+        assert result == [1]
+
+    def test_prefetch_consumer_stops_early(self):
+        # generator is closed before the producer finishes; must not hang
+        items = prefetch(iter(range(1000)), maxsize=1)
+        assert next(items) == 0
+        items.close()
+
+    def test_csv_chunk_writer(self, tmp_path):
+        writer = CsvChunkWriter(maxsize=1)
+        for i in range(3):
+            writer.write(pd.DataFrame({'col': [str(i)]}), tmp_path / f"chunk_{i}.csv")
+        writer.close()
+        for i in range(3):
+            assert pd.read_csv(tmp_path / f"chunk_{i}.csv", dtype=str)['col'].to_list() == [str(i)]
+
+    def test_csv_chunk_writer_reraises(self, tmp_path):
+        writer = CsvChunkWriter()
+        writer.write(pd.DataFrame({'col': ['a']}), tmp_path / "missing_dir" / "chunk.csv")
+        with pytest.raises(OSError):
+            writer.close()
+
+
+class TestCompressedCsv():
+    engines = TestCsvReaders.engines
+
+    @pytest.fixture
+    def zip_member(self, tmp_path):
+        df = pd.DataFrame({'Record_ID': [str(i) for i in range(10)], 'Drug': ['Xtandi', 'Café'] * 5})
+        zip_path = tmp_path / 'PGYR2022_P01302025.zip'
+        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr('OP_DTL_GNRL_PGYR2022_P01302025.csv', df.to_csv(index=False))
+            bundle.writestr('OP_PGYR2022_README_P01302025.txt', 'readme')
+        return f"{zip_path}/OP_DTL_GNRL_PGYR2022_P01302025.csv"
+
+    def test_split_zip_path(self, zip_member, tmp_path):
+        assert split_zip_path(zip_member) == (
+            f"{tmp_path}/PGYR2022_P01302025.zip", 'OP_DTL_GNRL_PGYR2022_P01302025.csv'
+            )
+        assert split_zip_path(tmp_path / 'data.csv') == (None, None)
+
+    @pytest.mark.parametrize("engine", engines)
+    def test_read_zip_member(self, zip_member, engine):
+        assert read_csv_header(zip_member) == ['Record_ID', 'Drug']
+        df = read_csv(zip_member, engine=engine)
+        assert df['Drug'].to_list() == ['Xtandi', 'Café'] * 5
+        chunks = list(iter_csv_chunks(zip_member, chunksize=4, engine=engine))
+        assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+        assert chunks[-1].index.to_list() == [8, 9]
+
+    def test_compressed_path(self):
+        assert compressed_path('a.csv') == 'a.csv'
+        assert compressed_path('a.csv', 'gzip') == 'a.csv.gz'
+        assert compressed_path('a.csv', 'zstd') == 'a.csv.zst'
+        with pytest.raises(ValueError):
+            compressed_path('a.csv', 'rar')
+
+    @pytest.mark.parametrize("compression", ["gzip", "zstd"])
+    def test_concatenate_compressed_chunks(self, tmp_path, compression):
+        if compression == "zstd":
+            pytest.importorskip("zstandard")
+        chunks_dir = tmp_path / 'chunks'
+        chunks_dir.mkdir()
+        df = pd.DataFrame({'Record_ID': ['1', '2', '3'], 'Drug': ['a', 'b', 'c']})
+        df.iloc[:2].to_csv(compressed_path(chunks_dir / 'chunk_0.csv', compression), index=False)
+        df.iloc[2:].to_csv(compressed_path(chunks_dir / 'chunk_1.csv', compression), index=False)
+        fileout = compressed_path(tmp_path / 'full.csv', compression)
+        concatenate_chunks(chunks_dir, fileout)
+
+        # one stream, one header; chunks are concatenated in listing order
+        with open_csv_source(fileout) as f:
+            lines = f.read().decode().splitlines()
+        assert lines[0] == 'Record_ID,Drug'
+        assert sorted(lines[1:]) == ['1,a', '2,b', '3,c']
+        assert read_csv(fileout).sort_values('Record_ID', ignore_index=True).equals(df)
 
 
 if __name__ == '__main__':
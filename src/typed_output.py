@@ -0,0 +1,158 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from src._utils import (
+    iter_csv_chunks,
+    read_csv_header,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed for typed output
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Date format of the OP files; ISO dates (YYYY-MM-DD) are also accepted
+DATE_FORMAT = "%m/%d/%Y"
+AMOUNT_TYPES = ("float", "cents")
+TYPED_EXTENSION = ".parquet"
+
+
+def typed_schema(columns, amount_type="float"):
+    """
+    Get the typed schema of a final table from its harmonized (grace_cols.csv)
+    column names:
+        *_USDollars (Total_Amt_of_Payment_USDollars): float64 dollars, or
+            Int64 cents with amount_type="cents"
+        Num_* (Num_Payments_Included_Total_Amt), *_Year (Program_Year): Int64
+        Date_* and *_Date (Date_of_Payment, Payment_Publication_Date): datetime64
+    Other columns stay strings.
+    Args:
+        columns (list): column names
+        amount_type (str): "float" or "cents"
+    Returns:
+        dict: column -> "float64", "cents", "Int64" or "datetime64[ns]", for typed columns only
+    """
+    if amount_type not in AMOUNT_TYPES:
+        raise ValueError(f"Unsupported amount_type '{amount_type}', expected one of {AMOUNT_TYPES}")
+    schema = {}
+    for col in columns:
+        if col.endswith("_USDollars"):
+            schema[col] = "float64" if amount_type == "float" else "cents"
+        elif col.startswith("Num_") or col.endswith("_Year"):
+            schema[col] = "Int64"
+        elif col.startswith("Date_") or col.endswith("_Date"):
+            schema[col] = "datetime64[ns]"
+    return schema
+
+
+def parse_dates(values, cache=None):
+    """
+    Parse date strings once per distinct string and map the results back to
+    every row: OP files have a few thousand distinct dates over millions of
+    rows. Unparseable strings become NaT.
+    Args:
+        values (pd.Series): date strings (NaN allowed)
+        cache (dict): string -> parsed date, shared across chunks; updated
+            with the strings parsed here
+    Returns:
+        pd.Series: datetime64[ns], same index
+    """
+    if cache is None:
+        cache = {}
+    codes, uniques = pd.factorize(values)
+    new = pd.Series([value for value in uniques if value not in cache], dtype=object)
+    if len(new):
+        parsed = pd.to_datetime(new, format=DATE_FORMAT, errors='coerce')
+        retry = parsed.isna()
+        if retry.any():
+            parsed[retry] = pd.to_datetime(new[retry], format='ISO8601', errors='coerce')
+        if parsed.isna().any():
+            logger.warning("Could not parse %s distinct dates, e.g. %s", parsed.isna().sum(), new[parsed.isna()].iloc[0])
+        cache.update(zip(new, parsed.to_numpy()))
+    # code -1 (missing) takes the last element
+    lookup = np.array([cache[value] for value in uniques] + [np.datetime64('NaT')], dtype='datetime64[ns]')
+    return pd.Series(lookup[codes], index=values.index, name=values.name)
+
+
+def parse_amounts(values, amount_type="float"):
+    """
+    Parse amount strings to float64 dollars, or to Int64 cents (exact for
+    amounts with up to 2 decimals). Unparseable strings become missing.
+    """
+    amounts = pd.to_numeric(values, errors='coerce')
+    if amount_type == "float":
+        return amounts.astype('float64')
+    return amounts.mul(100).round().astype('Int64')
+
+
+def apply_typed_schema(df, schema, date_cache=None):
+    """
+    Convert the typed columns of a final table (see typed_schema).
+    Args:
+        df (pd.DataFrame): final table rows, all strings
+        schema (dict): see typed_schema
+        date_cache (dict): see parse_dates
+    Returns:
+        pd.DataFrame: df with typed columns
+    """
+    converted = {}
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == "datetime64[ns]":
+            converted[col] = parse_dates(df[col], date_cache)
+        elif dtype in ("float64", "cents"):
+            converted[col] = parse_amounts(df[col], "float" if dtype == "float64" else "cents")
+        else:
+            converted[col] = pd.to_numeric(df[col], errors='coerce').round().astype(dtype)
+    return df.assign(**converted)
+
+
+def _arrow_schema(columns, schema):
+    types = {"float64": pa.float64(), "cents": pa.int64(), "Int64": pa.int64(), "datetime64[ns]": pa.timestamp("ns")}
+    return pa.schema([(col, types.get(schema.get(col), pa.string())) for col in columns])
+
+
+def get_typed_path(path):
+    """Path of the typed copy of a final table: same name, .parquet instead of .csv[.gz|.zst]."""
+    path = os.fspath(path)
+    base = path.split(".csv")[0] if ".csv" in os.path.basename(path) else os.path.splitext(path)[0]
+    return base + TYPED_EXTENSION
+
+
+def write_typed_table(path, path_out=None, amount_type="float", chunksize=200_000):
+    """
+    Write a typed copy of a final table to parquet, which keeps the dtypes
+    (float64/Int64 amounts, Int64 counts and years, datetime64 dates), so
+    consumers don't re-parse them. Dates are parsed once per distinct string
+    across the whole file.
+    Args:
+        path (str): final table written by clean_op_data
+        path_out (str): parquet file (default: see get_typed_path)
+        amount_type (str): "float" (dollars) or "cents" (exact Int64 cents)
+        chunksize (int): rows per chunk (one parquet row group per chunk)
+    Returns:
+        str: path_out
+    """
+    if pq is None:
+        raise ImportError("pyarrow is required for typed output")
+    path_out = path_out or get_typed_path(path)
+    columns = read_csv_header(path)
+    schema = typed_schema(columns, amount_type)
+    arrow_schema = _arrow_schema(columns, schema)
+    date_cache = {}
+    n_rows = 0
+    with pq.ParquetWriter(path_out, arrow_schema) as writer:
+        for chunk in iter_csv_chunks(path, chunksize=chunksize, header=columns):
+            chunk = apply_typed_schema(chunk, schema, date_cache)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=arrow_schema, preserve_index=False))
+            n_rows += len(chunk)
+    logger.info("Wrote %s typed rows to %s (%s distinct dates parsed)", n_rows, path_out, len(date_cache))
+    return path_out